@@ -0,0 +1,74 @@
+"""
+Local stand-in for the OpenRouter chat completions API.
+
+Answers /v1/chat/completions after a configurable latency and returns 429
+when more than --max-concurrency requests are in flight, like a provider
+under load. Supports streaming responses. Run standalone with:
+
+    python benchmarks/fake_openai.py --port 8765
+
+and point the bot at it with OPENROUTER_BASE_URL=http://127.0.0.1:8765/v1.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency: float = 0.2, max_concurrency: int = 16, tokens: int = 40) -> FastAPI:
+    app = FastAPI()
+    state = {"active": 0, "served": 0, "rejected": 0}
+    app.state.stats = state
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if state["active"] >= max_concurrency:
+            state["rejected"] += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit exceeded", "code": 429}},
+                status_code=429,
+                headers={"Retry-After": "1"},
+            )
+        state["active"] += 1
+        try:
+            await asyncio.sleep(latency)
+            state["served"] += 1
+            words = [f"word{i} " for i in range(tokens)]
+            created = int(time.time())
+            if body.get("stream"):
+                async def events():
+                    for word in words:
+                        chunk = {
+                            "id": "fake", "object": "chat.completion.chunk", "created": created,
+                            "model": body["model"],
+                            "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+                        }
+                        yield f"data: {json.dumps(chunk)}\n\n"
+                        await asyncio.sleep(latency / tokens)
+                    yield "data: [DONE]\n\n"
+                return StreamingResponse(events(), media_type="text/event-stream")
+            return {
+                "id": "fake", "object": "chat.completion", "created": created, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": tokens, "total_tokens": 100 + tokens},
+            }
+        finally:
+            state["active"] -= 1
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency, args.max_concurrency), host="127.0.0.1", port=args.port)
@@ -0,0 +1,76 @@
+"""
+Memory benchmark: bytes retained per stored message in message_history.
+
+Compares keeping whole telegram.Message objects (old behaviour) with keeping
+MessageRecord copies. Run from the repository root:
+
+    python benchmarks/history_memory.py [messages]
+"""
+import os
+import sys
+import gc
+import tracemalloc
+from collections import deque
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from telegram import Chat, Message, MessageEntity, User  # noqa: E402
+from utils.history import MessageRecord  # noqa: E402
+
+HISTORY_SIZE = 500
+
+
+def make_message(i: int, chat: Chat) -> Message:
+    """Build a message resembling a typical group message with a reply."""
+    user = User(id=1000 + i % 50, first_name=f"User{i % 50}", is_bot=False, username=f"user{i % 50}")
+    date = datetime.fromtimestamp(1_700_000_000 + i, tz=timezone.utc)
+    text = f"message number {i} with some ordinary chat text about the topic of the day"
+    reply = Message(
+        message_id=i - 1,
+        date=date,
+        chat=chat,
+        from_user=user,
+        text=f"previous message {i - 1}",
+    )
+    return Message(
+        message_id=i,
+        date=date,
+        chat=chat,
+        from_user=user,
+        text=text,
+        entities=(MessageEntity(type=MessageEntity.BOLD, offset=0, length=7),),
+        reply_to_message=reply,
+    )
+
+
+def measure(store_records: bool, count: int) -> int:
+    """Return bytes retained by a history holding `count` messages."""
+    chat = Chat(id=-100123, type=Chat.SUPERGROUP, title="bench")
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    history = deque(maxlen=count)
+    for i in range(1, count + 1):
+        msg = make_message(i, chat)
+        history.append(MessageRecord.from_message(msg) if store_records else msg)
+        del msg
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del history
+    return retained
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else HISTORY_SIZE
+    full = measure(store_records=False, count=count)
+    compact = measure(store_records=True, count=count)
+    print(f"messages stored:        {count}")
+    print(f"telegram.Message:       {full / count:10.1f} bytes/message")
+    print(f"MessageRecord:          {compact / count:10.1f} bytes/message")
+    print(f"reduction:              {full / compact:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Throughput benchmark for the on-disk history store.
+
+Measures how long append() blocks the caller (what the event loop pays per
+message) and how fast the writer thread drains the queue, first into an
+empty store and then into one where every chat already holds `retention`
+messages, so each write also trims. "every batch" trims each chat of a
+batch on every write (trim_slack=1, how the store used to work),
+"slack" uses the store's default trim_slack. Run from the repository
+root:
+
+    python benchmarks/history_store_throughput.py [messages] [chats] [retention]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from utils.config import HISTORY_RETENTION  # noqa: E402
+from utils.history import MessageRecord  # noqa: E402
+from utils.history_store import HistoryStore  # noqa: E402
+
+
+def prefill(db_file: str, chats: int, retention: int):
+    """Create a store where every chat already holds `retention` messages."""
+    HistoryStore(db_file=db_file).start()
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.executemany(
+            "INSERT INTO messages (chat_id, message_id, date, author, text) VALUES (?, ?, ?, ?, ?)",
+            ((str(-100 - i % chats), -1 - i, 0.0, "@old", "old message") for i in range(chats * retention)),
+        )
+    conn.close()
+
+
+def run(db_file: str, records: list, chats: int, retention: int, trim_slack=None):
+    store = HistoryStore(db_file=db_file, retention=retention, trim_slack=trim_slack)
+    store.start()
+    start = time.perf_counter()
+    for i, record in enumerate(records):
+        store.append(str(-100 - i % chats), record)
+    enqueue = time.perf_counter() - start
+    store.close(timeout=600)
+    total = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = store.load_recent("-100", 500)
+    warm = time.perf_counter() - start
+    conn = sqlite3.connect(db_file)
+    largest = conn.execute("SELECT MAX(n) FROM (SELECT COUNT(*) AS n FROM messages GROUP BY chat_id)").fetchone()[0]
+    conn.close()
+    return enqueue, total, warm, len(loaded), largest
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    retention = int(sys.argv[3]) if len(sys.argv) > 3 else HISTORY_RETENTION
+    records = [
+        MessageRecord(i, time.time(), f"@user{i % 50}", f"message number {i} with some text")
+        for i in range(count)
+    ]
+    print(f"messages: {count} across {chats} chats, retention {retention}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        full = os.path.join(tmp, "full.db")
+        started = time.perf_counter()
+        prefill(full, chats, retention)
+        print(f"prefilled {chats * retention} messages in {time.perf_counter() - started:.1f}s")
+
+        for name, filled, trim_slack in (("empty", False, None), ("full, every batch", True, 1),
+                                         ("full, slack", True, None)):
+            db_file = os.path.join(tmp, "history.db")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_file + suffix):
+                    os.remove(db_file + suffix)
+            if filled:
+                shutil.copyfile(full, db_file)
+            enqueue, total, warm, loaded, largest = run(db_file, records, chats, retention, trim_slack)
+            print(f"{name:18} append {enqueue / count * 1e6:6.2f} us/message  "
+                  f"durable {count / total:8.0f} messages/s  warm 500 {warm * 1e3:6.2f} ms ({loaded})  "
+                  f"largest chat {largest}")
+
+
+if __name__ == "__main__":
+    main()
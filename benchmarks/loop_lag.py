@@ -0,0 +1,69 @@
+"""
+Event loop lag while many large summary prompts are assembled at once.
+
+Formats, packs and cleans `requests` windows of `messages` messages
+concurrently, once inline on the event loop and once through the CPU
+offload pool, while LoopLagMonitor measures how late the loop wakes a
+sleeping task (what an update from another chat would wait). Run from the
+repository root:
+
+    python benchmarks/loop_lag.py [requests] [messages]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from utils.history import MessageRecord  # noqa: E402
+from utils.loop_monitor import LoopLagMonitor  # noqa: E402
+from utils.offload import run_cpu  # noqa: E402
+from models.llm import format_messages, remove_all_except_specified_tags, remove_tags_in_chunks  # noqa: E402
+from models.prompt_builder import pack_messages  # noqa: E402
+
+MODEL = "google/gemini-2.0-flash-001"
+
+
+def make_window(count: int):
+    return [
+        MessageRecord(i, 1700000000 + i, f"@user{i % 40}", f"Сообщение номер {i}, <i>немного</i> текста " * 4,
+                      reply_snippet="ответ на что-то" if i % 3 == 0 else None)
+        for i in range(count)
+    ]
+
+
+async def prepare(messages, offload: bool):
+    lines = await run_cpu(format_messages, messages, offload=offload)
+    packed = await run_cpu(pack_messages, lines, MODEL, 0, 8192, offload=offload)
+    if offload:
+        return await run_cpu(remove_tags_in_chunks, packed.text)
+    return remove_all_except_specified_tags(packed.text)
+
+
+async def run(requests: int, messages: int, offload: bool):
+    window = make_window(messages)
+    monitor = LoopLagMonitor(interval=0.005, window=100000)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(prepare(window, offload) for _ in range(requests)))
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.05)
+    monitor.stop()
+    return elapsed, monitor.get_stats()
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    print(f"{requests} concurrent windows of {messages} messages")
+    for offload in (False, True):
+        elapsed, lag = asyncio.run(run(requests, messages, offload))
+        print(f"{'offloaded' if offload else 'inline':>9}: {elapsed:6.2f}s total, loop lag avg {lag['avg'] * 1000:6.1f}ms "
+              f"p99 {lag['p99'] * 1000:6.1f}ms max {lag['max'] * 1000:6.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
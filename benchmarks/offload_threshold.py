@@ -0,0 +1,102 @@
+"""
+Where moving summary prompt assembly off the event loop starts to pay.
+
+Inline, get_chatgpt_summary formats a window, counts its tokens and packs
+it (or splits it into parts, for windows over the direct budget) in one
+event loop step: run_cpu(..., offload=False) does not yield in between.
+Offloaded, the same work runs in a worker thread, which still holds the
+GIL for up to sys.getswitchinterval() at a time, and every step pays a
+thread round trip. Offloading only shortens what other chats wait once
+the inline step is longer than the switch interval. This prints the
+inline cost of that step for windows of HISTORY_SIZE up to
+MAX_SUMMARY_MESSAGES messages, cold (first request for the window) and
+warm (lines and token estimates already cached), the thread round trip,
+and the window size where the cold step reaches the switch interval.
+Run from the repository root:
+
+    python benchmarks/offload_threshold.py [runs]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from utils.config import HISTORY_SIZE, MAX_SUMMARY_MESSAGES, SUMMARY_CHUNK_TOKENS  # noqa: E402
+from utils.offload import run_cpu  # noqa: E402
+from models import prompt_builder  # noqa: E402
+from models.llm import format_messages  # noqa: E402
+from models.prompt_builder import chunk_lines, count_tokens, pack_messages  # noqa: E402
+from search_index import make_messages  # noqa: E402
+
+MODEL = "google/gemini-2.0-flash-001"
+
+
+def assemble(messages, split: bool):
+    lines = format_messages(messages)
+    count_tokens(lines)
+    if split:
+        return chunk_lines(lines, SUMMARY_CHUNK_TOKENS)
+    return pack_messages(lines, MODEL, 0, 8192)
+
+
+def window(count: int, seed: int) -> list:
+    messages = make_messages(count, seed=seed)
+    for record in messages:
+        # As MessageRecord.from_message does at ingest
+        record._line = record.render()
+    return messages
+
+
+def cold(count: int, split: bool) -> float:
+    """Best of three assemblies of windows whose token estimates are not cached yet."""
+    samples = []
+    for seed in range(3):
+        messages = window(count, seed)
+        prompt_builder.truncate_line.cache_clear()
+        started = time.perf_counter()
+        assemble(messages, split)
+        samples.append(time.perf_counter() - started)
+    return min(samples)
+
+
+def warm(count: int, split: bool, runs: int) -> float:
+    messages = window(count, 0)
+    assemble(messages, split)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        assemble(messages, split)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+async def round_trip(runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await run_cpu(len, (), offload=True)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    switch = sys.getswitchinterval()
+    print(f"thread round trip {asyncio.run(round_trip(200)) * 1e6:.0f}us, GIL switch interval {switch * 1e3:.1f}ms")
+    sizes = sorted({size for size in (HISTORY_SIZE, 1000, 2000, 5000, MAX_SUMMARY_MESSAGES) if size <= MAX_SUMMARY_MESSAGES})
+    per_message = 0.0
+    for split in (False, True):
+        for size in sizes:
+            cold_time, warm_time = cold(size, split), warm(size, split, runs)
+            per_message = max(per_message, cold_time / size)
+            print(f"{'split' if split else 'pack':5} {size:6} messages: cold {cold_time * 1e3:6.2f}ms "
+                  f"({cold_time / size * 1e6:.2f}us per message), warm {warm_time * 1e3:6.2f}ms")
+    print(f"inline step reaches the switch interval at about {switch / per_message:.0f} messages")
+
+
+if __name__ == "__main__":
+    main()
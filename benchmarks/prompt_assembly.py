@@ -0,0 +1,118 @@
+"""
+Time and memory of assembling summary prompts from the in-memory history.
+
+Runs `requests` concurrent requests for the last `messages` messages of a
+full HISTORY_SIZE deque, the way handle_message and get_chatgpt_summary
+do: take the window, render the prompt lines, estimate tokens and pack
+the prompt. "copy+render" is the old path (copy the deque, render every
+line with string concatenation and estimate its tokens on every
+request), "cached" the current one (walk back from the newest message,
+reuse the lines rendered at ingest and their token estimates). Memory is the tracemalloc peak while all requests are in
+flight, without the finished prompts. Run from the repository root:
+
+    python benchmarks/prompt_assembly.py [requests] [messages]
+"""
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+from itertools import islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from utils.config import HISTORY_SIZE  # noqa: E402
+from utils.history import MessageRecord  # noqa: E402
+from models import prompt_builder  # noqa: E402
+from models.llm import format_messages  # noqa: E402
+from models.prompt_builder import count_tokens, pack_messages  # noqa: E402
+
+MODEL = "google/gemini-2.0-flash-001"
+
+
+def old_format_message(msg) -> str:
+    """Prompt line rendering as it was before lines were cached on the record."""
+    username = msg.author
+    if msg.forward_from:
+        username += f" forwarded from {msg.forward_from}"
+    text = ""
+    if hasattr(msg, "text") and msg.text:
+        text += msg.text
+    if hasattr(msg, "caption") and msg.caption:
+        text += f" Caption: {msg.caption}"
+    if msg.reply_snippet:
+        text += f" In response to '{msg.reply_snippet}'"
+    if text == "":
+        return ""
+    if username != "":
+        return f"{username}: {text}\n"
+    return text + "\n"
+
+
+def old_window(history: deque, n: int) -> list:
+    return list(history)[-n:]
+
+
+def new_window(history: deque, n: int) -> list:
+    window = list(islice(reversed(history), n))
+    window.reverse()
+    return window
+
+
+def make_history() -> deque:
+    history = deque(maxlen=HISTORY_SIZE)
+    for i in range(HISTORY_SIZE):
+        record = MessageRecord(i, 1700000000 + i, f"@user{i % 40}", f"Сообщение номер {i}, немного текста " * 3,
+                               caption="подпись" if i % 7 == 0 else None,
+                               forward_from="chat news" if i % 11 == 0 else None,
+                               reply_snippet="ответ на что-то" if i % 3 == 0 else None)
+        # As MessageRecord.from_message does at ingest
+        record._line = record.render()
+        history.append(record)
+    return history
+
+
+async def request(history: deque, n: int, cached: bool) -> int:
+    if cached:
+        messages = new_window(history, n)
+        await asyncio.sleep(0)
+        lines = format_messages(messages)
+    else:
+        messages = old_window(history, n)
+        await asyncio.sleep(0)
+        lines = [line for line in map(old_format_message, messages) if line]
+    await asyncio.sleep(0)
+    count_tokens(lines)
+    return len(pack_messages(lines, MODEL, 0, 8192).text)
+
+
+async def run(history: deque, requests: int, n: int, cached: bool) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(request(history, n, cached) for _ in range(requests)))
+    return time.perf_counter() - started
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    history = make_history()
+
+    old_lines = [line for line in map(old_format_message, old_window(history, messages)) if line]
+    assert old_lines == format_messages(new_window(history, messages)), "prompt lines differ"
+
+    cached_truncate = prompt_builder.truncate_line
+    for name, cached in (("copy+render", False), ("cached", True)):
+        prompt_builder.truncate_line = cached_truncate if cached else cached_truncate.__wrapped__
+        best = min(asyncio.run(run(history, requests, messages, cached)) for _ in range(3))
+        tracemalloc.start()
+        asyncio.run(run(history, requests, messages, cached))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:12} {requests} x {messages} messages: {best * 1e3:7.1f}ms "
+              f"({best / requests * 1e6:6.1f}us per request), peak {peak / 2 ** 20:6.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
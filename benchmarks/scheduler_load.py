@@ -0,0 +1,86 @@
+"""
+Load test for the LLM scheduler against the fake OpenAI server.
+
+Fires a burst of mixed-priority requests from many chats, once straight at
+the client and once through the scheduler, and reports 429s and wait times
+per priority. Run from the repository root:
+
+    python benchmarks/scheduler_load.py [requests] [chats]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+PORT = 8765
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+os.environ["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{PORT}/v1"
+
+import uvicorn  # noqa: E402
+from fake_openai import create_app  # noqa: E402
+from utils.config import MODEL_CAPABILITIES  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+from models.scheduler import LLMScheduler, PRIORITY_ERROR, PRIORITY_ASK, PRIORITY_SUMMARY  # noqa: E402
+
+MODEL = "fake/model"
+MODEL_CAPABILITIES[MODEL] = {"context_tokens": 32768, "max_output_tokens": 4096, "requests_per_minute": 60000}
+PRIORITIES = {PRIORITY_ERROR: "error", PRIORITY_ASK: "ask", PRIORITY_SUMMARY: "summary"}
+
+
+def start_server(app):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(requests: int, chats: int, scheduled: bool):
+    # A fresh client per run: the shared one is bound to the first event loop
+    client = AsyncOpenAI(api_key="fake", base_url=os.environ["OPENROUTER_BASE_URL"], max_retries=0)
+    scheduler = LLMScheduler(max_concurrency=12)
+    latencies = {p: [] for p in PRIORITIES}
+    failures = {}
+
+    async def one(i: int):
+        priority = (PRIORITY_ERROR, PRIORITY_ASK, PRIORITY_SUMMARY, PRIORITY_SUMMARY)[i % 4]
+        request = dict(model=MODEL, messages=[{"role": "user", "content": "hi"}], max_tokens=10)
+        start = time.perf_counter()
+        try:
+            if scheduled:
+                async with scheduler.slot(str(i % chats), MODEL, priority):
+                    await client.chat.completions.create(**request)
+            else:
+                await client.chat.completions.create(**request)
+            latencies[priority].append(time.perf_counter() - start)
+        except Exception as e:
+            failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{'scheduler' if scheduled else 'direct':>9}: {elapsed:6.2f}s total, failures {failures or 'none'}")
+    for priority, name in PRIORITIES.items():
+        values = sorted(latencies[priority])
+        if values:
+            p95 = values[int(len(values) * 0.95) - 1]
+            print(f"           {name:8} n={len(values):4}  mean {statistics.mean(values):6.2f}s  p95 {p95:6.2f}s")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    app = create_app(latency=0.2, max_concurrency=16)
+    start_server(app)
+    asyncio.run(run(requests, chats, scheduled=False))
+    asyncio.run(run(requests, chats, scheduled=True))
+    print(f"server: {app.state.stats['served']} served, {app.state.stats['rejected']} rejected with 429")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Build time and query latency of the per-chat search index.
+
+Indexes `messages` synthetic Russian/English chat messages in one ChatIndex,
+then times /search queries (ranked) and selector queries (time range,
+author and keyword filters), and appends past capacity to include
+eviction. Run from the repository root:
+
+    python benchmarks/search_index.py [messages] [queries]
+"""
+import os
+import random
+from itertools import accumulate
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from utils.chat_index import ChatIndex  # noqa: E402
+from utils.history import MessageRecord  # noqa: E402
+from utils.tokenizer import terms  # noqa: E402
+
+WORDS = (
+    "пицца пиццу пиццы вечером встреча встречу завтра сегодня работа работы проект проекта релиз релизе баг баги "
+    "сервер сервера деплой кот кота кошка собака погода дождь кофе обед ужин кино фильм игра игры музыка "
+    "pizza meeting meetings tomorrow release deploy server bug bugs coffee lunch movie game music weather rust "
+    "python docker kubernetes review merge branch test tests flaky build pipeline"
+).split()
+QUERIES = ["пицца", "встреча завтра", "release deploy server", "кот", "flaky tests pipeline", "kubernetes"]
+
+
+def make_vocabulary(size: int, rng: random.Random):
+    syllables = "ка ро ми на то ле за пе ду ви ba ko ri mu te lo sa ne".split()
+    return ["".join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(size)]
+
+
+def make_messages(count: int, vocabulary_size: int = 20000, seed: int = 1):
+    """Messages drawn from a Zipf-distributed vocabulary, with a topic word in about a third of them."""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    # Cumulative weights, so random.choices does not re-add them on every call
+    weights = list(accumulate(1 / (rank + 1) for rank in range(vocabulary_size)))
+    topic_weights = list(accumulate(1 / (rank + 1) for rank in range(len(WORDS))))
+    messages = []
+    for i in range(count):
+        words = rng.choices(vocabulary, cum_weights=weights, k=rng.randint(3, 20))
+        if rng.random() < 0.3:
+            words += rng.choices(WORDS, cum_weights=topic_weights, k=rng.randint(1, 2))
+            rng.shuffle(words)
+        messages.append(MessageRecord(i, 1700000000 + i * 5, f"@user{rng.randrange(200)}", " ".join(words)))
+    return messages
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def timed(func, runs: int):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    messages = make_messages(count + count // 10)
+    messages, later = messages[:count], messages[count:]
+
+    index = ChatIndex(capacity=count)
+    started = time.perf_counter()
+    for msg in messages:
+        index.append(msg)
+    elapsed = time.perf_counter() - started
+    print(f"build: {count} messages in {elapsed:.2f}s ({elapsed / count * 1e6:.1f}us per message), "
+          f"{len(index.words)} terms")
+
+    started = time.perf_counter()
+    for msg in later:
+        index.append(msg)
+    elapsed = time.perf_counter() - started
+    print(f"append with eviction: {elapsed / len(later) * 1e6:.1f}us per message")
+
+    for query in QUERIES:
+        query_terms = terms(query)
+        samples = timed(lambda: index.search(query_terms), runs)
+        print(f"search {query!r:28} p50 {percentile(samples, 0.5) * 1e6:7.1f}us  p99 {percentile(samples, 0.99) * 1e6:7.1f}us")
+
+    since = later[-1].date - 3 * 3600
+    selectors = {
+        "last 3h": dict(since=since),
+        "@user7": dict(author="@user7"),
+        "last 3h @user7 пицца": dict(since=since, author="@user7", words=terms("пицца")),
+        "kubernetes docker": dict(words=terms("kubernetes docker")),
+    }
+    for name, selector in selectors.items():
+        samples = timed(lambda: index.select(**selector), runs)
+        print(f"select {name!r:28} p50 {percentile(samples, 0.5) * 1e6:7.1f}us  p99 {percentile(samples, 0.99) * 1e6:7.1f}us  "
+              f"{len(index.select(**selector))} messages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Throughput of sharded mode as the number of worker processes grows.
+
+Routes synthetic group messages through the ShardRouter to real shard
+workers (the same handlers as production, without network access) and
+reports processed updates per second for each worker count. --cpu-ms adds
+a busy-loop handler to stand in for heavier per-message work. Scaling is
+bounded by the number of cores. Run from the repository root:
+
+    python benchmarks/shard_scaling.py [--count N] [--workers 1,2,4] [--cpu-ms MS]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC)
+
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:bench")
+os.environ["OPENROUTER_BASE_URL"] = "http://127.0.0.1:9/v1"
+
+
+def bench_worker(index, count, updates, ready, cpu_ms):
+    """Shard worker with getMe stubbed out and an optional CPU-bound handler."""
+    import main
+    from telegram import User
+    from telegram.ext import MessageHandler, filters
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bot_user = User(id=123456, is_bot=True, first_name="Bench", username="bench_bot")
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = bot_user
+        return bot_user
+
+    async def burn(update, context):
+        deadline = time.perf_counter() + cpu_ms / 1000
+        while time.perf_counter() < deadline:
+            pass
+
+    async def no_warmup():
+        pass
+
+    build_application = main.build_application
+    # Error phrase warming would call the LLM API
+    main.prepare_error_phrases = no_warmup
+
+    def build():
+        application = build_application()
+        type(application.bot).get_me = get_me
+        if cpu_ms:
+            application.add_handler(MessageHandler(filters.ALL, burn), group=1)
+        return application
+
+    main.build_application = build
+    main.worker_main(index, count, updates, ready)
+
+
+def synthetic_updates(count: int, chats: int = 200):
+    for i in range(count):
+        yield {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": 1700000000 + i,
+                "chat": {"id": -1000000000000 - i % chats, "type": "supergroup", "title": "Bench"},
+                "from": {"id": 1000 + i % 300, "is_bot": False, "first_name": "User", "username": f"user{i % 300}"},
+                "text": f"Benchmark message number {i} with some ordinary chat text in it",
+            },
+        }
+
+
+async def run(workers: int, updates, cpu_ms: float) -> float:
+    from handlers.shard_router import ShardRouter
+
+    router = ShardRouter(workers)
+    ready = [router.context.Event() for _ in range(workers)]
+    processes = [
+        router.context.Process(target=bench_worker, args=(i, workers, router.queues[i], ready[i], cpu_ms))
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for event in ready:
+        await asyncio.to_thread(event.wait)
+
+    started = time.perf_counter()
+    for data in updates:
+        await router.put(data)
+    router.close()
+    await asyncio.gather(*(asyncio.to_thread(process.join) for process in processes))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--cpu-ms", type=float, default=0.5)
+    args = parser.parse_args()
+
+    # Keep the config, channel and database files of the run out of the working tree
+    os.chdir(tempfile.mkdtemp())
+
+    updates = list(synthetic_updates(args.count))
+    print(f"{args.count} updates, {args.cpu_ms}ms extra CPU per update, {os.cpu_count()} CPUs")
+    baseline = None
+    for workers in (int(n) for n in args.workers.split(",")):
+        elapsed = asyncio.run(run(workers, updates, args.cpu_ms))
+        rate = args.count / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>2} workers: {rate:>8,.0f} updates/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Microbenchmark for local token estimation and prompt packing.
+
+Times estimate_tokens() and pack_messages() on 500-message windows of mixed
+Russian/English chat lines. Run from the repository root:
+
+    python benchmarks/token_estimator.py [windows]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from models.prompt_builder import estimate_tokens, pack_messages  # noqa: E402
+
+WINDOW = 500
+WORDS = [
+    "привет", "сегодня", "встреча", "кто", "идёт", "обед", "проект", "релиз", "баг", "исправил",
+    "hello", "deploy", "tomorrow", "meeting", "lunch", "fixed", "bug", "release", "review", "ok",
+]
+
+
+def make_window(rng: random.Random) -> list:
+    lines = []
+    for i in range(WINDOW):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 60)))
+        lines.append(f"@user{i % 20}: {text}\n")
+    return lines
+
+
+def main():
+    windows = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+    data = [make_window(rng) for _ in range(windows)]
+
+    start = time.perf_counter()
+    total_tokens = 0
+    for lines in data:
+        for line in lines:
+            total_tokens += estimate_tokens(line)
+    estimate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for lines in data:
+        pack_messages(lines, "meta-llama/llama-3.2-3b-instruct:free", 200, 15000)
+    pack_time = time.perf_counter() - start
+
+    print(f"windows:                   {windows} x {WINDOW} messages")
+    print(f"avg tokens per window:     {total_tokens / windows:10.0f}")
+    print(f"estimate_tokens per window:{estimate_time / windows * 1e3:10.3f} ms")
+    print(f"pack_messages per window:  {pack_time / windows * 1e3:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Embedding throughput and query latency of the /ask vector index.
+
+Embeds `messages` synthetic chat messages with the local embedder in
+batches, appends them to a flat VectorIndex and to an IVF one, then times
+queries on both and reports how many of the flat index's top 10 the IVF
+index finds (recall). Run from the repository root:
+
+    python benchmarks/vector_index.py [messages] [queries]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+
+from models.embeddings import LocalEmbedder  # noqa: E402
+from utils.config import EMBEDDING_BATCH_SIZE  # noqa: E402
+from utils.vector_index import VectorIndex  # noqa: E402
+from search_index import make_messages, percentile, timed  # noqa: E402
+
+TOP_K = 10
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    messages = make_messages(count)
+    texts = [msg.text for msg in messages]
+    embedder = LocalEmbedder()
+
+    started = time.perf_counter()
+    batches = [embedder.embed_batch(texts[i:i + EMBEDDING_BATCH_SIZE]) for i in range(0, count, EMBEDDING_BATCH_SIZE)]
+    elapsed = time.perf_counter() - started
+    print(f"embed: {count} messages in {elapsed:.2f}s ({elapsed / count * 1e6:.1f}us per message), "
+          f"batches of {EMBEDDING_BATCH_SIZE}, dim {embedder.dim}")
+
+    rng = random.Random(2)
+    queries = [embedder.embed_batch([" ".join(rng.sample(texts[rng.randrange(count)].split(), 2))])[0]
+               for _ in range(runs)]
+    queries = [query for query in queries if query.any()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        indexes = {
+            "flat": VectorIndex(os.path.join(directory, "flat"), embedder.name, capacity=count, ivf_min=count + 1),
+            "ivf": VectorIndex(os.path.join(directory, "ivf"), embedder.name, capacity=count, ivf_min=count // 2),
+        }
+        for name, index in indexes.items():
+            started = time.perf_counter()
+            for i, vectors in enumerate(batches):
+                index.add([msg.message_id for msg in messages[i * EMBEDDING_BATCH_SIZE:(i + 1) * EMBEDDING_BATCH_SIZE]],
+                          vectors)
+            elapsed = time.perf_counter() - started
+            print(f"add {name:4}: {elapsed:.2f}s in batches ({elapsed / count * 1e6:.1f}us per message)")
+
+        results = {}
+        for name, index in indexes.items():
+            found = []
+            samples = timed(lambda: found.append(index.search(queries[len(found) % len(queries)], TOP_K)), len(queries))
+            results[name] = found
+            print(f"search {name:4} k={TOP_K}  p50 {percentile(samples, 0.5) * 1e3:6.2f}ms  "
+                  f"p99 {percentile(samples, 0.99) * 1e3:6.2f}ms")
+
+        # Messages repeat words, so count a hit when the IVF result scores as well as the flat one
+        recall = np.mean([
+            sum(score >= exact[-1][1] - 1e-6 for _, score in approximate) / len(exact)
+            for exact, approximate in zip(results["flat"], results["ivf"]) if exact
+        ])
+        print(f"ivf recall@{TOP_K} against flat: {recall:.2f}")
+
+        started = time.perf_counter()
+        index = VectorIndex(os.path.join(directory, "ivf"), embedder.name, capacity=count, ivf_min=count // 2)
+        index.load()
+        print(f"reopen ivf: {time.perf_counter() - started:.2f}s for {len(index)} vectors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Replay harness for the webhook pipeline.
+
+Posts recorded updates (a JSONL file, one update per line, or synthetic
+group messages) to the webhook endpoint and reports accepted and
+processed updates per second. By default the FastAPI app and the real
+handlers run in this process on a local port; pass --url to post to a running bot instead.
+Run from the repository root:
+
+    python benchmarks/webhook_replay.py [--updates FILE] [--count N] [--concurrency C] [--url URL --secret S]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+PORT = 8766
+TMP = tempfile.mkdtemp()
+os.environ.setdefault("OPENAI_API_KEY", "fake")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:replay")
+os.environ["HISTORY_DB_FILE"] = os.path.join(TMP, "history.db")
+
+import uvicorn  # noqa: E402
+from telegram import User  # noqa: E402
+from utils.config import WEBHOOK_PATH  # noqa: E402
+
+
+def synthetic_updates(count: int, chats: int = 50):
+    for i in range(count):
+        chat_id = -1000000000000 - i % chats
+        yield {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": 1700000000 + i,
+                "chat": {"id": chat_id, "type": "supergroup", "title": "Replay"},
+                "from": {"id": 1000 + i % 200, "is_bot": False, "first_name": "User", "username": f"user{i % 200}"},
+                "text": f"Replayed message number {i} with some ordinary chat text in it",
+            },
+        }
+
+
+def load_updates(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def post_all(url: str, secret: str, updates, concurrency: int):
+    """POST every update over `concurrency` keep-alive connections.
+
+    A bare HTTP/1.1 client keeps the load generator cheap enough that the
+    server side is what gets measured.
+    """
+    target = urlsplit(url)
+    host, port = target.hostname, target.port or 80
+    statuses = {}
+    it = iter(updates)
+
+    async def sender():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for update in it:
+                body = json.dumps(update).encode()
+                writer.write(
+                    f"POST {target.path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                    f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                head = await reader.readuntil(b"\r\n\r\n")
+                status = int(head.split(b" ", 2)[1])
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(sender() for _ in range(concurrency)))
+    return statuses
+
+
+async def replay_local(updates, concurrency: int):
+    import main
+    from handlers.bot_handlers import active_channels
+    from handlers.webhook import update_pipeline
+    from utils.history_store import history_store
+
+    application = main.build_application()
+    bot_user = User(id=123456, is_bot=True, first_name="Replay", username="replay_bot")
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = bot_user
+        return bot_user
+
+    # No network: initialize() only needs getMe for the bot username
+    type(application.bot).get_me = get_me
+    await application.initialize()
+    active_channels.update(str(u["message"]["chat"]["id"]) for u in updates if "message" in u)
+    history_store.start()
+    update_pipeline.start(application)
+
+    # Serve on the same loop as the workers, the way run_bot does
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    server.install_signal_handlers = lambda: None
+    web_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    statuses = await post_all(f"http://127.0.0.1:{PORT}{WEBHOOK_PATH}", main.webhook_secret, updates, concurrency)
+    accepted_at = time.perf_counter()
+    await update_pipeline.stop()
+    finished = time.perf_counter()
+    server.should_exit = True
+    await web_task
+    history_store.close()
+    await application.shutdown()
+    return statuses, accepted_at - started, finished - started, update_pipeline.get_stats()
+
+
+async def replay_remote(updates, url: str, secret: str, concurrency: int):
+    started = time.perf_counter()
+    statuses = await post_all(url, secret, updates, concurrency)
+    elapsed = time.perf_counter() - started
+    return statuses, elapsed, None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--updates", help="JSONL file with recorded updates")
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--url", help="webhook URL of a running bot")
+    parser.add_argument("--secret", default="")
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else list(synthetic_updates(args.count))
+    if args.url:
+        statuses, posted, finished, stats = asyncio.run(replay_remote(updates, args.url, args.secret, args.concurrency))
+    else:
+        statuses, posted, finished, stats = asyncio.run(replay_local(updates, args.concurrency))
+
+    print(f"{len(updates)} updates, concurrency {args.concurrency}")
+    print(f"responses: {statuses}")
+    print(f"accepted: {statuses.get(200, 0) / posted:,.0f} updates/s")
+    if finished is not None:
+        print(f"processed: {stats['processed'] / finished:,.0f} updates/s "
+              f"(failed {stats['failed']}, rejected {stats['rejected']}, max queue depth {stats['max_depth']}, "
+              f"avg wait {stats['avg_wait'] * 1000:.2f}ms, avg handle {stats['avg_handle'] * 1000:.2f}ms)")
+
+
+if __name__ == "__main__":
+    main()
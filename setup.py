@@ -12,5 +12,7 @@ setup(
         "fastapi",
         "uvicorn",
         "requests",
+        "httpx",
+        "numpy",
     ],
 ) 
\ No newline at end of file
@@ -1,11 +1,29 @@
+import asyncio
+import html
 import logging
+from datetime import datetime
 from collections import deque
+from itertools import islice
+from typing import Optional
 from telegram import Update
 from telegram.ext import ContextTypes
+from models.scheduler import llm_scheduler
+from models.resilience import get_breaker_states
+from models.budget import budget_limits, daily_budget
 from models.llm import get_chatgpt_summary, get_error_message, change_model, CURRENT_MODEL, ERROR_MODEL, change_prompt, get_chatgpt_ask
-from utils.config import MODE, SUPPORTED_MODELS
+from utils.config import MODE, SUPPORTED_MODELS, HISTORY_SIZE, STREAM_RESPONSES, MAX_SUMMARY_MESSAGES
 from utils.channel_config import channel_config
+from utils.default_config import FALLBACK_MODELS
 from utils.stats import request_stats
+from utils.history import MessageRecord
+from utils.history_store import history_store
+from utils.chat_index import chat_indexes
+from utils.tokenizer import terms
+from models.retrieval import chat_retriever
+from handlers.streaming import StreamingReply
+from handlers.selectors import EmptyRangeError, parse_selector
+from handlers.webhook import update_pipeline
+from utils.loop_monitor import loop_monitor
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +31,39 @@ logger = logging.getLogger(__name__)
 message_history = {}
 # Store active channels
 active_channels = set()
+# Error contexts that do not depend on user input; their phrases are pre-generated at startup
+STATIC_ERROR_CONTEXTS = (
+    "Please specify model type (main/error) and model name",
+    "Number must be positive",
+    f"User is too greedy, must be less than {MAX_SUMMARY_MESSAGES}",
+    "Invalid number format",
+    "The time range is empty",
+    "No previous messages found",
+    "Wrong request, no question provided",
+    "Unauthorized status check attempt",
+)
+
+async def get_history(chat_id: str) -> deque:
+    """Return the history of a chat, warming it from the history store on first access."""
+    history = message_history.get(chat_id)
+    if history is None:
+        records = await asyncio.to_thread(history_store.load_recent, chat_id, HISTORY_SIZE)
+        history = message_history.setdefault(chat_id, deque(records, maxlen=HISTORY_SIZE))
+    return history
+
+async def get_window(chat_id: str, n: int) -> list:
+    """The last `n` messages of a chat, read from the history store when memory holds fewer."""
+    history = message_history[chat_id]
+    if n <= len(history):
+        # Walk back from the newest message instead of copying the whole deque
+        window = list(islice(reversed(history), n))
+        window.reverse()
+        return window
+    stored = await asyncio.to_thread(history_store.load_recent, chat_id, n)
+    # The newest messages may still be waiting for the history writer
+    last_id = stored[-1].message_id if stored else None
+    recent = [msg for msg in history if last_id is None or msg.message_id > last_id]
+    return (stored + recent)[-n:]
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
@@ -20,7 +71,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Initialize message history for this chat if it doesn't exist
     if chat_id not in message_history:
-        message_history[chat_id] = deque(maxlen=500)
+        message_history[chat_id] = deque(maxlen=HISTORY_SIZE)
     
     await update.message.reply_text(
         'Hi! I am a bot that can show you previous messages when tagged. Use @bot_username N to see last N messages.',
@@ -40,10 +91,18 @@ async def handle_model_command(update: Update, context: ContextTypes.DEFAULT_TYP
 <b>Current Settings for Channel {channel_id}:</b>
 Main Model: {config['main_model']}
 Error Model: {config['error_model']}
+Fallback Models: {', '.join(config.get('fallback_models', FALLBACK_MODELS))}
 Current Temperature: {config['temp_model']}
+Profile: {config.get('profile') or 'none'} (available: {', '.join(channel_config.profiles) or 'none'})
+Daily Budget: {config.get('daily_budget') or 'none'}
+Ask Context: {config.get('ask_context') or 'none'} messages
 <b>To change the model, use:</b>
 /model main model_name
 /model error model_name
+/model fallback model1,model2
+/model budget usd_per_day (0 for none)
+/model profile profile_name
+/model context N (chat messages sent with /ask, 0 for none)
 or /model temp new_temp
             '''
             ,
@@ -147,17 +206,22 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         logger.info(f"Received message from chat_id: {chat_id}")
         
-        # Initialize message history for this chat if it doesn't exist
-        if chat_id not in message_history:
-            message_history[chat_id] = deque(maxlen=500)
+        # Get message history for this chat, loading it from disk if needed
+        await get_history(chat_id)
         
-        # Store the current message
-        message_history[chat_id].append(update.message)
+        # Store a compact copy of the current message
+        record = MessageRecord.from_message(update.message)
+        message_history[chat_id].append(record)
+        
+        is_tag = update.message.text is not None and f"@{context.bot.username}" in update.message.text
+        if not is_tag:
+            history_store.append(chat_id, record)
+            chat_indexes.append(chat_id, record)
         
         if update.message.text == None: 
             return
         # Check if the bot is tagged in the message
-        if f"@{context.bot.username}" in update.message.text:
+        if is_tag:
             logger.info(f"Bot was tagged in message: {update.message.text}")
             # Delete the last message from chat history
             if chat_id in message_history and len(message_history[chat_id]) > 0:
@@ -165,41 +229,68 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.info(f"Deleted last message from chat history for chat_id: {chat_id}")
             
             try:
-                # Parse the number of messages to show
+                # Parse the number of messages to show, or a time/author/keyword selector
+                selector = None
+                # A bare mention summarizes the last message, as /help says
+                n = 1
                 try:
-                    # Split the message and get the number after the bot username
+                    # Split the message and parse what follows the bot username
                     parts = update.message.text.split()
                     if len(parts) > 1:
-                        n = int(parts[1])
+                        selector = parse_selector(parts[1:], ignore=f"@{context.bot.username}")
+                        n = selector.count if selector.count is not None else MAX_SUMMARY_MESSAGES
                         if n <= 0:
                             error_msg = await get_error_message("Number must be positive", chat_id)
                             await update.message.reply_text(error_msg, parse_mode='Markdown')
                             return
-                        if n > 500:
-                            error_msg = await get_error_message("User is too greedy, must be less than 500", chat_id)
+                        if n > MAX_SUMMARY_MESSAGES:
+                            error_msg = await get_error_message(f"User is too greedy, must be less than {MAX_SUMMARY_MESSAGES}", chat_id)
                             await update.message.reply_text(error_msg, parse_mode='Markdown')
                             return
                     else:
                         if n > len(message_history[chat_id]):
                             n = len(message_history[chat_id])-1
+                except EmptyRangeError:
+                    error_msg = await get_error_message("The time range is empty", chat_id)
+                    await update.message.reply_text(error_msg, parse_mode='Markdown')
+                    return
                 except ValueError:
                     error_msg = await get_error_message("Invalid number format", chat_id)
                     await update.message.reply_text(error_msg, parse_mode='Markdown')
                     return
 
-                # Get the last N messages
+                # Channels over their daily budget get a cheaper model and fewer messages
+                model, n, degraded = await budget_limits(chat_id, channel_config.get_channel_config(chat_id)["main_model"], n)
+                note = "\n<i>Daily budget reached, using a cheaper model and fewer messages</i>" if degraded else ""
+
+                # Get the last N messages, or the last N matching the selector
                 if len(message_history[chat_id]) > 0:
-                    m2 = list(message_history[chat_id])
-                    messages = m2[-n:]  # Get the last n messages
+                    selection = None
+                    if selector is not None and selector.filtered:
+                        index = await chat_indexes.get(chat_id, message_history[chat_id])
+                        messages = index.select(since=selector.since, until=selector.until, author=selector.author,
+                                                words=selector.words, phrases=selector.phrases, limit=n)
+                        header = f"Summary of {len(messages)} messages {html.escape(selector.describe())}"
+                        selection = selector.key()
+                    else:
+                        messages = await get_window(chat_id, n)  # Get the last n messages
+                        header = f"Summary of the last {len(messages)} messages"
                     if messages:
-                        # Get summary from ChatGPT using channel-specific configuration
-                        summary = await get_chatgpt_summary(messages, channel_id=chat_id)
-                        
-                        # Send the summary
-                        await update.message.reply_text(
-                            f"Summary of the last {len(messages)} messages:\n <blockquote expandable> {summary}</blockquote>",
-                           parse_mode='HTML'
-                        )
+                        render = lambda text: f"{header}:\n <blockquote expandable> {text}</blockquote>{note}"
+                        if STREAM_RESPONSES or len(messages) > HISTORY_SIZE:
+                            # Show progress and the summary while it is being generated
+                            reply = await StreamingReply.start(update.message, "⏳", render, parse_mode='HTML')
+                            summary = await get_chatgpt_summary(messages, model=model, channel_id=chat_id,
+                                                                on_update=reply.update if STREAM_RESPONSES else None,
+                                                                on_progress=reply.progress, selection=selection)
+                            await reply.finish(summary)
+                        else:
+                            # Get summary from ChatGPT using channel-specific configuration
+                            summary = await get_chatgpt_summary(messages, model=model, channel_id=chat_id,
+                                                                selection=selection)
+                            
+                            # Send the summary
+                            await update.message.reply_text(render(summary), parse_mode='HTML')
                         
                         # Also send the individual messages
                         if MODE == "debug":
@@ -234,10 +325,17 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 *Commands:*
 @FunnelReadsBot N \\- Show summary of last N messages \\(default: 1\\)
 Example: @FunnelReadsBot 5 \\- shows summary of last 5 messages
+@FunnelReadsBot last 3h, since 09:00 until 12:00, today \\- summary of a time range
+@FunnelReadsBot @alice \\- summary of one user's messages
+@FunnelReadsBot about:pizza or "pizza night" \\- summary of messages mentioning a word or phrase
+Filters combine: `@FunnelReadsBot today @alice about:pizza`
 
-/ask \\[question\\] \\- Ask a direct question to the AI
+/ask \\[question\\] \\- Ask a direct question to the AI, with related messages from this chat as context
 Example: `/ask дай мне рецепт пиццы`
 
+/search \\[words\\] \\- Find messages in the chat history
+Example: `/search пицца вечером`
+
 /prompt \\[main/error\\] \\[prompt\\] \\- Change the prompt
 Example: `/prompt@FunnelReadsBot error act as a nice guy \\- Заставить отвечать как хороший парень при`
 
@@ -247,7 +345,7 @@ Example: `/model@FunnelReadsBot main deepseek/deepseek-r1-distill-llama-70b`
 Find available models at: [OpenRouter Models](https://openrouter\\.ai/models)
 
 *Notes:*
-• Maximum message history: 500 messages
+• Maximum summary window: {max_messages} messages
 • Only admin can change models and prompts
 • Bot must be added to channels to work
 • In debug mode, bot only responds in special debug channel
@@ -258,11 +356,24 @@ Error Model: `{error_model}`
 
 For more information, contact the bot administrator @Fparadox\.""".format(
         main_model=CURRENT_MODEL.replace('.', '\\.'),
-        error_model=ERROR_MODEL.replace('.', '\\.')
+        error_model=ERROR_MODEL.replace('.', '\\.'),
+        max_messages=MAX_SUMMARY_MESSAGES
     )
     
     await update.message.reply_text(help_text, parse_mode='MarkdownV2')
 
+async def ask_context(chat_id: str, question: str, k: int, ask_message_id: int) -> list:
+    """Chat messages related to an /ask question; none if retrieval is off or fails."""
+    if k <= 0:
+        return []
+    try:
+        history = await get_history(chat_id)
+        recent = [record for record in history if record.message_id != ask_message_id]
+        return await chat_retriever.retrieve(chat_id, question, k, recent)
+    except Exception as e:
+        logger.error(f"Error retrieving /ask context for chat {chat_id}: {str(e)}")
+        return []
+
 async def handle_ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /ask command to make direct requests to the model."""
     if not context.args:
@@ -283,15 +394,72 @@ async def handle_ask_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text(error_msg, parse_mode='Markdown')
             return
 
-        # Get response using channel-specific configuration
-        response = await get_chatgpt_ask(question, channel_id=str(update.message.chat_id))
-        await update.message.reply_text(response, parse_mode='Markdown')
+        # Get response using channel-specific configuration, on a cheaper model once over budget
+        channel_id = str(update.message.chat_id)
+        config = channel_config.get_channel_config(channel_id)
+        model, _, _ = await budget_limits(channel_id, config["main_model"])
+        context_messages = await ask_context(channel_id, question, config.get("ask_context") or 0, update.message.message_id)
+        if STREAM_RESPONSES:
+            reply = await StreamingReply.start(update.message, "⏳", lambda text: text, parse_mode='Markdown')
+            response = await get_chatgpt_ask(question, model=model, channel_id=channel_id, on_update=reply.update,
+                                              context=context_messages)
+            await reply.finish(response)
+        else:
+            response = await get_chatgpt_ask(question, model=model, channel_id=channel_id, context=context_messages)
+            await update.message.reply_text(response, parse_mode='Markdown')
         
     except Exception as e:
         logger.error(f"Error processing ask command: {str(e)}")
         error_msg = await get_error_message(f"Error processing request: {str(e)}", str(update.message.chat_id))
         await update.message.reply_text(error_msg, parse_mode='Markdown')
 
+# Results shown by /search, and characters of each message shown
+SEARCH_RESULTS = 10
+SEARCH_SNIPPET_LENGTH = 150
+
+def message_link(chat_id: str, message_id: int) -> Optional[str]:
+    """Link to a message in a supergroup or channel; other chats have no public message links."""
+    if chat_id.startswith("-100"):
+        return f"https://t.me/c/{chat_id[4:]}/{message_id}"
+    return None
+
+async def handle_search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /search command to find messages in the chat history."""
+    if not context.args:
+        await update.message.reply_text(
+            "*Usage:*\n"
+            "/search words to find\n"
+            "Example: `/search пицца вечером`",
+            parse_mode='Markdown'
+        )
+        return
+
+    chat_id = str(update.message.chat_id)
+    try:
+        query = " ".join(context.args)
+        history = await get_history(chat_id)
+        index = await chat_indexes.get(chat_id, history)
+        results = index.search(terms(query), limit=SEARCH_RESULTS)
+        if not results:
+            await update.message.reply_text(f"Nothing found for <i>{html.escape(query)}</i>", parse_mode='HTML')
+            return
+
+        lines = [f"<b>Found for</b> <i>{html.escape(query)}</i>:"]
+        for msg, _ in results:
+            text = " ".join(part for part in (msg.text, msg.caption) if part)
+            if len(text) > SEARCH_SNIPPET_LENGTH:
+                text = text[:SEARCH_SNIPPET_LENGTH] + "…"
+            when = datetime.fromtimestamp(msg.date).strftime("%d.%m %H:%M")
+            link = message_link(chat_id, msg.message_id)
+            when = f'<a href="{link}">{when}</a>' if link else when
+            lines.append(f"{when} {html.escape(msg.author or '')}: {html.escape(text)}")
+        await update.message.reply_text("\n".join(lines), parse_mode='HTML', disable_web_page_preview=True)
+
+    except Exception as e:
+        logger.error(f"Error processing search command: {str(e)}")
+        error_msg = await get_error_message(f"Error processing request: {str(e)}", chat_id)
+        await update.message.reply_text(error_msg, parse_mode='Markdown')
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the /status command to show current configuration and statistics."""
     # Check if the user is the admin
@@ -302,11 +470,32 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     channel_id = str(update.message.chat_id)
     config = channel_config.get_channel_config(channel_id)
-    stats = request_stats.get_stats()
-
-    # Get current channel stats
-    total_requests = stats["channel_requests"].get(channel_id, 0)
-    ask_requests = stats["ask_requests"].get(channel_id, 0)
+    stats = await request_stats.get_stats(channel_id, hours=24)
+    spent = await request_stats.get_daily_cost(channel_id)
+    budget = daily_budget(channel_id)
+    budget_text = f"`${budget:.2f}`" if budget else "no"
+    queue = llm_scheduler.get_stats()
+    updates = update_pipeline.get_stats()
+    lag = loop_monitor.get_stats()
+    breakers = "\n".join(
+        f"`{model}`: {state['state']} ({state['failures']} failures)"
+        for model, state in get_breaker_states().items()
+    ) or "No calls yet"
+
+    # Get current channel stats for the last 24 hours
+    commands = stats["commands"]
+    empty = {"requests": 0, "errors": 0, "avg_latency": 0.0, "latency_max": 0.0}
+
+    def command_line(title, command):
+        entry = commands.get(command, empty)
+        return (f"{title}: `{entry['requests']}` (avg `{entry['avg_latency']:.1f}s`, "
+                f"max `{entry['latency_max']:.1f}s`, `{entry['errors']}` errors)")
+
+    tokens = "\n".join(
+        f"`{model}`: `{usage['calls']}` calls (`{usage['call_errors']}` failed), "
+        f"`{usage['prompt_tokens']}` prompt / `{usage['completion_tokens']}` completion, `${usage['cost']:.4f}`"
+        for model, usage in sorted(stats["models"].items())
+    ) or "No calls"
 
     status_text = f"""*Bot Status Report for Channel {channel_id}*
 
@@ -316,10 +505,34 @@ Error Model: `{config['error_model']}`
 Main Prompt: `{config['main_prompt'][:100]}...`
 Error Prompt: `{config['error_prompt'][:100]}...`
 
-*Request Statistics:*
-Total Requests: `{total_requests}`
-/ask Commands: `{ask_requests}`
-Summary Requests: `{total_requests - ask_requests}`
+*Requests (last 24h):*
+{command_line("Summaries", "summary")}
+{command_line("/ask Commands", "ask")}
+{command_line("Error Replies", "error")}
+Coalesced Summaries: `{commands.get('coalesced', empty)['requests']}`
+Error Phrase Cache: `{commands.get('error_cache_hit', empty)['requests']}` hits / `{commands.get('error_cache_miss', empty)['requests']}` misses
+
+*Token Usage (last 24h):*
+{tokens}
+Spent Today (UTC): `${spent:.4f}` of {budget_text} daily budget
+
+*LLM Queue:*
+Active Calls: `{queue['active']}`
+Queued: `{queue['queue_depth']}`
+Avg / Max Wait: `{queue['avg_wait']:.2f}s` / `{queue['max_wait']:.2f}s`
+
+*Event Loop Lag:*
+Avg / p99 / Max: `{lag['avg'] * 1000:.1f}ms` / `{lag['p99'] * 1000:.1f}ms` / `{lag['max'] * 1000:.1f}ms`
+Stalls over 250ms: `{lag['stalls']}`
+
+*Webhook Updates:*
+Processed / Failed: `{updates['processed']}` / `{updates['failed']}`
+Rejected (queue full): `{updates['rejected']}`
+Queued / Max: `{updates['queue_depth']}` / `{updates['max_depth']}`
+Avg Wait / Handle: `{updates['avg_wait']:.3f}s` / `{updates['avg_handle']:.3f}s`
+
+*Model Circuit Breakers:*
+{breakers}
 
 *Mode:* `{MODE}`
 """
@@ -0,0 +1,162 @@
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from utils.tokenizer import terms
+
+DURATION_PATTERN = re.compile(r"^(\d+)(m|min|h|d|м|мин|ч|д)$")
+CLOCK_PATTERN = re.compile(r"^(\d{1,2}):(\d{2})$")
+DURATION_UNITS = {"m": 60, "min": 60, "м": 60, "мин": 60, "h": 3600, "ч": 3600, "d": 86400, "д": 86400}
+# Words that only make a request read naturally ("last 3h", "since 09:00")
+FILLER_WORDS = {"last", "since", "from", "за", "последние", "последний", "с", "со"}
+UNTIL_WORDS = {"until", "till", "to", "до", "по"}
+TODAY_WORDS = {"today", "сегодня"}
+# A keyword must be marked, `about:pizza` or quoted, so casual words around a mention select nothing
+KEYWORD_PREFIXES = ("about:", "про:")
+QUOTES = "\"'«»“”"
+
+
+class EmptyRangeError(ValueError):
+    """The time range of a selector ends before it starts."""
+
+
+class Selector:
+    """Which messages a summary request asks for."""
+
+    __slots__ = ("count", "since", "until", "author", "words", "phrases", "labels")
+
+    def __init__(self):
+        self.count: Optional[int] = None
+        self.since: Optional[float] = None
+        self.until: Optional[float] = None
+        self.author: Optional[str] = None
+        self.words: List[str] = []
+        # Keywords of several terms, which must appear next to each other
+        self.phrases: List[Tuple[str, ...]] = []
+        # How the user phrased the filters, for the reply header
+        self.labels: List[str] = []
+
+    @property
+    def filtered(self) -> bool:
+        """Whether anything other than a message count was given."""
+        return self.since is not None or self.until is not None or self.author is not None or bool(self.words)
+
+    def describe(self) -> str:
+        return " ".join(self.labels)
+
+    def key(self) -> tuple:
+        """The filters, for telling summaries of different selections apart."""
+        return (self.since, self.until, self.author, tuple(self.words), tuple(self.phrases))
+
+
+def clock_time(hour: int, minute: int, now: datetime) -> datetime:
+    """The most recent past moment with this local wall clock time."""
+    moment = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if moment > now:
+        moment -= timedelta(days=1)
+    return moment
+
+
+def end_time(hour: int, minute: int, since: Optional[float], now: datetime) -> float:
+    """End of a range given as a wall clock time: the first such moment after `since`
+    (today's when there is no start), but never later than now."""
+    start = datetime.fromtimestamp(since) if since is not None else now
+    moment = start.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if since is not None and moment.timestamp() <= since:
+        moment += timedelta(days=1)
+    return min(moment, now).timestamp()
+
+
+def keyword_args(args: List[str]) -> List[str]:
+    """Join quoted phrases (`"pizza night"`) into one argument."""
+    joined = []
+    quoted = None
+    for arg in args:
+        if quoted is not None:
+            quoted.append(arg)
+            if arg[-1:] in QUOTES:
+                joined.append(" ".join(quoted))
+                quoted = None
+        elif arg[:1] in QUOTES and (len(arg) == 1 or arg[-1:] not in QUOTES):
+            quoted = [arg]
+        else:
+            joined.append(arg)
+    if quoted is not None:
+        joined.append(" ".join(quoted))
+    return joined
+
+
+def keyword_text(arg: str) -> Optional[str]:
+    """The keyword of a marked argument, or None if it is not marked as one."""
+    for prefix in KEYWORD_PREFIXES:
+        if arg.lower().startswith(prefix):
+            return arg[len(prefix):]
+    if len(arg) > 1 and arg[0] in QUOTES and arg[-1] in QUOTES:
+        return arg[1:-1]
+    return None
+
+
+def parse_selector(args: List[str], now: Optional[datetime] = None, ignore: str = "") -> Selector:
+    """Parse the words after the bot mention, e.g. `200`, `last 3h`, `since 09:00 @alice`, `about:pizza`.
+
+    Numbers are a message count, durations and clock times a time range,
+    `@name` an author, and `about:word` or a quoted word or phrase a
+    keyword; the words of a phrase must follow each other. Times are local
+    to the server, and an end time is the first one after the start.
+    Raises ValueError for anything else and for a malformed number or time,
+    EmptyRangeError when the range is empty.
+    """
+    now = now or datetime.now()
+    selector = Selector()
+    until_next = False
+    until_clock = None
+    for arg in keyword_args(args):
+        word = arg.lower()
+        if not word or word == ignore.lower():
+            continue
+        if word in FILLER_WORDS:
+            continue
+        if word in UNTIL_WORDS:
+            until_next = True
+            continue
+        if word.lstrip("-").isdigit():
+            selector.count = int(word)
+            continue
+        duration = DURATION_PATTERN.match(word)
+        clock = CLOCK_PATTERN.match(word)
+        if duration:
+            selector.since = (now - timedelta(seconds=int(duration.group(1)) * DURATION_UNITS[duration.group(2)])).timestamp()
+            selector.labels.append(f"from the last {word}")
+        elif clock:
+            hour, minute = int(clock.group(1)), int(clock.group(2))
+            if hour > 23 or minute > 59:
+                raise ValueError(f"Invalid time: {arg}")
+            if until_next:
+                # Resolved once the start, which may come later, is known
+                until_clock = (hour, minute)
+                selector.labels.append(f"until {arg}")
+            else:
+                selector.since = clock_time(hour, minute, now).timestamp()
+                selector.labels.append(f"since {arg}")
+        elif word in TODAY_WORDS:
+            selector.since = now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+            selector.labels.append("from today")
+        elif word.startswith("@") and len(word) > 1:
+            selector.author = word
+            selector.labels.append(f"by {arg}")
+        else:
+            keyword = keyword_text(arg)
+            words = terms(keyword) if keyword else []
+            if not words:
+                raise ValueError(f"Invalid selector: {arg}")
+            selector.words.extend(words)
+            if len(words) > 1:
+                selector.phrases.append(tuple(words))
+            selector.labels.append(f"about {keyword}")
+        until_next = False
+    if until_clock is not None:
+        selector.until = end_time(*until_clock, selector.since, now)
+    if selector.since is not None and selector.until is not None and selector.until <= selector.since:
+        raise EmptyRangeError("The time range is empty")
+    if selector.count is None and not selector.filtered:
+        raise ValueError("Nothing selected")
+    return selector
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+from typing import List
+from utils.config import UPDATE_QUEUE_SIZE
+from utils.sharding import shard_for, update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+class ShardRouter:
+    """Ingress side of sharded mode: sends each raw update to the worker owning its chat.
+
+    Every worker has its own bounded inter-process queue, so the history of
+    a chat lives in exactly one process.
+    """
+
+    def __init__(self, workers: int, max_size: int = UPDATE_QUEUE_SIZE):
+        self.context = multiprocessing.get_context("spawn")
+        self.queues: List[multiprocessing.Queue] = [self.context.Queue(max_size) for _ in range(workers)]
+        self.running = False
+        self.routed = [0] * workers
+        self.rejected = 0
+
+    def route(self, data: dict) -> int:
+        return shard_for(update_chat_id(data) or 0, len(self.queues))
+
+    def submit(self, data: dict) -> bool:
+        """Forward a raw update without waiting. Returns False when the worker's queue is full."""
+        shard = self.route(data)
+        try:
+            self.queues[shard].put_nowait(data)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.routed[shard] += 1
+        return True
+
+    async def put(self, data: dict):
+        """Forward a raw update, waiting for room in the worker's queue."""
+        shard = self.route(data)
+        try:
+            self.queues[shard].put_nowait(data)
+        except queue.Full:
+            await asyncio.to_thread(self.queues[shard].put, data)
+        self.routed[shard] += 1
+
+    def close(self):
+        """Tell every worker to finish its queue and exit."""
+        self.running = False
+        for q in self.queues:
+            q.put(None)
+
+    def get_stats(self) -> dict:
+        """Get per-worker routing statistics."""
+        return {"routed": list(self.routed), "rejected": self.rejected}
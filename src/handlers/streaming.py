@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
+from models.llm import sanitize_partial_html
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects longer messages
+MAX_MESSAGE_LENGTH = 4096
+# Room kept for the tags that close a cut HTML response
+CLOSING_TAGS_RESERVE = 64
+
+
+class StreamingReply:
+    """A placeholder reply that is edited in place while a response streams in.
+
+    Responses too long for one message are cut before rendering, and cut
+    HTML is repaired. Partial Markdown is shown as plain text, since an
+    unfinished `*` or backtick would make Telegram reject the edit.
+    """
+
+    def __init__(self, message: Message, render: Callable[[str], str], parse_mode: Optional[str] = None):
+        self.message = message
+        self.render = render
+        self.parse_mode = parse_mode
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        # Text and parse mode of the last successful edit
+        self._last_text: tuple = ("", None)
+        self._blocked_until = 0.0
+
+    @classmethod
+    async def start(cls, reply_to: Message, placeholder: str, render: Callable[[str], str],
+                    parse_mode: Optional[str] = None) -> "StreamingReply":
+        """Post the placeholder reply."""
+        message = await reply_to.reply_text(placeholder)
+        return cls(message, render, parse_mode)
+
+    async def update(self, partial: str):
+        """Show a partial model response. Skipped while Telegram asks us to slow down."""
+        if not partial.strip() or time.monotonic() < self._blocked_until:
+            return
+        parse_mode = None if self._is_markdown else self.parse_mode
+        if await self._edit(self._fit(partial), final=False, parse_mode=parse_mode) and self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            logger.info(f"Time to first visible token: {self.first_token_at - self.started:.2f}s")
+
+    async def progress(self, status: str):
+        """Show how far a long request has got, before any model output."""
+        if not status.strip() or time.monotonic() < self._blocked_until:
+            return
+        await self._edit(self._fit(status), final=False, parse_mode=self.parse_mode)
+
+    async def finish(self, text: str):
+        """Show the complete response."""
+        await self._edit(self._fit(text), final=True, parse_mode=self.parse_mode)
+
+    @property
+    def _is_markdown(self) -> bool:
+        return bool(self.parse_mode) and self.parse_mode.lower().startswith("markdown")
+
+    def _fit(self, text: str) -> str:
+        """Render `text`, cutting the raw text first if the message would be too long."""
+        rendered = self.render(text)
+        if len(rendered) <= MAX_MESSAGE_LENGTH:
+            return rendered
+        room = MAX_MESSAGE_LENGTH - len(self.render("")) - 1
+        if self.parse_mode and self.parse_mode.upper() == "HTML":
+            text = sanitize_partial_html(text[:room - CLOSING_TAGS_RESERVE])
+        else:
+            text = text[:room]
+        return self.render(text + "…")
+
+    async def _edit(self, text: str, final: bool, parse_mode: Optional[str]) -> bool:
+        """Edit the reply; returns whether the text is now shown."""
+        if (text, parse_mode) == self._last_text:
+            return True
+        try:
+            await self.message.edit_text(text, parse_mode=parse_mode)
+            self._last_text = (text, parse_mode)
+            return True
+        except RetryAfter as e:
+            self._blocked_until = time.monotonic() + e.retry_after
+            if final:
+                logger.warning(f"Edit rate limited, retrying final edit in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+                await self.message.edit_text(text, parse_mode=parse_mode)
+                self._last_text = (text, parse_mode)
+                return True
+            return False
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return True
+            if final and parse_mode:
+                # The markup could not be parsed, show the response as plain text
+                logger.warning(f"Failed to send formatted response, falling back to plain text: {str(e)}")
+                await self.message.edit_text(text)
+                self._last_text = (text, None)
+                return True
+            logger.debug(f"Skipped partial edit: {str(e)}")
+            return False
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+from telegram import Update
+from telegram.ext import Application
+from utils.config import UPDATE_QUEUE_SIZE, UPDATE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Only plain messages reach the handlers; everything else is not requested from Telegram
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+
+class UpdatePipeline:
+    """Bounded queue between the webhook endpoint and the update handlers.
+
+    The endpoint only parses and enqueues; worker tasks hand updates to
+    `application.process_update`. When the queue is full the update is
+    rejected so Telegram retries it later instead of piling up in memory.
+    """
+
+    def __init__(self, max_size: int = UPDATE_QUEUE_SIZE, workers: int = UPDATE_WORKERS):
+        self.max_size = max_size
+        self.workers = workers
+        self.application: Optional[Application] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.handle_total = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self, application: Application):
+        """Start the worker tasks."""
+        self.application = application
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Update pipeline started with {self.workers} workers")
+
+    async def stop(self):
+        """Finish the queued updates and stop the workers."""
+        if not self._tasks:
+            return
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, data: dict) -> bool:
+        """Parse and enqueue a raw update. Returns False when the queue is full."""
+        self.received += 1
+        update = Update.de_json(data, self.application.bot)
+        try:
+            self._queue.put_nowait((time.monotonic(), update))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def put(self, data: dict):
+        """Parse and enqueue a raw update, waiting for room in the queue."""
+        self.received += 1
+        await self._queue.put((time.monotonic(), Update.de_json(data, self.application.bot)))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    async def _worker(self):
+        while True:
+            enqueued, update = await self._queue.get()
+            started = time.monotonic()
+            self.wait_total += started - enqueued
+            try:
+                await self.application.process_update(update)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing update {update.update_id}: {str(e)}")
+            finally:
+                self.handle_total += time.monotonic() - started
+                self._queue.task_done()
+
+    def get_stats(self) -> dict:
+        """Get pipeline and backpressure statistics."""
+        done = self.processed + self.failed
+        return {
+            "received": self.received,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_depth": self.queue_depth,
+            "max_depth": self.max_depth,
+            "avg_wait": self.wait_total / done if done else 0.0,
+            "avg_handle": self.handle_total / done if done else 0.0,
+        }
+
+
+# Create a global instance
+update_pipeline = UpdatePipeline()
@@ -1,14 +1,45 @@
-import os
+import asyncio
+import hmac
+import queue
+import secrets
 import signal
 import logging
-import requests
-from threading import Thread
-from fastapi import FastAPI
+import time
+from itertools import islice
+import httpx
+from fastapi import FastAPI, Header, Request, Response
+from fastapi.responses import PlainTextResponse
 import uvicorn
-from telegram import Update
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
-from utils.config import TOKEN, MODE, load_channels, save_channels, OPENROUTER_API_KEY, logger
-from handlers.bot_handlers import start, handle_model_command, handle_message, active_channels, handle_prompt_command, help_command, handle_ask_command, status_command
+from utils.config import TOKEN, MODE, load_channels, save_channels, OPENROUTER_API_KEY, OPENROUTER_BASE_URL, ERROR_CACHE_FILE, VERIFY_CONCURRENCY, VERIFY_RATE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, SHARD_WORKERS, logger
+from utils.verified_channels import verified_channels
+from utils.channel_config import channel_config
+from utils.shared_store import shared_store
+from utils.sharding import owns, set_shard
+from utils.stats import request_stats
+from utils.loop_monitor import loop_monitor
+from utils.metrics import metrics, instrument
+from handlers.bot_handlers import start, handle_model_command, handle_message, active_channels, message_history, handle_prompt_command, help_command, handle_ask_command, handle_search_command, status_command, STATIC_ERROR_CONTEXTS
+from handlers.webhook import update_pipeline, ALLOWED_UPDATES
+from handlers.shard_router import ShardRouter
+from models.llm import warm_error_cache
+from models.error_cache import error_cache
+from models.scheduler import TokenBucket, llm_scheduler
+from utils.history_store import history_store
+
+WEB_PORT = 8080
+# Seconds to wait for the OpenRouter key check before giving up on it
+STARTUP_CHECK_TIMEOUT = 10.0
+
+# Telegram echoes this back on every webhook request
+webhook_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+# Where the webhook sends updates: the local pipeline, or the shard router in sharded mode
+update_sink = update_pipeline
+
+# Keep references to startup tasks that run in the background
+background_tasks = set()
 
 # Create FastAPI app
 app = FastAPI()
@@ -17,114 +48,371 @@ app = FastAPI()
 async def livez():
     return {"status": "ok"}
 
-def run_web_server():
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Records sampled to estimate the memory held by message_history
+HISTORY_SIZE_SAMPLE = 1000
 
-def startup_check():
+def history_memory() -> float:
+    """Estimate message_history memory from a sample instead of walking every record."""
+    total = sum(len(history) for history in message_history.values())
+    sample = []
+    for history in list(message_history.values()):
+        sample.extend(islice(history, HISTORY_SIZE_SAMPLE - len(sample)))
+        if len(sample) >= HISTORY_SIZE_SAMPLE:
+            break
+    if not sample:
+        return 0.0
+    return total * sum(record.memory_size() for record in sample) / len(sample)
+
+metrics.gauge("event_loop_lag_seconds", "Event loop wake-up lag over the recent window",
+              lambda: {(stat,): value for stat, value in loop_monitor.get_stats().items() if stat != "stalls"}, ["stat"])
+metrics.gauge("event_loop_stalls", "Event loop lags over the stall threshold since start", lambda: loop_monitor.stalls)
+metrics.gauge("history_messages", "Messages held in memory across chats",
+              lambda: sum(len(history) for history in message_history.values()))
+metrics.gauge("history_chats", "Chats with history in memory", lambda: len(message_history))
+metrics.gauge("history_bytes", "Estimated memory held by in-memory history", history_memory)
+metrics.gauge("llm_active_calls", "LLM calls in progress", lambda: llm_scheduler.active)
+metrics.gauge("llm_queued_calls", "LLM calls waiting for the scheduler", lambda: llm_scheduler.queue_depth)
+metrics.gauge("update_queue_depth", "Webhook updates waiting for a worker", lambda: update_pipeline.queue_depth)
+metrics.gauge("updates_rejected", "Webhook updates rejected because the queue was full", lambda: update_pipeline.rejected)
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request, x_telegram_bot_api_secret_token: str = Header(default="")):
+    """Accept an update from Telegram and queue it for the workers."""
+    if not hmac.compare_digest(x_telegram_bot_api_secret_token, webhook_secret):
+        return Response(status_code=403)
+    if not update_sink.running:
+        return Response(status_code=503)
+    # A non-2xx answer makes Telegram redeliver the update later
+    if not update_sink.submit(await request.json()):
+        return Response(status_code=503)
+    return Response(status_code=200)
+
+async def startup_check():
     """Check if the OpenRouter API key is valid."""
-    response = requests.get(
-        url="https://openrouter.ai/api/v1/auth/key",
-        headers={
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}"
-        }
-    )
-    print(response.json())
+    try:
+        async with httpx.AsyncClient(timeout=STARTUP_CHECK_TIMEOUT) as http:
+            response = await http.get(
+                url=f"{OPENROUTER_BASE_URL}/auth/key",
+                headers={
+                    "Authorization": f"Bearer {OPENROUTER_API_KEY}"
+                }
+            )
+        logger.info(f"OpenRouter key check: {response.json()}")
+    except Exception as e:
+        logger.error(f"OpenRouter key check failed: {str(e)}")
+
+async def timed(phase: str, coro):
+    """Await a startup phase and log how long it took."""
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        logger.info(f"Startup phase '{phase}' took {time.perf_counter() - started:.2f}s")
+
+async def verify_channel(application: Application, channel_id: str, semaphore: asyncio.Semaphore, bucket: TokenBucket):
+    """Verify bot access to one channel, waiting out Telegram flood limits."""
+    for attempt in range(3):
+        async with semaphore:
+            delay = bucket.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                await application.bot.get_chat(chat_id=channel_id)
+                verified_channels.mark(channel_id)
+                active_channels.add(channel_id)
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+            except Exception as e:
+                logger.error(f"Error accessing channel {channel_id}: {str(e)}")
+                return False
+        logger.warning(f"Flood limit while verifying {channel_id}, retrying in {retry_after}s")
+        await asyncio.sleep(retry_after)
+    return False
+
+async def verify_channels(application: Application, channels):
+    """Verify channels concurrently, skipping ones verified recently."""
+    started = time.perf_counter()
+    pending = [channel_id for channel_id in channels if not verified_channels.is_fresh(channel_id)]
+    for channel_id in channels:
+        if verified_channels.is_fresh(channel_id):
+            active_channels.add(channel_id)
+    logger.info(f"Verifying {len(pending)} channels, {len(channels) - len(pending)} verified recently")
+
+    semaphore = asyncio.Semaphore(VERIFY_CONCURRENCY)
+    bucket = TokenBucket(VERIFY_RATE, VERIFY_RATE)
+    results = await asyncio.gather(*(verify_channel(application, channel_id, semaphore, bucket) for channel_id in pending))
+    verified_channels.save()
+    logger.info(f"Verified {sum(results)}/{len(pending)} channels in {time.perf_counter() - started:.2f}s")
 
 async def load_initial_messages(application: Application):
     """Initialize channels from file when bot starts."""
     try:
         print("Loading channels from file...")
-        # Load channels from file
-        channels = load_channels()
+        # Load channels from file, keeping the ones this process handles
+        channels = [channel_id for channel_id in load_channels() if owns(channel_id)]
         print(f"Found {len(channels)} channels in file")
         
-        for channel_id in channels:
-            try:
-                print(f"Initializing channel: {channel_id}")
-                try:
-                    # Verify channel access
-                    chat = await application.bot.get_chat(chat_id=channel_id)
-                    print(f"Successfully verified access to channel {channel_id}")
-                    active_channels.add(channel_id)
-                except Exception as e:
-                    print(f"Error accessing channel {channel_id}: {str(e)}")
-                    continue
-                    
-            except Exception as e:
-                print(f"Error initializing channel {channel_id}: {str(e)}")
-                continue
+        # Open the history store; each chat's last messages are loaded from it on first use
+        history_store.start()
+        
+        # Verify channel access in the background so updates are served meanwhile
+        task = asyncio.create_task(verify_channels(application, channels))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
     except Exception as e:
         print(f"Error in load_initial_messages: {str(e)}")
 
+async def prepare_error_phrases():
+    """Pre-generate error phrases for all configured channels and persist them."""
+    try:
+        channel_ids = [channel_id for channel_id in channel_config.channel_configs if owns(channel_id)]
+        await warm_error_cache(channel_ids, STATIC_ERROR_CONTEXTS)
+        error_cache.save(ERROR_CACHE_FILE)
+    except Exception as e:
+        logger.error(f"Error warming error phrase cache: {str(e)}")
+
 async def post_init(application: Application):
     """Post initialization handler."""
     print("Starting post initialization...")
+    error_cache.load(ERROR_CACHE_FILE)
+    request_stats.start()
+    # Generate missing phrases in the background so polling is not delayed
+    task = asyncio.create_task(prepare_error_phrases())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
     await load_initial_messages(application)
     print("Finished loading initial messages")
 
-def main():
+async def post_shutdown(application: Application):
+    """Post shutdown handler."""
+    history_store.close()
+    request_stats.close()
+    channel_config.close()
+    error_cache.save(ERROR_CACHE_FILE)
 
-    # a = [1,2,3,4,5,6,7,8,9,10]
-    # print(a[:-3:-1])
-    # return
+def build_application() -> Application:
+    """Create the Application and register handlers."""
+    application = Application.builder().token(TOKEN).build()
 
-    """Start the bot."""
-    if not TOKEN:
-        logger.error("No token provided. Please set TELEGRAM_BOT_TOKEN in .env file")
-        return
+    # Add handlers
+    application.add_handler(CommandHandler("start", instrument(start)))
+    application.add_handler(CommandHandler("help", instrument(help_command)))
+    application.add_handler(CommandHandler("model", instrument(handle_model_command)))
+    application.add_handler(CommandHandler("prompt", instrument(handle_prompt_command)))
+    application.add_handler(CommandHandler("ask", instrument(handle_ask_command)))
+    application.add_handler(CommandHandler("search", instrument(handle_search_command)))
+    application.add_handler(CommandHandler("status", instrument(status_command)))
+    application.add_handler(MessageHandler(filters.TEXT | ~filters.COMMAND | ~filters.REPLY | ~filters.FORWARDED, instrument(handle_message)))
+    return application
 
-    print("Starting bot...")
-    
-    # Set up signal handlers
-    def signal_handler(signum, frame):
-        print("stopped")
+def install_stop_handlers() -> asyncio.Event:
+    """Stop on signals instead of letting uvicorn or PTB install their own handlers."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    return stop
+
+def start_web_server(port: int = WEB_PORT):
+    """Serve the FastAPI app as a task on the running loop."""
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=port))
+    server.install_signal_handlers = lambda: None
+    return server, asyncio.create_task(server.serve())
+
+async def start_receiving(application: Application):
+    """Register the webhook, or start polling when no webhook URL is configured."""
+    if WEBHOOK_URL:
+        await timed("set webhook", application.bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=webhook_secret,
+            allowed_updates=ALLOWED_UPDATES,
+        ))
+    else:
+        await timed("start polling", application.updater.start_polling(allowed_updates=ALLOWED_UPDATES))
+
+async def run_bot():
+    """Run the bot and the web server on a single event loop until SIGINT/SIGTERM."""
+    started = time.perf_counter()
+    stop = install_stop_handlers()
+    loop_monitor.start()
+    server, web_task = start_web_server()
+
+    # Load channels from YAML file
+    channels = load_channels()
+    active_channels.update(channels)
+    logger.info(f"Active channels after loading: {list(active_channels)}")
+
+    application = build_application()
+    await timed("telegram initialize", application.initialize())
+    # The key check runs next to channel verification rather than blocking boot
+    await asyncio.gather(
+        timed("openrouter key check", startup_check()),
+        timed("post init", post_init(application)),
+    )
+    await application.start()
+    if WEBHOOK_URL:
+        update_pipeline.start(application)
+    await start_receiving(application)
+    logger.info(f"Bot started in {time.perf_counter() - started:.2f}s")
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping bot...")
+        if application.updater.running:
+            await application.updater.stop()
+        # The webhook stays registered so Telegram keeps updates until the next start
+        await update_pipeline.stop()
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+        server.should_exit = True
+        await web_task
         # Save channels before exit
         save_channels(active_channels)
-        # Exit the program
-        os._exit(0)
-
-    # Register signal handlers
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    # Start web server in a separate thread
-    web_server_thread = Thread(target=run_web_server, daemon=True)
-    web_server_thread.start()
-    print("Web server started on port 8080")
-    
-    # Load channels from YAML file
+
+async def serve_shard(index: int, count: int, updates, ready=None):
+    """Handle the updates the ingress routes to shard `index` until it sends None."""
+    set_shard(index, count)
+    loop_monitor.start()
+    # Each worker serves its own /metrics and /livez next to the ingress port
+    server, web_task = start_web_server(WEB_PORT + 1 + index)
+    channel_config.attach_store(shared_store)
+    llm_scheduler.share(count)
+    active_channels.update(channel_id for channel_id in load_channels() if owns(channel_id))
+
+    application = build_application()
+    await application.initialize()
+    await post_init(application)
+    await application.start()
+    update_pipeline.start(application)
+    logger.info(f"Worker {index}/{count} ready with {len(active_channels)} channels")
+    if ready is not None:
+        ready.set()
+
+    try:
+        while True:
+            batch = [await asyncio.to_thread(updates.get)]
+            # Take whatever else is already waiting without another thread hop
+            try:
+                while len(batch) < 256:
+                    batch.append(updates.get_nowait())
+            except queue.Empty:
+                pass
+            for data in batch:
+                if data is None:
+                    return
+                await update_pipeline.put(data)
+    finally:
+        await update_pipeline.stop()
+        await application.stop()
+        await post_shutdown(application)
+        await application.shutdown()
+        server.should_exit = True
+        await web_task
+        shared_store.close()
+        logger.info(f"Worker {index}/{count} stopped")
+
+def worker_main(index: int, count: int, updates, ready=None):
+    """Entry point of a shard worker process."""
+    # The ingress handles signals and shuts workers down through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_shard(index, count, updates, ready))
+
+async def forward_polled_updates(application: Application, router: ShardRouter):
+    """Pass updates fetched by long polling on to the shard workers."""
+    while True:
+        update = await application.update_queue.get()
+        await router.put(update.to_dict())
+
+async def wait_for_workers(processes, ready):
+    """Wait until every worker has started, or one of them has died."""
+    while not all(event.is_set() for event in ready):
+        dead = [process.name for process in processes if not process.is_alive()]
+        if dead:
+            logger.error(f"Workers exited during startup: {', '.join(dead)}")
+            return
+        await asyncio.sleep(0.1)
+
+async def run_ingress(workers: int):
+    """Receive updates and shard them by chat across worker processes."""
+    global update_sink
+    started = time.perf_counter()
+    stop = install_stop_handlers()
+    loop_monitor.start()
+
+    # Workers read config from the shared store
+    channel_config.attach_store(shared_store, seed=True)
     channels = load_channels()
     active_channels.update(channels)
-    print(f"Active channels after loading: {list(active_channels)}")
 
-    # Create the Application
-    application = Application.builder().token(TOKEN).build()
+    router = ShardRouter(workers)
+    ready = [router.context.Event() for _ in range(workers)]
+    processes = [
+        router.context.Process(target=worker_main, args=(i, workers, router.queues[i], ready[i]), name=f"shard-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    router.running = True
+    update_sink = router
+    server, web_task = start_web_server()
 
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("model", handle_model_command))
-    application.add_handler(CommandHandler("prompt", handle_prompt_command))
-    application.add_handler(CommandHandler("ask", handle_ask_command))
-    application.add_handler(CommandHandler("status", status_command))
-    application.add_handler(MessageHandler(filters.TEXT | ~filters.COMMAND | ~filters.REPLY | ~filters.FORWARDED, handle_message))
+    # The ingress only fetches updates; its handlers never run
+    application = build_application()
+    await timed("telegram initialize", application.initialize())
+    await timed("openrouter key check", startup_check())
+    forward_task = None
+    if not WEBHOOK_URL:
+        forward_task = asyncio.create_task(forward_polled_updates(application, router))
+    await start_receiving(application)
+    logger.info(f"Ingress started in {time.perf_counter() - started:.2f}s")
+    # Updates queue up for workers that are still starting
+    task = asyncio.create_task(timed("workers ready", wait_for_workers(processes, ready)))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
-    # Add post initialization handler
-    application.post_init = post_init
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Stopping ingress...")
+        if application.updater.running:
+            await application.updater.stop()
+        if forward_task is not None:
+            while not application.update_queue.empty():
+                await router.put(application.update_queue.get_nowait().to_dict())
+            forward_task.cancel()
+        router.close()
+        await asyncio.gather(*(asyncio.to_thread(process.join) for process in processes))
+        logger.info(f"Routed updates per worker: {router.get_stats()['routed']}")
+        await application.shutdown()
+        server.should_exit = True
+        await web_task
+        # Write the shared configuration back to channel_config.json
+        channel_config.detach_store()
+        save_channels(active_channels)
 
-    print("Starting polling...")
-    # Start the Bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+def main():
+    """Start the bot."""
+    if not TOKEN:
+        logger.error("No token provided. Please set TELEGRAM_BOT_TOKEN in .env file")
+        return
+
+    print("Starting bot...")
+    if SHARD_WORKERS > 0:
+        asyncio.run(run_ingress(SHARD_WORKERS))
+    else:
+        asyncio.run(run_bot())
 
 if __name__ == '__main__':
     try:
-        startup_check()
         main()
-    except KeyboardInterrupt:
-        print("stopped")
-        # Save channels before exit
-        save_channels(active_channels)
     except Exception as e:
         logger.error(f"Bot stopped due to error: {str(e)}")
         # Save channels even if there's an error
-        save_channels(active_channels) 
\ No newline at end of file
+        save_channels(active_channels)
@@ -0,0 +1,54 @@
+import logging
+from typing import Optional, Tuple
+from utils.config import MODEL_PRICES, DEFAULT_MODEL_PRICE, BUDGET_MODEL, BUDGET_MAX_MESSAGES
+from utils.channel_config import channel_config
+from utils.default_config import DAILY_BUDGET
+from utils.stats import request_stats
+
+logger = logging.getLogger(__name__)
+
+
+def model_price(model: str) -> Tuple[float, float]:
+    """USD per million prompt and completion tokens."""
+    return MODEL_PRICES.get(model, DEFAULT_MODEL_PRICE)
+
+
+def call_cost(model: str, usage) -> float:
+    """Price of one call in USD from the token usage the API reported."""
+    if usage is None:
+        return 0.0
+    prompt_price, completion_price = model_price(model)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def daily_budget(channel_id: Optional[str]) -> float:
+    """The channel's daily limit in USD, 0 when it has none."""
+    config = channel_config.get_channel_config(channel_id) if channel_id else channel_config.default_config
+    return float(config.get("daily_budget", DAILY_BUDGET) or 0)
+
+
+async def over_budget(channel_id: Optional[str]) -> bool:
+    """Whether the channel has spent its daily budget."""
+    budget = daily_budget(channel_id)
+    if budget <= 0:
+        return False
+    return await request_stats.get_daily_cost(channel_id) >= budget
+
+
+async def budget_limits(channel_id: Optional[str], model: str, n: Optional[int] = None) -> Tuple[str, Optional[int], bool]:
+    """Model and number of messages to use for a request.
+
+    Channels over budget get the cheaper of their model and BUDGET_MODEL and
+    at most BUDGET_MAX_MESSAGES messages. The last value tells whether the
+    request was degraded.
+    """
+    if not await over_budget(channel_id):
+        return model, n, False
+    if sum(model_price(BUDGET_MODEL)) < sum(model_price(model)):
+        model = BUDGET_MODEL
+    if n is not None:
+        n = min(n, BUDGET_MAX_MESSAGES)
+    logger.info(f"Channel {channel_id} is over its daily budget, using {model}")
+    return model, n, True
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class SummaryCoalescer:
+    """Single-flight deduplication and a short-lived result cache for summaries.
+
+    Identical concurrent requests share one in-flight call. A request whose
+    window ends at the same message as a recent summary that started no later
+    is answered from that summary.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_results: int = 256):
+        self.ttl = ttl
+        self.max_results = max_results
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        # (chat_id, model, prompt, temp, last_message_id) -> (first_message_id, created, result)
+        self._recent: "OrderedDict[Hashable, Tuple[int, float, str]]" = OrderedDict()
+
+    def get_recent(self, end_key: Hashable, first_message_id: int) -> Optional[str]:
+        """Return a recent summary ending at the same message that covers the window."""
+        entry = self._recent.get(end_key)
+        if entry is None:
+            return None
+        first, created, result = entry
+        if time.monotonic() - created > self.ttl:
+            del self._recent[end_key]
+            return None
+        if first > first_message_id:
+            return None
+        return result
+
+    def remember(self, end_key: Hashable, first_message_id: int, result: str):
+        """Store a successful summary, keeping the widest window per end message."""
+        entry = self._recent.get(end_key)
+        if entry is not None and entry[0] < first_message_id and time.monotonic() - entry[1] <= self.ttl:
+            return
+        self._recent[end_key] = (first_message_id, time.monotonic(), result)
+        self._recent.move_to_end(end_key)
+        while len(self._recent) > self.max_results:
+            self._recent.popitem(last=False)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """Run `factory` unless an identical call is in flight.
+
+        Returns the result and whether it was shared with another request.
+        Only the request that started the call sees its streaming and
+        progress updates; requests that join get just the final result.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one cancelled waiter does not cancel the call for the others
+        return await asyncio.shield(task), shared
+
+
+# Create a global instance
+summary_coalescer = SummaryCoalescer()
@@ -0,0 +1,103 @@
+import logging
+import zlib
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import numpy as np
+from openai import AsyncOpenAI
+from models.budget import call_cost
+from models.scheduler import llm_scheduler, PRIORITY_ASK
+from utils.config import OPENROUTER_API_KEY, EMBEDDING_MODEL, EMBEDDING_BASE_URL, EMBEDDING_DIM, EMBEDDING_BATCH_SIZE, LLM_TIMEOUT
+from utils.offload import run_cpu
+from utils.stats import request_stats
+from utils.tokenizer import terms
+from utils.vector_index import normalize
+
+logger = logging.getLogger(__name__)
+
+# Texts are cut to this many characters before embedding
+EMBEDDING_MAX_CHARS = 2000
+# Local embedding of larger batches moves off the event loop
+LOCAL_OFFLOAD_TEXTS = 64
+
+
+@lru_cache(maxsize=65536)
+def term_slot(term: str, dim: int) -> Tuple[int, float]:
+    """Column and sign of a term in a hashed embedding; crc32 keeps it stable across runs."""
+    h = zlib.crc32(term.encode("utf-8"))
+    return h % dim, 1.0 if h & 0x80000000 else -1.0
+
+
+class LocalEmbedder:
+    """Deterministic embeddings computed in process, with no API calls.
+
+    Each index term (see utils.tokenizer) adds a signed one to a hashed
+    column and the rows are scaled to unit length, so similarity reflects
+    shared words rather than meaning. Numbers are left out: they rarely
+    say what a message is about and would mostly add hash collisions. Used
+    when EMBEDDING_MODEL is not set and wherever results must be
+    reproducible.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"local-hash-{dim}"
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for term in terms(text[:EMBEDDING_MAX_CHARS]):
+                if term.isdigit():
+                    continue
+                column, sign = term_slot(term, self.dim)
+                rows.append(row)
+                columns.append(column)
+                signs.append(sign)
+        vectors = np.zeros((len(texts), self.dim), np.float32)
+        np.add.at(vectors, (rows, columns), signs)
+        return normalize(vectors)
+
+    async def embed(self, texts: List[str], chat_id: Optional[str] = None) -> np.ndarray:
+        """Unit-length embeddings of texts, one row each."""
+        return await run_cpu(self.embed_batch, texts, offload=len(texts) >= LOCAL_OFFLOAD_TEXTS)
+
+
+class APIEmbedder:
+    """Embeddings from an OpenAI-compatible embeddings endpoint, EMBEDDING_BATCH_SIZE texts per call.
+
+    Calls go through the LLM scheduler like chat completions and are
+    counted, with their cost, towards the chat's /ask statistics and budget.
+    """
+
+    def __init__(self, model: str, batch_size: int = EMBEDDING_BATCH_SIZE):
+        self.model = model
+        self.name = model
+        self.batch_size = batch_size
+        self.client = AsyncOpenAI(api_key=OPENROUTER_API_KEY, base_url=EMBEDDING_BASE_URL, timeout=LLM_TIMEOUT)
+
+    async def embed(self, texts: List[str], chat_id: Optional[str] = None) -> np.ndarray:
+        """Unit-length embeddings of texts, one row each."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = [text[:EMBEDDING_MAX_CHARS] or " " for text in texts[start:start + self.batch_size]]
+            async with llm_scheduler.slot(chat_id, self.model, PRIORITY_ASK):
+                try:
+                    response = await self.client.embeddings.create(model=self.model, input=batch)
+                except Exception:
+                    request_stats.record_call(chat_id, "ask", self.model, error=True)
+                    raise
+            usage = getattr(response, "usage", None)
+            request_stats.record_call(chat_id, "ask", self.model, usage, cost=call_cost(self.model, usage))
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return normalize(np.asarray(vectors, np.float32))
+
+
+def make_embedder():
+    """The configured embedder: the embeddings API when EMBEDDING_MODEL is set, local hashing otherwise."""
+    if EMBEDDING_MODEL:
+        logger.info(f"Using embeddings model {EMBEDDING_MODEL}")
+        return APIEmbedder(EMBEDDING_MODEL)
+    return LocalEmbedder()
+
+
+# Create a global instance
+embedder = make_embedder()
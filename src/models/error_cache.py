@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from utils.atomic_file import file_lock, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# (error_model, error_prompt, error_context)
+ErrorKey = Tuple[str, str, str]
+
+
+class _PhrasePool:
+    __slots__ = ("phrases", "created")
+
+    def __init__(self, created: float):
+        self.phrases: List[str] = []
+        self.created = created
+
+
+class ErrorPhraseCache:
+    """LRU cache of generated error phrases with a small pool of variants per key."""
+
+    def __init__(self, pool_size: int = 5, ttl: float = 12 * 3600, max_keys: int = 512):
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._pools: "OrderedDict[ErrorKey, _PhrasePool]" = OrderedDict()
+        self._refilling = set()
+
+    def get(self, key: ErrorKey) -> Optional[str]:
+        """Return a random cached phrase for the key, or None on a miss."""
+        pool = self._pools.get(key)
+        if pool is None:
+            return None
+        if time.time() - pool.created > self.ttl:
+            del self._pools[key]
+            return None
+        self._pools.move_to_end(key)
+        return random.choice(pool.phrases)
+
+    def add(self, key: ErrorKey, phrase: str):
+        """Add a generated phrase to the key's pool."""
+        pool = self._pools.get(key)
+        if pool is None or time.time() - pool.created > self.ttl:
+            pool = _PhrasePool(time.time())
+            self._pools[key] = pool
+            while len(self._pools) > self.max_keys:
+                self._pools.popitem(last=False)
+        if phrase not in pool.phrases and len(pool.phrases) < self.pool_size:
+            pool.phrases.append(phrase)
+
+    def needs_refill(self, key: ErrorKey) -> bool:
+        """Check whether the key's pool is short of variants and no refill is running."""
+        pool = self._pools.get(key)
+        return pool is not None and len(pool.phrases) < self.pool_size and key not in self._refilling
+
+    def refill_started(self, key: ErrorKey):
+        self._refilling.add(key)
+
+    def refill_done(self, key: ErrorKey):
+        self._refilling.discard(key)
+
+    def missing(self, key: ErrorKey) -> int:
+        """Number of variants the key's pool is short of."""
+        pool = self._pools.get(key)
+        if pool is None or time.time() - pool.created > self.ttl:
+            return self.pool_size
+        return self.pool_size - len(pool.phrases)
+
+    def save(self, path: str):
+        """Write all pools to a JSON file atomically.
+
+        Pools other processes saved to the file are kept unless this one has
+        the same key, so shard workers can share one file.
+        """
+        try:
+            with file_lock(path):
+                pools = self._read(path)
+                for key, pool in self._pools.items():
+                    pools.pop(key, None)
+                    pools[key] = pool
+                while len(pools) > self.max_keys:
+                    pools.popitem(last=False)
+                data = [
+                    {"model": key[0], "prompt": key[1], "context": key[2], "created": pool.created, "phrases": pool.phrases}
+                    for key, pool in pools.items()
+                    if pool.phrases
+                ]
+                write_json_atomic(path, data, ensure_ascii=False, indent=2)
+            logger.info(f"Saved {len(data)} error phrase pools to {path}")
+        except Exception as e:
+            logger.error(f"Error saving error phrase pools: {str(e)}")
+
+    def _read(self, path: str) -> "OrderedDict[ErrorKey, _PhrasePool]":
+        """Unexpired pools in a file written by save()."""
+        pools = OrderedDict()
+        if not os.path.exists(path):
+            return pools
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading error phrase pools: {str(e)}")
+            return pools
+        now = time.time()
+        for item in data:
+            if now - item["created"] > self.ttl:
+                continue
+            pool = _PhrasePool(item["created"])
+            pool.phrases = item["phrases"][:self.pool_size]
+            pools[(item["model"], item["prompt"], item["context"])] = pool
+        return pools
+
+    def load(self, path: str):
+        """Load pools saved by save(), skipping expired ones."""
+        if not os.path.exists(path):
+            return
+        self._pools.update(self._read(path))
+        while len(self._pools) > self.max_keys:
+            self._pools.popitem(last=False)
+        logger.info(f"Loaded {len(self._pools)} error phrase pools from {path}")
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+
+# Create a global instance
+error_cache = ErrorPhraseCache()
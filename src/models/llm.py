@@ -1,11 +1,24 @@
+import asyncio
 import json
 import logging
+import time
 from openai import AsyncOpenAI
-from utils.config import OPENROUTER_API_KEY, SUPPORTED_MODELS, MODE
+from utils.config import OPENROUTER_API_KEY, OPENROUTER_BASE_URL, SUPPORTED_MODELS, MODE, STREAM_UPDATE_INTERVAL, LLM_TIMEOUT, OFFLOAD_MIN_MESSAGES, OFFLOAD_MIN_CHARS
+from utils.config import SUMMARY_DIRECT_MAX_TOKENS, SUMMARY_CHUNK_TOKENS, SUMMARY_MAP_CONCURRENCY, SUMMARY_REDUCE_FANOUT
 from utils.channel_config import channel_config
-from utils.default_config import CURRENT_MODEL, ERROR_MODEL, MAIN_PROMPT, ERROR_PROMPT, TEMPERATURE
+from utils.default_config import CURRENT_MODEL, ERROR_MODEL, MAIN_PROMPT, ERROR_PROMPT, TEMPERATURE, FALLBACK_MODELS
 from utils.stats import request_stats
-from typing import Optional
+from utils.offload import run_cpu
+from utils.metrics import metrics
+from models.error_cache import error_cache
+from models.coalescing import summary_coalescer
+from models.budget import call_cost
+from models.resilience import call_with_fallback, StreamInterrupted
+from models.scheduler import llm_scheduler, PRIORITY_ERROR, PRIORITY_ASK, PRIORITY_SUMMARY, PRIORITY_BACKGROUND
+from models.prompt_builder import estimate_tokens, output_budget, pack_messages, input_budget, count_tokens, chunk_lines
+from models.summary_cache import summary_cache, split_blocks, block_key, config_fingerprint, MIN_CACHED_BLOCKS
+from operator import attrgetter
+from typing import Awaitable, Callable, List, Optional
 import re
 
 logger = logging.getLogger(__name__)
@@ -13,13 +26,57 @@ logger = logging.getLogger(__name__)
 # Initialize OpenAI client with OpenRouter configuration
 client = AsyncOpenAI(
     api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1",
+    base_url=OPENROUTER_BASE_URL,
+    # Retries and timeouts are handled by call_with_fallback
+    max_retries=0,
+    timeout=LLM_TIMEOUT,
     default_headers={
         "HTTP-Referer": "gege",  # Required for OpenRouter
         "X-Title": "Telegram Bot"  # Optional, but recommended
     }
 )
 
+SUMMARY_FORMAT_PROMPT = "Use htlm, allowed tags: <b> for bold,<i> for italic,<u> for underline,<s>for strikethrough,<a> for links,<blockquote> for quotes. Every other tag and markdown style are not allowed"
+# Upper bound for summary length; lowered when the input leaves less room in the context
+SUMMARY_MAX_TOKENS = 15000
+
+# Receives the partial response text while streaming
+UpdateCallback = Callable[[str], Awaitable[None]]
+# Receives a short description of how far a long summary has got
+ProgressCallback = Callable[[str], Awaitable[None]]
+
+PART_PROMPT = "This is one part of a longer conversation. Write a short plain-text summary of this part only, keep who said what, no markup. It will be combined with summaries of other parts."
+MERGE_PROMPT = "These are summaries of consecutive parts of a longer conversation, oldest first. Merge them into one shorter plain-text summary, keep who said what, no markup. It will be combined with other summaries."
+# Output limit for one partial summary
+PART_SUMMARY_TOKENS = 1000
+ASK_CONTEXT_PROMPT = "Messages from this chat that may be relevant to the question, oldest first. Use them if they help, do not mention them otherwise:"
+
+LLM_LATENCY = metrics.histogram("llm_request_seconds", "Duration of one LLM API attempt after admission", ["model", "outcome"])
+LLM_TTFB = metrics.histogram("llm_ttfb_seconds", "Time to the first streamed token of an LLM call", ["model"])
+LLM_TOKENS = metrics.counter("llm_tokens_total", "Tokens reported by the API in response.usage", ["model", "kind"])
+LLM_COST = metrics.counter("llm_cost_usd_total", "Cost of LLM calls from the local price table", ["model"])
+
+# Statistics command an LLM call is attributed to
+COMMAND_BY_PRIORITY = {
+    PRIORITY_ERROR: "error",
+    PRIORITY_ASK: "ask",
+    PRIORITY_SUMMARY: "summary",
+    PRIORITY_BACKGROUND: "error",
+}
+
+def record_usage(chat_id: Optional[str], priority: int, model: str, usage, error: bool = False):
+    """Count a finished call, its tokens and cost, if the API reported usage."""
+    cost = call_cost(model, usage)
+    request_stats.record_call(chat_id, COMMAND_BY_PRIORITY.get(priority, "other"), model, usage, error, cost)
+    if usage is None:
+        return
+    LLM_TOKENS.labels(model, "prompt").inc(usage.prompt_tokens or 0)
+    LLM_TOKENS.labels(model, "completion").inc(usage.completion_tokens or 0)
+    LLM_COST.labels(model).inc(cost)
+
+# Keep references to fire-and-forget tasks so they are not garbage collected
+_background_tasks = set()
+
 def change_prompt(model_type: str, new_prompt: str, channel_id: Optional[str] = None) -> tuple[bool, str]:
     """Change the prompt for a specific model type."""
     if channel_id:
@@ -38,131 +95,563 @@ def change_prompt(model_type: str, new_prompt: str, channel_id: Optional[str] =
     else:
         return False, f"Invalid model type: {model_type}. Use 'main' or 'error'"
 
-async def get_chatgpt_summary(messages, model=None, channel_id: Optional[str] = None):
-    """Get a summary of messages using OpenRouter API."""
+def model_chain(model: str, chat_id: Optional[str]) -> List[str]:
+    """The requested model followed by the chat's fallback models."""
+    config = channel_config.get_channel_config(chat_id) if chat_id else channel_config.default_config
+    fallbacks = config.get("fallback_models", FALLBACK_MODELS)
+    return [model] + [m for m in fallbacks if m != model]
+
+async def create_completion(chat_id: Optional[str], priority: int, **request):
+    """Call the chat completions API once the scheduler admits the request.
+
+    Provider failures are retried with backoff and then passed down the
+    chat's fallback models.
+    """
+    return (await create_completion_served(chat_id, priority, **request))[1]
+
+async def create_completion_served(chat_id: Optional[str], priority: int, **request) -> tuple:
+    """Like create_completion, but return (model that answered, response)."""
+    async def call(model):
+        async with llm_scheduler.slot(chat_id, model, priority):
+            started = time.monotonic()
+            try:
+                response = await client.chat.completions.create(**{**request, "model": model})
+            except Exception:
+                LLM_LATENCY.labels(model, "error").observe(time.monotonic() - started)
+                record_usage(chat_id, priority, model, None, error=True)
+                raise
+            LLM_LATENCY.labels(model, "ok").observe(time.monotonic() - started)
+            record_usage(chat_id, priority, model, getattr(response, "usage", None))
+            return model, response
+
+    return await call_with_fallback(model_chain(request["model"], chat_id), call)
+
+def format_message(msg) -> str:
+    """Render a stored message as a prompt line, or "" if it has no text."""
+    return msg.line
+
+def format_messages(messages) -> List[str]:
+    """Prompt lines of stored messages, skipping the ones without text.
+
+    Lines are rendered once per message (see MessageRecord.line), so this
+    only collects references to them.
+    """
+    return [line for line in map(attrgetter("line"), messages) if line]
+
+async def summarize_part(text: str, model: str, prompt: str, temp, chat_id: Optional[str] = None,
+                         instruction: str = PART_PROMPT) -> Optional[str]:
+    """Summarize one part of a conversation, or merge partial summaries, as plain text."""
+    return (await summarize_part_served(text, model, prompt, temp, chat_id, instruction))[0]
+
+async def summarize_part_served(text: str, model: str, prompt: str, temp, chat_id: Optional[str] = None,
+                                instruction: str = PART_PROMPT) -> tuple:
+    """Like summarize_part, but return (summary, model that wrote it); the summary is None on failure."""
+    try:
+        model, response = await create_completion_served(
+            chat_id, PRIORITY_SUMMARY,
+            model=model,
+            messages=[
+                {"role": "system", "content": prompt},
+                {"role": "system", "content": instruction},
+                {"role": "user", "content": text}
+            ],
+            max_tokens=PART_SUMMARY_TOKENS,
+            temperature=float(temp)
+        )
+        if hasattr(response, 'error'):
+            logger.error(f"Error code {response.error['code']}, {response.error['message']}")
+            return None, model
+        return response.choices[0].message.content, model
+    except Exception as e:
+        logger.error(f"Error summarizing part: {str(e)}")
+        return None, model
+
+async def summarize_block(block, model: str, prompt: str, temp, chat_id: Optional[str] = None) -> tuple:
+    """Summarize one block of messages for reuse in later summaries.
+
+    Returns (summary, model that wrote it), which may be a fallback model.
+    """
+    block_text = "".join(format_message(msg) for msg in block)
+    if not block_text:
+        return "", model
+    return await summarize_part_served(block_text, model, prompt, temp, chat_id)
+
+def numbered_summaries(summaries: List[str]) -> str:
+    return "\n".join(f"[{i}] {summary}" for i, summary in enumerate(summaries, 1))
+
+def group_summaries(summaries: List[str], max_tokens: int, fanout: int = SUMMARY_REDUCE_FANOUT) -> List[List[str]]:
+    """Group consecutive partial summaries for merging, at least two per group so every level shrinks."""
+    groups = []
+    used = 0
+    for summary in summaries:
+        tokens = estimate_tokens(summary)
+        if groups and len(groups[-1]) < fanout and (len(groups[-1]) < 2 or used + tokens <= max_tokens):
+            groups[-1].append(summary)
+            used += tokens
+        else:
+            groups.append([summary])
+            used = tokens
+    if len(groups) > 1 and len(groups[-1]) == 1:
+        groups[-2].extend(groups.pop())
+    return groups
+
+async def map_reduce_summary(message_texts: List[str], channel_id: Optional[str], model: str, prompt: str, temp,
+                             final_budget: int, on_progress: Optional[ProgressCallback] = None) -> tuple[str, int]:
+    """Reduce a window too large for one call to partial summaries that fit `final_budget` tokens.
+
+    The window is split into token-bounded parts that are summarized
+    concurrently (at most SUMMARY_MAP_CONCURRENCY at a time); while the
+    partial summaries are still too large they are merged in groups, level by
+    level. Returns the prompt for the final summary and the number of parts
+    that could not be summarized.
+    """
+    chunk_tokens = min(SUMMARY_CHUNK_TOKENS, input_budget(model, estimate_tokens(prompt) + estimate_tokens(PART_PROMPT),
+                                                          PART_SUMMARY_TOKENS))
+    chunks = await run_cpu(chunk_lines, message_texts, chunk_tokens, offload=len(message_texts) >= OFFLOAD_MIN_MESSAGES)
+    semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+    last_report = 0.0
+
+    async def report(text: str, force: bool = False):
+        nonlocal last_report
+        if on_progress is None or (not force and time.monotonic() - last_report < STREAM_UPDATE_INTERVAL):
+            return
+        last_report = time.monotonic()
+        try:
+            await on_progress(text)
+        except Exception as e:
+            logger.warning(f"Error reporting summary progress: {str(e)}")
+
+    async def run_stage(texts: List[str], instruction: str, stage: str) -> List[Optional[str]]:
+        done = 0
+
+        async def run(text):
+            nonlocal done
+            async with semaphore:
+                summary = await summarize_part(text, model, prompt, temp, channel_id, instruction)
+            done += 1
+            await report(f"⏳ {stage}: {done} of {len(texts)}")
+            return summary
+
+        await report(f"⏳ {stage}: 0 of {len(texts)}", force=True)
+        return await asyncio.gather(*(run(text) for text in texts))
+
+    logger.info(f"Summarizing {len(message_texts)} messages for chat {channel_id} in {len(chunks)} parts")
+    results = await run_stage(chunks, PART_PROMPT, "Reading parts of the conversation")
+    summaries = [summary for summary in results if summary]
+    failed = len(results) - len(summaries)
+    if not summaries:
+        raise SummaryError("Sorry, I couldn't summarize any part of the conversation.")
+
+    level = 1
+    while len(summaries) > 1 and estimate_tokens(numbered_summaries(summaries)) > final_budget:
+        groups = group_summaries(summaries, chunk_tokens)
+        logger.info(f"Merging {len(summaries)} partial summaries into {len(groups)} for chat {channel_id}")
+        merged = await run_stage([numbered_summaries(group) for group in groups], MERGE_PROMPT,
+                                 f"Merging summaries (level {level})")
+        if not all(merged):
+            raise SummaryError("Sorry, I couldn't merge the summaries of the conversation.")
+        summaries = merged
+        level += 1
+
+    await report("⏳ Writing the summary", force=True)
+    return "Summaries of consecutive parts of the conversation, oldest first:\n" + numbered_summaries(summaries), failed
+
+async def build_rolling_prompt(messages, channel_id: str, model: str, prompt: str, temp) -> Optional[str]:
+    """Build the summary input from cached block summaries plus the raw unsummarized messages.
+
+    Returns None when the window is too small to benefit from block summaries
+    or a block could not be summarized.
+    """
+    lead, blocks, tail = split_blocks(messages)
+    if len(blocks) < MIN_CACHED_BLOCKS:
+        return None
+
+    fingerprint = config_fingerprint(model, prompt, temp)
+    keys = [block_key(block) for block in blocks]
+    summaries = [summary_cache.get(channel_id, fingerprint, key) for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if missing:
+        logger.info(f"Summarizing {len(missing)} of {len(blocks)} blocks for chat {channel_id}")
+        semaphore = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+
+        async def summarize(block):
+            async with semaphore:
+                return await summarize_block(block, model, prompt, temp, channel_id)
+
+        results = await asyncio.gather(*(summarize(blocks[i]) for i in missing))
+        for i, (summary, served_by) in zip(missing, results):
+            if summary is None:
+                return None
+            # Cached under the model that wrote it, so a fallback's summary is not reused as the requested model's
+            summary_cache.put(channel_id, config_fingerprint(served_by, prompt, temp), keys[i], summary)
+            summaries[i] = summary
+
+    parts = []
+    lead_text = "".join(format_message(msg) for msg in lead)
+    if lead_text:
+        parts.append(f"Earlier messages:\n{lead_text}")
+    parts.append("Summaries of the following parts of the conversation:\n" + "\n".join(
+        f"[{i}] {summary}" for i, summary in enumerate(summaries, 1) if summary
+    ))
+    tail_text = "".join(format_message(msg) for msg in tail)
+    if tail_text:
+        parts.append(f"Latest messages:\n{tail_text}")
+    return "\n\n".join(parts)
+
+class SummaryError(Exception):
+    """The API answered with an error message instead of a summary."""
+
+async def get_chatgpt_summary(messages, model=None, channel_id: Optional[str] = None,
+                              on_update: Optional[UpdateCallback] = None,
+                              on_progress: Optional[ProgressCallback] = None, selection: Optional[tuple] = None):
+    """Get a summary of messages using OpenRouter API.
+
+    If `on_update` is given the response is streamed and the callback receives
+    the sanitized partial summary as it grows; `on_progress` hears how far a
+    window that is summarized in parts has got. Concurrent requests for the
+    same window share one call, and recent summaries are reused; a request
+    that joins a call in flight hears no updates, only the final summary.
+
+    `selection` identifies the filters that picked the messages, for windows
+    that are not simply the last N. Such windows share a call only with the
+    same selection and never use or fill the recent and block summary caches.
+    """
+    started = time.monotonic()
+    failed = False
     try:
         # Get channel-specific configuration
         config = channel_config.get_channel_config(channel_id) if channel_id else None
         model = model or (config["main_model"] if config else CURRENT_MODEL)
         prompt = config["main_prompt"] if config else MAIN_PROMPT
         temp = config["temp_model"] if config else TEMPERATURE
-        # Track request
-        request_stats.increment(channel_id or "default")
 
         # Prepare messages for ChatGPT
-        message_texts = []
-        for msg in messages:
-            # Get username or full name
-            username = ""
-            if msg.from_user:
-                if msg.from_user.username:
-                    username += f"@{msg.from_user.username}"
-                elif msg.effective_name:
-                    username += msg.effective_name
-                else:
-                    username += msg.from_user.full_name
-            if msg.forward_from_chat:
-                username += f" forwarded from chat {msg.forward_from_chat.effective_name}"
-            if msg.forward_from:
-                username += f" forwarded from user {msg.forward_from.username}"
-            # Get message text
-            text = ""
-            if hasattr(msg, 'text') and msg.text:
-                text += msg.text
-            if hasattr(msg, 'caption') and msg.caption:
-                text += f" Caption: {msg.caption}"
-            if hasattr(msg, 'reply_to_message') and msg.reply_to_message:
-                text += f" In response to '{msg.reply_to_message.caption} {msg.reply_to_message.text}'"
-            if text != "":
-                # Format message with username if available
-                if username != "":
-                    message_texts.append(f"{username}: {text}\n")
-                else:
-                    message_texts.append(text+"\n")
+        message_texts = await run_cpu(format_messages, messages, offload=len(messages) >= OFFLOAD_MIN_MESSAGES)
         
         if not message_texts:
             return "No text messages found to summarize."
         
-        # Create the prompt
-        prompt_text = f"".join(message_texts)
-        
         # Call OpenRouter API
         if MODE == "debug":
             return "Debug mode"
-        response = await client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": "Use htlm, allowed tags: <b> for bold,<i> for italic,<u> for underline,<s>for strikethrough,<a> for links,<blockquote> for quotes. Every other tag and markdown style are not allowed"},
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": prompt_text}
-            ],
-            max_tokens=15000,
-            temperature=float(temp)
+
+        first_id, last_id = messages[0].message_id, messages[-1].message_id
+        end_key = (channel_id, model, prompt, float(temp), last_id)
+        if selection is None:
+            summary = summary_coalescer.get_recent(end_key, first_id)
+            if summary is not None:
+                request_stats.record_coalesced(channel_id or "default")
+                return summary
+
+        summary, shared = await summary_coalescer.run(
+            end_key + (first_id, len(messages), selection),
+            lambda: generate_summary(messages, message_texts, channel_id, model, prompt, temp, on_update, on_progress,
+                                     use_blocks=selection is None),
         )
-        
-        if hasattr(response, 'error'):
-            msg = f"Error code {response.error['code']}, {response.error['message']}"
-            logger.error(msg)
-            return msg
-        return  remove_all_except_specified_tags(response.choices[0].message.content)
+        if shared:
+            request_stats.record_coalesced(channel_id or "default")
+        elif selection is None:
+            summary_coalescer.remember(end_key, first_id, summary)
+        return summary
 
+    except SummaryError as e:
+        failed = True
+        return str(e)
     except Exception as e:
+        failed = True
         logger.error(f"Error getting AI summary: {str(e)}")
         return "Sorry, I couldn't generate a summary at this time."
+    finally:
+        # Track request
+        request_stats.record_request(channel_id, "summary", model, time.monotonic() - started, failed)
+
+async def generate_summary(messages, message_texts, channel_id: Optional[str], model: str, prompt: str, temp,
+                           on_update: Optional[UpdateCallback] = None,
+                           on_progress: Optional[ProgressCallback] = None, use_blocks: bool = True) -> str:
+    """Build the prompt for a window and call the model; `use_blocks` allows cached block summaries."""
+    reserved_tokens = estimate_tokens(SUMMARY_FORMAT_PROMPT) + estimate_tokens(prompt)
+    note = ""
+    prompt_text = None
+    final_budget = min(SUMMARY_DIRECT_MAX_TOKENS, input_budget(model, reserved_tokens, SUMMARY_MAX_TOKENS))
+    offload = len(message_texts) >= OFFLOAD_MIN_MESSAGES
+    if await run_cpu(count_tokens, message_texts, offload=offload) > final_budget:
+        # Too large for one call: summarize it in parts, then summarize the parts
+        prompt_text, failed = await map_reduce_summary(message_texts, channel_id, model, prompt, temp, final_budget,
+                                                       on_progress)
+        if failed:
+            note = f"\n\n<i>{failed} parts of the conversation could not be summarized and were skipped</i>"
+    elif channel_id and use_blocks:
+        # Reuse block summaries for large windows
+        prompt_text = await build_rolling_prompt(messages, channel_id, model, prompt, temp)
+    if prompt_text is not None:
+        max_tokens = output_budget(model, reserved_tokens + estimate_tokens(prompt_text), SUMMARY_MAX_TOKENS)
+    else:
+        packed = await run_cpu(pack_messages, message_texts, model, reserved_tokens, SUMMARY_MAX_TOKENS,
+                               offload=offload)
+        prompt_text = packed.text
+        max_tokens = packed.max_tokens
+        if packed.dropped or packed.compressed:
+            logger.info(f"Prompt for {model}: {packed.included} messages, ~{packed.input_tokens} tokens, "
+                        f"{packed.dropped} dropped, {packed.compressed} truncated")
+        if packed.dropped:
+            note = f"\n\n<i>{packed.dropped} older messages did not fit into the model context and were skipped</i>"
+
+    request = dict(
+        model=model,
+        messages=[
+            {"role": "system", "content": SUMMARY_FORMAT_PROMPT},
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": prompt_text}
+        ],
+        max_tokens=max_tokens,
+        temperature=float(temp)
+    )
+    if on_update:
+        content = await stream_completion(on_update, sanitize_partial_html, channel_id, PRIORITY_SUMMARY, **request)
+        return await clean_html(content) + note
+
+    response = await create_completion(channel_id, PRIORITY_SUMMARY, **request)
+    
+    if hasattr(response, 'error'):
+        msg = f"Error code {response.error['code']}, {response.error['message']}"
+        logger.error(msg)
+        raise SummaryError(msg)
+    return await clean_html(response.choices[0].message.content) + note
+
+async def stream_completion(on_update: UpdateCallback, transform: Optional[Callable[[str], str]] = None,
+                            chat_id: Optional[str] = None, priority: int = PRIORITY_SUMMARY, **request) -> str:
+    """Run a streaming chat completion and return the full text.
+
+    The accumulated text (passed through `transform`) is reported to
+    `on_update` at most every STREAM_UPDATE_INTERVAL seconds. The scheduler
+    slot is held until the stream ends. Failures are retried and passed to
+    fallback models only until the first token has been shown.
+    """
+    parts = []
+
+    async def call(model):
+        async with llm_scheduler.slot(chat_id, model, priority):
+            started = time.monotonic()
+            last_update = 0.0
+            usage = None
+            try:
+                stream = await client.chat.completions.create(
+                    stream=True, stream_options={"include_usage": True}, **{**request, "model": model}
+                )
+                async for chunk in stream:
+                    # The final chunk carries usage and no choices
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if not parts:
+                        LLM_TTFB.labels(model).observe(time.monotonic() - started)
+                    parts.append(delta)
+                    now = time.monotonic()
+                    if now - last_update >= STREAM_UPDATE_INTERVAL:
+                        last_update = now
+                        text = "".join(parts)
+                        await on_update(transform(text) if transform else text)
+            except Exception as e:
+                LLM_LATENCY.labels(model, "error").observe(time.monotonic() - started)
+                record_usage(chat_id, priority, model, usage, error=True)
+                if parts:
+                    raise StreamInterrupted(str(e)) from e
+                raise
+            LLM_LATENCY.labels(model, "ok").observe(time.monotonic() - started)
+            record_usage(chat_id, priority, model, usage)
+            return "".join(parts)
+
+    return await call_with_fallback(model_chain(request["model"], chat_id), call)
+
+ALLOWED_TAG_PATTERN = re.compile(r'<(/?)(b|i|u|s|a|blockquote)\b[^>]*>', flags=re.IGNORECASE)
+
+# An entity cut off by the end of a partial response
+UNFINISHED_ENTITY_PATTERN = re.compile(r'&#?\w{0,10}$')
+
+def sanitize_partial_html(text):
+    """Sanitize a partial HTML response so it can be sent to Telegram while still streaming.
+
+    Drops a trailing unfinished tag or entity and removes disallowed tags.
+    Allowed tags are then nested properly: a closing tag closes the tags
+    opened inside it first, closing tags with nothing to close are
+    dropped, and tags still open at the end are closed innermost first.
+    """
+    last_open = text.rfind('<')
+    if last_open > text.rfind('>'):
+        text = text[:last_open]
+    text = UNFINISHED_ENTITY_PATTERN.sub('', text)
+    text = remove_all_except_specified_tags(text)
+    parts = []
+    open_tags = []
+    position = 0
+    for match in ALLOWED_TAG_PATTERN.finditer(text):
+        parts.append(text[position:match.start()])
+        position = match.end()
+        tag = match.group(2).lower()
+        if not match.group(1):
+            open_tags.append(tag)
+            parts.append(match.group(0))
+        elif tag in open_tags:
+            while True:
+                inner = open_tags.pop()
+                parts.append(f"</{inner}>")
+                if inner == tag:
+                    break
+    parts.append(text[position:])
+    parts.extend(f"</{tag}>" for tag in reversed(open_tags))
+    return "".join(parts)
+
+# Matches any HTML tag that is NOT in our allowed list
+DISALLOWED_TAG_PATTERN = re.compile(r'''<(?!\/?(b|i|u|s|a|blockquote)\b)[^>]+>''', flags=re.IGNORECASE)
+# Text is cleaned piecewise off the loop so the GIL is released between pieces
+CLEAN_CHUNK_SIZE = 65536
+
 def remove_all_except_specified_tags(text):
     """Remove all HTML tags except <b>, <i>, <u>, <s>, <a>, and <blockquote> with all their attributes."""
-    # Pattern matches any HTML tag that is NOT in our allowed list
-    pattern = re.compile(
-        r'''<(?!\/?(b|i|u|s|a|blockquote)\b)[^>]+>''',
-        flags=re.IGNORECASE
-    )
-    clean_text = pattern.sub('', text)
+    clean_text = DISALLOWED_TAG_PATTERN.sub('', text)
     return clean_text
 
+def remove_tags_in_chunks(text, chunk_size: int = CLEAN_CHUNK_SIZE):
+    """Same as remove_all_except_specified_tags for large texts.
+
+    Chunks end right after a '>', and no tag match contains a '>' before its
+    end, so no tag is split between chunks.
+    """
+    parts = []
+    start = 0
+    while start < len(text):
+        end = text.find('>', start + chunk_size)
+        end = len(text) if end == -1 else end + 1
+        parts.append(DISALLOWED_TAG_PATTERN.sub('', text[start:end]))
+        start = end
+    return "".join(parts)
+
+async def clean_html(text) -> str:
+    """Remove disallowed tags, off the event loop for large texts."""
+    if len(text) < OFFLOAD_MIN_CHARS:
+        return remove_all_except_specified_tags(text)
+    return await run_cpu(remove_tags_in_chunks, text)
 
-async def get_chatgpt_ask(question, model=None, channel_id: Optional[str] = None):
-    """Get a response for a direct question using OpenRouter API."""
+
+async def get_chatgpt_ask(question, model=None, channel_id: Optional[str] = None,
+                          on_update: Optional[UpdateCallback] = None, context=None):
+    """Get a response for a direct question using OpenRouter API, streamed to `on_update` if given.
+
+    `context` are chat messages retrieved for the question, sent ahead of it.
+    """
+    started = time.monotonic()
+    failed = False
     try:
         # Get channel-specific configuration
         config = channel_config.get_channel_config(channel_id) if channel_id else None
         model = model or (config["main_model"] if config else CURRENT_MODEL)
-        
-        # Track request
-        request_stats.increment(channel_id or "default", is_ask=True)
+
+        messages = [
+            {"role": "system", "content": "Ты полезный ассистент. Дай чистый ответ на русском, используй разметку для telegram - Markdown. bold text for titles **title**, italic simple text for normal text"},
+        ]
+        lines = format_messages(context or [])
+        if lines:
+            messages.append({"role": "user", "content": ASK_CONTEXT_PROMPT + "\n" + "".join(lines)})
+        messages.append({"role": "user", "content": question})
 
         # Call OpenRouter API
-        response = await client.chat.completions.create(
+        request = dict(
             model=model,
-            messages=[
-                {"role": "system", "content": "Ты полезный ассистент. Дай чистый ответ на русском, используй разметку для telegram - Markdown. bold text for titles **title**, italic simple text for normal text"},
-                {"role": "user", "content": question}
-            ],
+            messages=messages,
             max_tokens=15000,
             temperature=0.7
         )
+        if on_update:
+            return await stream_completion(on_update, chat_id=channel_id, priority=PRIORITY_ASK, **request)
+
+        response = await create_completion(channel_id, PRIORITY_ASK, **request)
         
         if hasattr(response, 'error'):
+            failed = True
             msg = f"Error code {response.error['code']}, {response.error['message']}"
             logger.error(msg)
             return msg
         return response.choices[0].message.content
     
     except Exception as e:
+        failed = True
         logger.error(f"Error getting AI response: {str(e)}")
         return "Sorry, I couldn't generate a response at this time."
+    finally:
+        # Track request
+        request_stats.record_request(channel_id, "ask", model, time.monotonic() - started, failed)
 
 async def get_error_message(error_context: str, channel_id: Optional[str] = None) -> str:
-    """Generate an error message using the error model."""
-    try:
-        # Get channel-specific configuration
-        config = channel_config.get_channel_config(channel_id) if channel_id else None
-        model = config["error_model"] if config else ERROR_MODEL
-        prompt = config["error_prompt"] if config else ERROR_PROMPT
+    """Get an error message, served from the phrase cache when possible."""
+    # Get channel-specific configuration
+    config = channel_config.get_channel_config(channel_id) if channel_id else None
+    model = config["error_model"] if config else ERROR_MODEL
+    prompt = config["error_prompt"] if config else ERROR_PROMPT
 
+    key = (model, prompt, error_context)
+    phrase = error_cache.get(key)
+    if phrase is not None:
         # Track request
-        request_stats.increment(channel_id or "default")
+        request_stats.record_request(channel_id, "error", model)
+        request_stats.record_error_cache(hit=True, channel_id=channel_id)
+        schedule_error_refill(key)
+        return phrase
+
+    request_stats.record_error_cache(hit=False, channel_id=channel_id)
+    started = time.monotonic()
+    phrase = await generate_error_message(error_context, model, prompt, channel_id)
+    request_stats.record_request(channel_id, "error", model, time.monotonic() - started, phrase is None)
+    if phrase is None:
+        return "Error parsing model response"
+    error_cache.add(key, phrase)
+    return phrase
 
-        response = await client.chat.completions.create(
+def schedule_error_refill(key: tuple):
+    """Generate one more variant for a cached error phrase pool in the background."""
+    if not error_cache.needs_refill(key):
+        return
+
+    async def refill():
+        try:
+            phrase = await generate_error_message(key[2], key[0], key[1], priority=PRIORITY_BACKGROUND)
+            if phrase is not None:
+                error_cache.add(key, phrase)
+        finally:
+            error_cache.refill_done(key)
+
+    error_cache.refill_started(key)
+    task = asyncio.create_task(refill())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def warm_error_cache(channel_ids, contexts, concurrency: int = 4):
+    """Fill the error phrase pools for every channel and static error context."""
+    configs = [channel_config.get_channel_config(channel_id) for channel_id in channel_ids]
+    configs.append(channel_config.default_config)
+    keys = {(config["error_model"], config["error_prompt"], context) for config in configs for context in contexts}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(key):
+        async with semaphore:
+            phrase = await generate_error_message(key[2], key[0], key[1], priority=PRIORITY_BACKGROUND)
+        if phrase is not None:
+            error_cache.add(key, phrase)
+
+    jobs = [generate(key) for key in keys for _ in range(error_cache.missing(key))]
+    logger.info(f"Warming error phrase cache: {len(jobs)} phrases for {len(keys)} keys")
+    await asyncio.gather(*jobs)
+    logger.info(f"Error phrase cache warmed, {len(error_cache)} pools")
+
+async def generate_error_message(error_context: str, model: str, prompt: str,
+                                 chat_id: Optional[str] = None, priority: int = PRIORITY_ERROR) -> Optional[str]:
+    """Generate an error message using the error model. Returns None on failure."""
+    try:
+        response = await create_completion(
+            chat_id, priority,
             model=model,
             messages=[
                 {"role": "system", "content": 'На вход подается "context" - поле содержит стиль ответа на ошибку в поле "error", ответ должен быть структурированым json файлом. Пример запроса {"context":"ты добрый дедушка", "error":"Number must be positive"}, Ответ должен содержать только 1 поле с фразой пример {"response": "Ну как же так внучок, число должно быть положительным"}. Стиль ответа задан в поле context, ошибка на тексте которой создавать ответ в поле error. Если не знаешь что ответить, отвечай "Не знаю что ответить" и не используй другие фразы'},
@@ -194,7 +683,7 @@ async def get_error_message(error_context: str, channel_id: Optional[str] = None
             try:
                 response_json = json.loads(response_text)
                 logger.info(f"Successfully parsed JSON: {response_json}")
-                return response_json.get("response", "Произошла ошибка при обработке запроса.")
+                return response_json.get("response")
             except json.JSONDecodeError as json_err:
                 logger.error(f"JSON parsing error: {str(json_err)}")
                 logger.error(f"Failed to parse text: {response_text}")
@@ -205,21 +694,53 @@ async def get_error_message(error_context: str, channel_id: Optional[str] = None
                     try:
                         extracted_json = json.loads(json_match.group())
                         logger.info(f"Successfully extracted and parsed JSON: {extracted_json}")
-                        return extracted_json.get("response", "Произошла ошибка при обработке запроса.")
+                        return extracted_json.get("response")
                     except json.JSONDecodeError:
                         logger.error("Failed to parse extracted JSON")
-                return "Error parsing model response"
+                return None
         except Exception as e:
             logger.error(f"Error processing response: {str(e)}")
             logger.error(f"Response text: {response_text}")
-            return "Error processing model response"
+            return None
             
     except Exception as e:
         logger.error(f"Error getting error message: {str(e)}")
-        return "Error parsing model response"
+        return None
 
 def change_model(model_type: str, new_model: str, channel_id: Optional[str] = None) -> tuple[bool, str]:
     """Change the model being used by the bot."""
+    if model_type == "fallback":
+        models = [m.strip() for m in new_model.split(",") if m.strip()]
+        invalid = [m for m in models if m not in SUPPORTED_MODELS]
+        if invalid:
+            return False, f"Invalid fallback models: {', '.join(invalid)}"
+        if channel_config.update_channel_config(channel_id or "default", "fallback_models", models):
+            return True, f"Fallback models changed to {', '.join(models) or 'none'} for channel {channel_id}"
+        return False, f"Failed to update fallback models for channel {channel_id}"
+
+    if model_type == "profile":
+        if channel_config.update_channel_config(channel_id or "default", "profile", new_model):
+            return True, f"Profile changed to {new_model} for channel {channel_id}"
+        return False, f"Unknown profile: {new_model}"
+
+    if model_type == "budget":
+        try:
+            budget = float(new_model)
+        except ValueError:
+            return False, f"Invalid budget: {new_model}"
+        if budget < 0:
+            return False, "Budget must not be negative"
+        if channel_config.update_channel_config(channel_id or "default", "daily_budget", budget):
+            return True, f"Daily budget changed to ${budget:.2f} for channel {channel_id}"
+        return False, f"Failed to update daily budget for channel {channel_id}"
+
+    if model_type == "context":
+        if not new_model.isdigit():
+            return False, f"Invalid number of context messages: {new_model}"
+        if channel_config.update_channel_config(channel_id or "default", "ask_context", int(new_model)):
+            return True, f"/ask context changed to {new_model} messages for channel {channel_id}"
+        return False, f"Failed to update /ask context for channel {channel_id}"
+
     if channel_id:
         success = channel_config.update_channel_config(channel_id, f"{model_type}_model", new_model)
         if success:
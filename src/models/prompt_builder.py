@@ -0,0 +1,125 @@
+from functools import lru_cache
+from typing import List, Tuple
+from utils.config import MODEL_CAPABILITIES, DEFAULT_MODEL_CAPABILITIES
+
+# Tokens kept free on top of the estimate, estimates are approximate
+SAFETY_MARGIN = 0.1
+# Messages longer than this are cut rather than dropped
+MAX_MESSAGE_TOKENS = 1000
+# Appended to a message that was cut
+TRUNCATION_MARK = "…\n"
+# Never ask for fewer output tokens than this
+MIN_OUTPUT_TOKENS = 512
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a text locally.
+
+    BPE tokenizers average about 4 bytes of UTF-8 per token for English and
+    Russian alike (Cyrillic letters are 2 bytes, tokens about 2 letters long),
+    so the encoded length is a cheap and slightly pessimistic estimate.
+    """
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def get_model_capabilities(model: str) -> dict:
+    """Get context and output limits for a model."""
+    return MODEL_CAPABILITIES.get(model, DEFAULT_MODEL_CAPABILITIES)
+
+
+def output_budget(model: str, input_tokens: int, desired_output: int) -> int:
+    """Largest max_tokens that still fits next to the input in the model context."""
+    caps = get_model_capabilities(model)
+    available = int(caps["context_tokens"] * (1 - SAFETY_MARGIN)) - input_tokens
+    return max(MIN_OUTPUT_TOKENS, min(desired_output, caps["max_output_tokens"], available))
+
+
+def input_budget(model: str, reserved_tokens: int, desired_output: int) -> int:
+    """Tokens left for the input after the system prompts and room for the output."""
+    caps = get_model_capabilities(model)
+    return int(caps["context_tokens"] * (1 - SAFETY_MARGIN)) - reserved_tokens \
+        - min(desired_output, caps["max_output_tokens"])
+
+
+# Lines are rendered once per message (MessageRecord.line), so every request
+# for a window passes the same string objects and hits this cache
+@lru_cache(maxsize=16384)
+def truncate_line(line: str) -> Tuple[str, int, bool]:
+    """Cut an oversized message to MAX_MESSAGE_TOKENS; returns the line, its token estimate and whether it was cut."""
+    tokens = estimate_tokens(line)
+    if tokens <= MAX_MESSAGE_TOKENS:
+        return line, tokens, False
+    # The estimate counts UTF-8 bytes, so cut the encoded line; a character split by the cut is dropped
+    room = MAX_MESSAGE_TOKENS * 4 - len(TRUNCATION_MARK.encode("utf-8"))
+    line = line.encode("utf-8")[:room].decode("utf-8", errors="ignore") + TRUNCATION_MARK
+    return line, estimate_tokens(line), True
+
+
+def count_tokens(lines: List[str]) -> int:
+    """Estimated tokens of formatted lines as they would be packed."""
+    return sum(truncate_line(line)[1] for line in lines)
+
+
+def chunk_lines(lines: List[str], max_tokens: int) -> List[str]:
+    """Split formatted lines into consecutive chunks of at most `max_tokens` tokens each."""
+    chunks = []
+    current = []
+    used = 0
+    for line in lines:
+        line, tokens, _ = truncate_line(line)
+        if current and used + tokens > max_tokens:
+            chunks.append("".join(current))
+            current = []
+            used = 0
+        current.append(line)
+        used += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+class PackedPrompt:
+    """Result of fitting messages into a model context."""
+
+    __slots__ = ("text", "input_tokens", "max_tokens", "included", "dropped", "compressed")
+
+    def __init__(self, text: str, input_tokens: int, max_tokens: int, included: int, dropped: int, compressed: int):
+        self.text = text
+        self.input_tokens = input_tokens
+        self.max_tokens = max_tokens
+        self.included = included
+        self.dropped = dropped
+        self.compressed = compressed
+
+
+def pack_messages(lines: List[str], model: str, reserved_tokens: int, desired_output: int) -> PackedPrompt:
+    """Pack formatted message lines newest-first into the model's context budget.
+
+    `reserved_tokens` covers the system prompts. Room for the desired output
+    (capped by the model's output limit) is kept; older messages that do not
+    fit are dropped and oversized messages are truncated to MAX_MESSAGE_TOKENS.
+    """
+    budget = input_budget(model, reserved_tokens, desired_output)
+
+    packed = []
+    used = 0
+    compressed = 0
+    for line in reversed(lines):
+        line, tokens, truncated = truncate_line(line)
+        if used + tokens > budget:
+            break
+        packed.append(line)
+        used += tokens
+        # Only lines that made it into the prompt count as compressed, not the one dropped at the cutoff
+        compressed += truncated
+    packed.reverse()
+
+    input_tokens = used + reserved_tokens
+    return PackedPrompt(
+        text="".join(packed),
+        input_tokens=input_tokens,
+        max_tokens=output_budget(model, input_tokens, desired_output),
+        included=len(packed),
+        dropped=len(lines) - len(packed),
+        compressed=compressed,
+    )
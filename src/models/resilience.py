@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+import openai
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Stops sending requests to a model after repeated provider failures."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = CLOSED
+
+    def allow(self) -> bool:
+        """Check whether a request may be sent. An open breaker lets one probe through after the timeout."""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            return True
+        return self.state == CLOSED
+
+    def record_success(self):
+        self.failures = 0
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """A call ended without telling whether the provider works (e.g. it was cancelled).
+
+        An unfinished probe reopens the breaker as it was, so the next call probes again.
+        """
+        if self.state == HALF_OPEN:
+            self.state = OPEN
+
+
+class StreamInterrupted(Exception):
+    """A stream failed after output was already shown, so it cannot be retried."""
+
+
+class AllModelsFailed(Exception):
+    """Every model in the fallback chain failed or was skipped."""
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    breaker = _breakers.get(model)
+    if breaker is None:
+        breaker = _breakers[model] = CircuitBreaker()
+    return breaker
+
+
+def get_breaker_states() -> Dict[str, dict]:
+    """Get the state of every model breaker seen so far."""
+    return {model: {"state": b.state, "failures": b.failures} for model, b in _breakers.items()}
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and connection failures are worth retrying."""
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+# Phrases of 400 errors that are about the model or its limits rather than the request itself
+MODEL_ERROR_PHRASES = ("model", "context length", "context window", "too long", "too many tokens", "maximum context",
+                       "max_tokens", "not supported", "unsupported")
+
+
+def is_model_error(error: Exception) -> bool:
+    """Errors another model may not have: the model does not exist (404) or cannot take this request (some 400s)."""
+    if isinstance(error, openai.NotFoundError):
+        return True
+    if isinstance(error, openai.BadRequestError):
+        message = str(error).lower()
+        return any(phrase in message for phrase in MODEL_ERROR_PHRASES)
+    return False
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Delay requested by the provider through the Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def call_with_fallback(models: List[str], call: Callable[[str], Awaitable[T]],
+                             attempts: int = 3, base_delay: float = 0.5, max_delay: float = 10.0,
+                             max_retry_after: float = 60.0) -> T:
+    """Call `call(model)` for each model in turn until one succeeds.
+
+    Retryable errors are retried with jittered exponential backoff (at most
+    `max_delay`), or after the provider's Retry-After (at most
+    `max_retry_after`), up to `attempts` times per model before moving to
+    the next one. Models whose breaker is open are skipped. Errors that
+    are specific to a model (see is_model_error) move on to the next model
+    at once; a missing model counts as a failure for its breaker. A stream
+    that broke after output was shown cannot be retried or replaced, so it
+    is raised, as a failure. Other errors are raised immediately; they mean
+    the provider answered, so they count as a success for the breaker.
+    """
+    last_error: Optional[Exception] = None
+    for model in models:
+        breaker = get_breaker(model)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                logger.warning(f"Circuit open for {model}, skipping")
+                break
+            try:
+                result = await call(model)
+            except StreamInterrupted:
+                breaker.record_failure()
+                raise
+            except Exception as e:
+                if is_model_error(e):
+                    last_error = e
+                    if isinstance(e, openai.NotFoundError):
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+                    logger.warning(f"{model} cannot serve the request ({type(e).__name__}: {str(e)}), trying the next model")
+                    break
+                if not is_retryable(e):
+                    breaker.record_success()
+                    raise
+                last_error = e
+                breaker.record_failure()
+                if attempt + 1 == attempts:
+                    break
+                delay = retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+                else:
+                    delay = min(max(delay, 0.0), max_retry_after)
+                logger.warning(f"{model} failed ({type(e).__name__}), retry {attempt + 1}/{attempts - 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled: nothing was learned about the provider
+                breaker.record_abandoned()
+                raise
+            breaker.record_success()
+            if model != models[0]:
+                logger.info(f"Served by fallback model {model} instead of {models[0]}")
+            return result
+    raise AllModelsFailed(f"All models failed: {', '.join(models)}") from last_error
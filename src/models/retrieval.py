@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+import numpy as np
+from utils.config import VECTOR_INDEX_DIR, VECTOR_INDEX_SIZE, VECTOR_INDEX_MAX_CHATS, EMBEDDING_BATCH_SIZE
+from utils.history import MessageRecord
+from utils.history_store import history_store
+from utils.vector_index import VectorIndex
+from models.embeddings import embedder as default_embedder
+
+logger = logging.getLogger(__name__)
+
+
+def record_text(record: MessageRecord) -> str:
+    return " ".join(part for part in (record.text, record.caption) if part)
+
+
+class ChatRetriever:
+    """Finds the stored messages of a chat most related to a question.
+
+    Each chat has a VectorIndex under VECTOR_INDEX_DIR. Before a query the
+    messages that reached the history store (or memory) since the newest
+    one the index has seen are embedded, EMBEDDING_BATCH_SIZE at a time, and appended,
+    so only the first query of a chat embeds its whole history. Updates
+    and queries of one chat take turns; other chats are not blocked. A
+    chat's lock lives only while a query of the chat runs or waits.
+    """
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, capacity: int = VECTOR_INDEX_SIZE,
+                 max_chats: int = VECTOR_INDEX_MAX_CHATS, embedder=None):
+        self.directory = directory
+        self.capacity = capacity
+        self.max_chats = max_chats
+        self.embedder = embedder or default_embedder
+        self._indexes: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Queries running or waiting per chat, to drop the lock after the last one
+        self._lock_users: Dict[str, int] = {}
+
+    def _load(self, chat_id: str) -> VectorIndex:
+        index = VectorIndex(os.path.join(self.directory, chat_id), self.embedder.name, self.capacity)
+        index.load()
+        return index
+
+    async def _index(self, chat_id: str) -> VectorIndex:
+        index = self._indexes.get(chat_id)
+        if index is None:
+            index = await asyncio.to_thread(self._load, chat_id)
+            self._indexes[chat_id] = index
+            if len(self._indexes) > self.max_chats:
+                self._indexes.popitem(last=False)
+        self._indexes.move_to_end(chat_id)
+        return index
+
+    async def _update(self, chat_id: str, index: VectorIndex, recent: Iterable[MessageRecord]) -> Dict[int, MessageRecord]:
+        """Embed and add the messages newer than the index's cursor; returns them by message id."""
+        last_id = index.processed_id
+        new = await asyncio.to_thread(history_store.load_after, chat_id, last_id, self.capacity)
+        newest = new[-1].message_id if new else last_id
+        new += [record for record in recent if newest is None or record.message_id > newest]
+        if not new:
+            return {}
+        newest = new[-1].message_id
+        new = [record for record in new if record_text(record)]
+        for start in range(0, len(new), EMBEDDING_BATCH_SIZE):
+            batch = new[start:start + EMBEDDING_BATCH_SIZE]
+            vectors = await self.embedder.embed([record_text(record) for record in batch], chat_id)
+            # Messages without index terms embed to zero and could never match
+            keep = np.flatnonzero(np.abs(vectors).sum(axis=1) > 0)
+            await asyncio.to_thread(index.add, [batch[i].message_id for i in keep], vectors[keep])
+        # Messages without text are skipped for good, not loaded again by the next query
+        await asyncio.to_thread(index.mark_processed, newest)
+        if new:
+            logger.info(f"Embedded {len(new)} messages of chat {chat_id}, index holds {len(index)}")
+        return {record.message_id: record for record in new}
+
+    async def retrieve(self, chat_id: str, question: str, k: int,
+                       recent: Iterable[MessageRecord] = ()) -> List[MessageRecord]:
+        """The `k` messages most similar to `question`, oldest first.
+
+        `recent` are in-memory messages that may not have reached the store yet.
+        """
+        chat_id = str(chat_id)
+        recent = list(recent)
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._lock_users[chat_id] = self._lock_users.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                index = await self._index(chat_id)
+                added = await self._update(chat_id, index, recent)
+                query = (await self.embedder.embed([question], chat_id))[0]
+                # A question of only stop words matches nothing
+                hits = [hit for hit in index.search(query, k) if hit[1] > 0] if query.any() else []
+        finally:
+            self._release_lock(chat_id)
+        if not hits:
+            return []
+
+        known = {record.message_id: record for record in recent}
+        known.update(added)
+        missing = [message_id for message_id, _ in hits if message_id not in known]
+        for record in await asyncio.to_thread(history_store.load_messages, chat_id, missing):
+            known[record.message_id] = record
+        # Messages dropped from the store since they were embedded are skipped
+        return sorted((known[message_id] for message_id, _ in hits if message_id in known),
+                      key=lambda record: record.message_id)
+
+    def _release_lock(self, chat_id: str):
+        users = self._lock_users[chat_id] - 1
+        if users:
+            self._lock_users[chat_id] = users
+        else:
+            del self._lock_users[chat_id]
+            del self._locks[chat_id]
+
+    def drop(self, chat_id: str):
+        self._indexes.pop(str(chat_id), None)
+
+
+# Create a global instance
+chat_retriever = ChatRetriever()
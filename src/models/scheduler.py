@@ -0,0 +1,160 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+from utils.config import LLM_MAX_CONCURRENCY, MODEL_CAPABILITIES, DEFAULT_MODEL_CAPABILITIES
+from utils.metrics import metrics
+
+# Lower value is served first
+PRIORITY_ERROR = 0
+PRIORITY_ASK = 1
+PRIORITY_SUMMARY = 2
+# Cache warming and refills
+PRIORITY_BACKGROUND = 3
+
+QUEUE_WAIT = metrics.histogram("llm_queue_wait_seconds", "Time an LLM call waited for rate limit and concurrency slot", ["priority"])
+
+
+class TokenBucket:
+    """Request rate limiter refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take one token and return how long to wait before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class _Waiter:
+    __slots__ = ("chat_id", "priority", "seq", "future")
+
+    def __init__(self, chat_id: str, priority: int, seq: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+
+
+class LLMScheduler:
+    """Admission control in front of the LLM client.
+
+    Limits the number of concurrent calls and, when a slot frees up, hands
+    it to the waiter with the best (priority, calls its chat already has
+    running, arrival) order so one busy chat cannot starve the others. A
+    call then waits for its model's token bucket while holding the slot.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        # Fraction of each model's rate limit this process may use
+        self.rate_share = 1.0
+        self._active = 0
+        self._seq = 0
+        self._waiters: List[_Waiter] = []
+        self._chat_active: Dict[str, int] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def _bucket(self, model: str) -> TokenBucket:
+        bucket = self._buckets.get(model)
+        if bucket is None:
+            rpm = MODEL_CAPABILITIES.get(model, DEFAULT_MODEL_CAPABILITIES)["requests_per_minute"]
+            rpm *= self.rate_share
+            bucket = TokenBucket(rpm / 60.0, max(1.0, rpm / 10.0))
+            self._buckets[model] = bucket
+        return bucket
+
+    def share(self, workers: int):
+        """Split the concurrency and rate limits evenly with other worker processes."""
+        self.max_concurrency = max(1, self.max_concurrency // workers)
+        self.rate_share = 1.0 / workers
+        self._buckets.clear()
+
+    @asynccontextmanager
+    async def slot(self, chat_id: Optional[str], model: str, priority: int = PRIORITY_SUMMARY):
+        """Wait for permission to call `model` on behalf of a chat."""
+        chat_id = str(chat_id or "default")
+        enqueued = time.monotonic()
+        await self._acquire(chat_id, priority)
+        try:
+            # Tokens are taken in the order slots are granted, so they follow priority too
+            delay = self._bucket(model).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            self._record_wait(time.monotonic() - enqueued, priority)
+            yield
+        finally:
+            self._release(chat_id)
+
+    async def _acquire(self, chat_id: str, priority: int):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._grant(chat_id)
+            return
+        self._seq += 1
+        waiter = _Waiter(chat_id, priority, self._seq, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just before cancellation, pass it on
+                self._release(chat_id)
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def _grant(self, chat_id: str):
+        self._active += 1
+        self._chat_active[chat_id] = self._chat_active.get(chat_id, 0) + 1
+
+    def _release(self, chat_id: str):
+        self._active -= 1
+        remaining = self._chat_active.get(chat_id, 1) - 1
+        if remaining:
+            self._chat_active[chat_id] = remaining
+        else:
+            self._chat_active.pop(chat_id, None)
+        while self._waiters and self._active < self.max_concurrency:
+            waiter = min(self._waiters, key=lambda w: (w.priority, self._chat_active.get(w.chat_id, 0), w.seq))
+            self._waiters.remove(waiter)
+            self._grant(waiter.chat_id)
+            waiter.future.set_result(None)
+
+    def _record_wait(self, seconds: float, priority: int):
+        QUEUE_WAIT.labels(priority).observe(seconds)
+        self.wait_count += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def get_stats(self) -> dict:
+        """Get queue statistics."""
+        return {
+            "active": self._active,
+            "queue_depth": len(self._waiters),
+            "avg_wait": self.wait_total / self.wait_count if self.wait_count else 0.0,
+            "max_wait": self.wait_max,
+        }
+
+
+# Create a global instance
+llm_scheduler = LLMScheduler()
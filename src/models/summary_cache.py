@@ -0,0 +1,88 @@
+import hashlib
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from utils.config import MAX_SUMMARY_MESSAGES
+
+# Messages are grouped into blocks by message_id // BLOCK_SIZE, so block
+# boundaries stay fixed while the history window slides.
+BLOCK_SIZE = 50
+# Use cached blocks only when the window spans at least this many complete blocks
+MIN_CACHED_BLOCKS = 2
+
+BlockKey = Tuple[int, int, int, int]
+
+
+def config_fingerprint(model: str, prompt: str, temp) -> str:
+    """Fingerprint of the settings a block summary depends on."""
+    return hashlib.sha1(f"{model}\0{prompt}\0{float(temp)}".encode("utf-8")).hexdigest()
+
+
+def block_key(block: list) -> BlockKey:
+    """Key identifying the exact records of a block."""
+    return (block[0].message_id // BLOCK_SIZE, block[0].message_id, block[-1].message_id, len(block))
+
+
+def split_blocks(messages: list) -> Tuple[list, List[list], list]:
+    """Split a window into (leading partial block, complete blocks, unfinished tail block).
+
+    The first block of the window may start mid-block and the last one may
+    still receive messages, so only the blocks in between are cacheable.
+    """
+    blocks: List[list] = []
+    for msg in messages:
+        block_id = msg.message_id // BLOCK_SIZE
+        if blocks and blocks[-1][0].message_id // BLOCK_SIZE == block_id:
+            blocks[-1].append(msg)
+        else:
+            blocks.append([msg])
+    if len(blocks) < 2:
+        return [], [], messages
+    return blocks[0], blocks[1:-1], blocks[-1]
+
+
+class BlockSummaryCache:
+    """Per-chat cache of partial summaries over fixed message blocks.
+
+    Summaries are keyed by the fingerprint of the model, prompt and
+    temperature that produced them, so summaries of different models (e.g.
+    a cheaper one under budget or a fallback) live side by side and the
+    least recently used blocks of a chat are evicted first. By default a
+    chat keeps enough blocks for the largest window a summary may ask for
+    (MAX_SUMMARY_MESSAGES) with two models, so re-summarizing it hits the
+    cache.
+    """
+
+    def __init__(self, max_chats: int = 1000,
+                 max_blocks_per_chat: int = 2 * (MAX_SUMMARY_MESSAGES // BLOCK_SIZE + 1)):
+        self.max_chats = max_chats
+        self.max_blocks_per_chat = max_blocks_per_chat
+        self._chats: "OrderedDict[str, OrderedDict[Tuple[str, BlockKey], str]]" = OrderedDict()
+
+    def _blocks(self, chat_id: str) -> OrderedDict:
+        blocks = self._chats.get(chat_id)
+        if blocks is None:
+            blocks = self._chats[chat_id] = OrderedDict()
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        self._chats.move_to_end(chat_id)
+        return blocks
+
+    def get(self, chat_id: str, fingerprint: str, key: BlockKey) -> Optional[str]:
+        """Return the cached summary of a block, if any."""
+        blocks = self._blocks(str(chat_id))
+        summary = blocks.get((fingerprint, key))
+        if summary is not None:
+            blocks.move_to_end((fingerprint, key))
+        return summary
+
+    def put(self, chat_id: str, fingerprint: str, key: BlockKey, summary: str):
+        """Store the summary of a block."""
+        blocks = self._blocks(str(chat_id))
+        blocks[(fingerprint, key)] = summary
+        blocks.move_to_end((fingerprint, key))
+        while len(blocks) > self.max_blocks_per_chat:
+            blocks.popitem(last=False)
+
+
+# Create a global instance
+summary_cache = BlockSummaryCache()
@@ -1,70 +1,280 @@
-import json
+import asyncio
+import logging
 import os
-from typing import Dict, Optional
-from utils.default_config import CURRENT_MODEL, ERROR_MODEL, MAIN_PROMPT, ERROR_PROMPT, TEMPERATURE
+import time
+import yaml
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from utils.config import CHANNEL_CONFIG_FLUSH_DELAY, CHANNEL_CONFIG_REFRESH_INTERVAL, PROFILES_FILE
+from utils.config_store import ConfigFileStore
+from utils.default_config import CURRENT_MODEL, ERROR_MODEL, MAIN_PROMPT, ERROR_PROMPT, TEMPERATURE, FALLBACK_MODELS, DAILY_BUDGET, ASK_CONTEXT_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+# Settings a channel can override; "profile" selects a group profile
+CONFIG_KEYS = ("main_model", "error_model", "main_prompt", "error_prompt", "temp_model", "fallback_models",
+               "daily_budget", "ask_context", "profile")
 
 class ChannelConfig:
+    """Channel settings resolved from three layers: global defaults, an
+    optional group profile and the channel's own overrides.
+
+    Only overrides are stored. Resolved configs are built once per channel
+    and reused until that channel, the profiles or the shared store change;
+    they are shared and must not be modified by callers.
+    """
+
     def __init__(self):
         self.config_file = "channel_config.json"
+        self.file_store = ConfigFileStore(self.config_file)
+        self.flush_delay = CHANNEL_CONFIG_FLUSH_DELAY
+        # Channels changed since the last write
+        self._dirty = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        # One writer thread keeps file and shared store writes in the order they were made
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="channel-config")
         self.default_config = {
             "main_model": CURRENT_MODEL,
             "error_model": ERROR_MODEL,
             "main_prompt": MAIN_PROMPT,
             "error_prompt": ERROR_PROMPT,
             "temp_model": float(TEMPERATURE),
+            "fallback_models": list(FALLBACK_MODELS),
+            "daily_budget": DAILY_BUDGET,
+            "ask_context": ASK_CONTEXT_MESSAGES,
         }
+        # Per-channel overrides
         self.channel_configs: Dict[str, dict] = {}
+        # Profile name -> settings, from PROFILES_FILE
+        self.profiles: Dict[str, dict] = {}
+        # Channel id -> resolved config
+        self._resolved: Dict[str, dict] = {}
+        # Set when stored configs were reduced to overrides and the file should be rewritten
+        self._migrated = False
+        # Shared store used instead of the file when chats are sharded across processes
+        self.store = None
+        self._store_version = None
+        self.refresh_interval = CHANNEL_CONFIG_REFRESH_INTERVAL
+        self._store_checked_at = float("-inf")
+        # Last shared store write handed to the writer thread
+        self._store_write: Optional[Future] = None
+        self.load_profiles()
         self.load_configs()
 
-    def load_configs(self):
-        """Load channel configurations from file."""
-        if os.path.exists(self.config_file):
+    def attach_store(self, store, seed: bool = False):
+        """Keep configurations in a shared store, optionally seeding it from the file."""
+        self.store = store
+        if seed:
+            store.replace_configs(self.channel_configs)
+        self._store_version = None
+        self.refresh(force=True)
+
+    def detach_store(self):
+        """Stop using the shared store and write its contents back to the file."""
+        self._wait_store_writes()
+        self.refresh(force=True)
+        self.store = None
+        self.save_configs()
+
+    def refresh(self, force: bool = False):
+        """Reload configurations if another process changed the shared store.
+
+        The store is checked at most every `refresh_interval` seconds unless
+        `force` is set, and not while this process's own writes are queued:
+        until they land, memory is newer than the store.
+        """
+        if self.store is None or (self._store_write is not None and not self._store_write.done()):
+            return
+        now = time.monotonic()
+        if not force and now - self._store_checked_at < self.refresh_interval:
+            return
+        self._store_checked_at = now
+        version = self.store.data_version()
+        if version != self._store_version:
+            self.channel_configs = self._overrides_only(self.store.load_configs())
+            self._resolved.clear()
+            self._store_version = version
+
+    def load_profiles(self, path: str = PROFILES_FILE):
+        """Load group profiles: a YAML mapping of profile name to settings."""
+        profiles = {}
+        if os.path.exists(path):
             try:
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.channel_configs = json.load(f)
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = yaml.safe_load(f) or {}
+                profiles = {str(name): {k: v for k, v in (settings or {}).items() if k in CONFIG_KEYS and k != "profile"}
+                            for name, settings in data.items()}
+                logger.info(f"Loaded {len(profiles)} config profiles from {path}")
             except Exception as e:
-                print(f"Error loading channel configs: {str(e)}")
-                self.channel_configs = {}
+                logger.error(f"Error loading config profiles: {str(e)}")
+        self.profiles = profiles
+        self._resolved.clear()
 
-    def save_configs(self):
-        """Save channel configurations to file."""
+    def _inherited(self, overrides: dict) -> dict:
+        """The defaults with the channel's profile applied."""
+        profile = self.profiles.get(overrides.get("profile"))
+        return {**self.default_config, **profile} if profile else self.default_config
+
+    def _overrides_only(self, configs: Dict[str, dict]) -> Dict[str, dict]:
+        """Drop stored values equal to what the channel inherits anyway.
+
+        Files written before configs were layered hold full copies of the
+        defaults; those reduce to an empty override set.
+        """
+        result = {}
+        for channel_id, config in configs.items():
+            overrides = {k: v for k, v in config.items() if k in CONFIG_KEYS}
+            inherited = self._inherited(overrides)
+            overrides = {k: v for k, v in overrides.items() if k == "profile" or inherited.get(k) != v}
+            if overrides != config:
+                self._migrated = True
+            if overrides:
+                result[channel_id] = overrides
+        return result
+
+    def _persist(self, channel_id: str):
+        if self.store is not None:
+            # SQLite may wait for other workers' writes, so this runs on the writer thread
+            config = self.channel_configs.get(channel_id)
+            self._store_write = self._writer.submit(self._write_store, channel_id, dict(config) if config else None)
+            return
+        self._dirty.add(channel_id)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to flush later from, write now
+            _, lines, snapshot = self._take_dirty()
+            self._writer.submit(self._write, lines, snapshot).result()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _take_dirty(self):
+        """Serialize the changed channels, or all of them when the journal is due for compaction."""
+        dirty, self._dirty = self._dirty, set()
+        lines = [self.file_store.entry(channel_id, self.channel_configs.get(channel_id)) for channel_id in dirty]
+        snapshot = None
+        if self.file_store.needs_compaction(len(self.channel_configs), len(lines)):
+            snapshot = {channel_id: dict(config) for channel_id, config in self.channel_configs.items()}
+        return dirty, lines, snapshot
+
+    def _write(self, lines: List[str], snapshot: Optional[dict]) -> bool:
         try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.channel_configs, f, ensure_ascii=False, indent=2)
+            if snapshot is not None:
+                self.file_store.compact(snapshot)
+            else:
+                self.file_store.append(lines)
+            return True
         except Exception as e:
             print(f"Error saving channel configs: {str(e)}")
+            return False
+
+    def _write_store(self, channel_id: str, config: Optional[dict]):
+        try:
+            self.store.save_config(channel_id, config)
+        except Exception as e:
+            logger.error(f"Error saving config of channel {channel_id} to the shared store: {str(e)}")
+
+    def _wait_store_writes(self):
+        if self._store_write is not None:
+            self._store_write.result()
+            self._store_write = None
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Write pending changes from the writer thread."""
+        if not self._dirty or self.store is not None:
+            return
+        dirty, lines, snapshot = self._take_dirty()
+        if not await asyncio.get_running_loop().run_in_executor(self._writer, self._write, lines, snapshot):
+            # Try again with the next change or on close
+            self._dirty |= dirty
+
+    def close(self):
+        """Write everything still pending and fold the journal into the file."""
+        pending = self._flush_task is not None and not self._flush_task.done()
+        if pending:
+            self._flush_task.cancel()
+        self._flush_task = None
+        self._wait_store_writes()
+        if self.store is None and (pending or self._dirty or self._migrated or self.file_store.journal_lines):
+            self.save_configs()
+
+    def load_configs(self):
+        """Load channel configurations from file."""
+        try:
+            self.channel_configs = self._overrides_only(self.file_store.load())
+        except Exception as e:
+            print(f"Error loading channel configs: {str(e)}")
+            self.channel_configs = {}
+        self._resolved.clear()
+
+    def save_configs(self):
+        """Save all channel configurations to file atomically."""
+        self._dirty.clear()
+        self._migrated = False
+        snapshot = {channel_id: dict(config) for channel_id, config in self.channel_configs.items()}
+        # Queued behind any write still in progress
+        self._writer.submit(self._write, [], snapshot).result()
 
     def get_channel_config(self, channel_id: str) -> dict:
-        """Get configuration for a specific channel."""
-        return self.channel_configs.get(str(channel_id), self.default_config)
+        """Get the resolved configuration for a specific channel."""
+        self.refresh()
+        channel_id = str(channel_id)
+        config = self._resolved.get(channel_id)
+        if config is None:
+            overrides = self.channel_configs.get(channel_id)
+            if overrides:
+                config = {**self._inherited(overrides), **overrides}
+            else:
+                config = self.default_config
+            self._resolved[channel_id] = config
+        return config
 
-    def update_channel_config(self, channel_id: str, config_type: str, value: str) -> bool:
+    def update_channel_config(self, channel_id: str, config_type: str, value) -> bool:
         """Update a specific configuration for a channel."""
         channel_id = str(channel_id)
-        if channel_id not in self.channel_configs:
-            self.channel_configs[channel_id] = self.default_config.copy()
+        # Change the latest stored overrides, not ones up to a refresh interval old
+        self.refresh(force=True)
+        if config_type not in CONFIG_KEYS:
+            return False
+        if config_type == "profile" and value not in self.profiles:
+            return False
 
-        if config_type in ["main_model", "error_model", "main_prompt", "error_prompt","temp_model"]:
-            self.channel_configs[channel_id][config_type] = value
-            self.save_configs()
-            return True
-        return False
+        overrides = dict(self.channel_configs.get(channel_id, {}))
+        overrides[config_type] = value
+        inherited = self._inherited(overrides)
+        # Store only what differs from the defaults and the profile
+        if config_type != "profile" and inherited.get(config_type) == value:
+            del overrides[config_type]
+        self._set_overrides(channel_id, overrides)
+        return True
 
     def reset_channel_config(self, channel_id: str, config_type: Optional[str] = None) -> bool:
-        """Reset configuration for a channel to default values."""
+        """Reset configuration for a channel to the inherited values."""
         channel_id = str(channel_id)
+        self.refresh(force=True)
+        if channel_id not in self.channel_configs:
+            return False
         if config_type:
-            if channel_id in self.channel_configs:
-                if config_type in self.channel_configs[channel_id]:
-                    self.channel_configs[channel_id][config_type] = self.default_config[config_type]
-                    self.save_configs()
-                    return True
+            if config_type not in CONFIG_KEYS:
+                return False
+            overrides = {k: v for k, v in self.channel_configs[channel_id].items() if k != config_type}
+        else:
+            overrides = {}
+        self._set_overrides(channel_id, overrides)
+        return True
+
+    def _set_overrides(self, channel_id: str, overrides: dict):
+        if overrides:
+            self.channel_configs[channel_id] = overrides
         else:
-            if channel_id in self.channel_configs:
-                del self.channel_configs[channel_id]
-                self.save_configs()
-                return True
-        return False
+            self.channel_configs.pop(channel_id, None)
+        self._resolved.pop(channel_id, None)
+        self._persist(channel_id)
 
 # Create a global instance
-channel_config = ChannelConfig() 
\ No newline at end of file
+channel_config = ChannelConfig()
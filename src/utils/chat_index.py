@@ -0,0 +1,249 @@
+import asyncio
+import heapq
+import math
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+from utils.config import CHAT_INDEX_SIZE, CHAT_INDEX_MAX_CHATS
+from utils.history import MessageRecord
+from utils.history_store import history_store
+from utils.tokenizer import terms
+
+# Search looks at most at this many of the newest occurrences of each query term
+SEARCH_SCAN_LIMIT = 500
+
+
+def record_words(record: MessageRecord) -> set:
+    """Distinct index terms of a message's text and caption."""
+    words = set()
+    for part in (record.text, record.caption):
+        if part:
+            words.update(terms(part))
+    return words
+
+
+def has_phrase(record: MessageRecord, phrase: Tuple[str, ...]) -> bool:
+    """Whether the terms of a phrase follow each other in a message's text or caption."""
+    size = len(phrase)
+    for part in (record.text, record.caption):
+        if part:
+            found = terms(part)
+            if any(tuple(found[i:i + size]) == phrase for i in range(len(found) - size + 1)):
+                return True
+    return False
+
+
+class ChatIndex:
+    """Messages of one chat with indexes for selecting summary windows.
+
+    Every message gets a sequence number. Messages and their timestamps are
+    kept in parallel lists, so a time range is two binary searches and a
+    slice. Authors and words map to ascending lists of sequence numbers
+    (posting lists) that grow by appending; words are indexed as stems
+    (see utils.tokenizer). The oldest messages are evicted in batches once
+    the index holds a quarter more than `capacity`.
+    """
+
+    def __init__(self, capacity: int = CHAT_INDEX_SIZE):
+        self.capacity = capacity
+        # Sequence number of records[0]
+        self.base = 0
+        self.records: List[MessageRecord] = []
+        self.timestamps: List[float] = []
+        self.authors: Dict[str, List[int]] = {}
+        self.words: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @property
+    def last_message_id(self) -> Optional[int]:
+        return self.records[-1].message_id if self.records else None
+
+    def append(self, record: MessageRecord):
+        """Index a new message."""
+        seq = self.base + len(self.records)
+        # Keep timestamps sorted even if a message arrives with an older date
+        date = max(record.date, self.timestamps[-1]) if self.timestamps else record.date
+        self.records.append(record)
+        self.timestamps.append(date)
+        if record.author:
+            self.authors.setdefault(record.author.lower(), []).append(seq)
+        for word in record_words(record):
+            self.words.setdefault(word, []).append(seq)
+        if len(self.records) > self.capacity + self.capacity // 4:
+            self._evict(len(self.records) - self.capacity)
+
+    def _evict(self, count: int):
+        del self.records[:count]
+        del self.timestamps[:count]
+        self.base += count
+        for postings in (self.authors, self.words):
+            for key in list(postings):
+                seqs = postings[key]
+                start = bisect_left(seqs, self.base)
+                if start == len(seqs):
+                    del postings[key]
+                elif start:
+                    del seqs[:start]
+
+    def seq_since(self, since: float) -> int:
+        """Sequence number of the first message at or after `since`."""
+        return self.base + bisect_left(self.timestamps, since)
+
+    def seq_until(self, until: float) -> int:
+        """Sequence number just past the last message at or before `until`."""
+        return self.base + bisect_right(self.timestamps, until)
+
+    def postings(self, author: Optional[str] = None, word: Optional[str] = None) -> List[int]:
+        if author is not None:
+            return self.authors.get(author.lower(), [])
+        return self.words.get(word, [])
+
+    def select(self, since: Optional[float] = None, until: Optional[float] = None, author: Optional[str] = None,
+               words: Iterable[str] = (), phrases: Iterable[Tuple[str, ...]] = (),
+               limit: Optional[int] = None) -> List[MessageRecord]:
+        """Messages matching all given filters, oldest first, at most the newest `limit`.
+
+        `words` are index terms. `phrases` are runs of terms that must appear
+        in that order; their terms must also be in `words`, and only the
+        messages that have every word are checked for them. Walks only the
+        shortest posting list within the time range, so the cost is
+        O(log n + k) for k candidates rather than a scan.
+        """
+        start = self.seq_since(since) if since is not None else self.base
+        end = self.seq_until(until) if until is not None else self.base + len(self.records)
+
+        candidates = [self.postings(author=author)] if author else []
+        candidates += [self.postings(word=word) for word in words]
+        if not candidates:
+            selected = self.records[start - self.base:end - self.base]
+            return selected[-limit:] if limit else selected
+
+        candidates.sort(key=len)
+        seqs = candidates[0]
+        matched = seqs[bisect_left(seqs, start):bisect_left(seqs, end)]
+        for other in candidates[1:]:
+            if not matched:
+                break
+            # Only the part of the longer list between the first and last candidate matters
+            in_range = set(other[bisect_left(other, matched[0]):bisect_right(other, matched[-1])])
+            matched = [seq for seq in matched if seq in in_range]
+        for phrase in phrases:
+            matched = [seq for seq in matched if has_phrase(self.records[seq - self.base], phrase)]
+        if limit:
+            matched = matched[-limit:]
+        return [self.records[seq - self.base] for seq in matched]
+
+    def search(self, query_terms: Iterable[str], limit: int = 10) -> List[Tuple[MessageRecord, float]]:
+        """Best matches for a query, highest score first.
+
+        A message scores the sum of the inverse document frequencies of the
+        query terms it contains, and newer messages win ties. Messages with
+        every term are found first by walking the rarest term's postings
+        newest first and probing the others by binary search; partial
+        matches are scored only if that leaves room. Each step looks at no
+        more than SEARCH_SCAN_LIMIT of the newest occurrences of a term,
+        which bounds the cost for common terms.
+        """
+        query = sorted({term for term in query_terms if self.words.get(term)}, key=lambda term: len(self.words[term]))
+        if not query:
+            return []
+        total = len(self.records)
+        idf = {term: math.log(1 + (total - len(self.words[term]) + 0.5) / (len(self.words[term]) + 0.5))
+               for term in query}
+
+        full_score = sum(idf.values())
+        rarest = self.words[query[0]]
+        others = [self.words[term] for term in query[1:]]
+        # Upper search bounds only move down as the walk goes back in time
+        bounds = [len(seqs) for seqs in others]
+        found: List[Tuple[int, float]] = []
+        for seq in islice(reversed(rarest), SEARCH_SCAN_LIMIT):
+            for i, seqs in enumerate(others):
+                pos = bisect_left(seqs, seq, 0, bounds[i])
+                bounds[i] = pos + 1 if pos < len(seqs) else pos
+                if pos == len(seqs) or seqs[pos] != seq:
+                    break
+            else:
+                found.append((seq, full_score))
+                if len(found) == limit:
+                    break
+
+        if len(found) < limit and others:
+            exclude = {seq for seq, _ in found}
+            scores: Dict[int, float] = {}
+            for term in query:
+                weight = idf[term]
+                for seq in self.words[term][-SEARCH_SCAN_LIMIT:]:
+                    if seq not in exclude:
+                        scores[seq] = scores.get(seq, 0.0) + weight
+            # (score, seq) tuples compare in C, newer messages winning ties
+            found += [(seq, score) for score, seq in heapq.nlargest(limit - len(found), zip(scores.values(), scores))]
+        return [(self.records[seq - self.base], score) for seq, score in found]
+
+
+class ChatIndexRegistry:
+    """Indexes of the most recently queried chats, built from the history store on first use."""
+
+    def __init__(self, max_chats: int = CHAT_INDEX_MAX_CHATS, capacity: int = CHAT_INDEX_SIZE):
+        self.max_chats = max_chats
+        self.capacity = capacity
+        self._chats: "OrderedDict[str, ChatIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def append(self, chat_id: str, record: MessageRecord):
+        """Index a new message if the chat's index is loaded."""
+        index = self._chats.get(str(chat_id))
+        if index is not None:
+            index.append(record)
+
+    async def get(self, chat_id: str, recent: Iterable[MessageRecord] = ()) -> ChatIndex:
+        """The chat's index, loading it from the history store if needed.
+
+        `recent` are in-memory messages that may not have reached the store
+        yet; the ones newer than the store's last message are added.
+        """
+        chat_id = str(chat_id)
+        index = self._chats.get(chat_id)
+        if index is not None:
+            self._chats.move_to_end(chat_id)
+            return index
+        loading = self._loading.get(chat_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[chat_id] = future
+        try:
+            index = await asyncio.to_thread(self._build, chat_id)
+            last_id = index.last_message_id
+            for record in recent:
+                if last_id is None or record.message_id > last_id:
+                    index.append(record)
+            self._chats[chat_id] = index
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+            future.set_result(index)
+            return index
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; keep the exception from being reported as unretrieved
+            future.exception()
+            raise
+        finally:
+            del self._loading[chat_id]
+
+    def _build(self, chat_id: str) -> ChatIndex:
+        index = ChatIndex(self.capacity)
+        for record in history_store.load_recent(chat_id, self.capacity):
+            index.append(record)
+        return index
+
+    def drop(self, chat_id: str):
+        self._chats.pop(str(chat_id), None)
+
+
+# Create a global instance
+chat_indexes = ChatIndexRegistry()
@@ -17,8 +17,79 @@ logger = logging.getLogger(__name__)
 # Configuration
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 OPENROUTER_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
 MODE = os.getenv('MODE')
 CHANNELS_FILE = 'channels.yaml'
+# Named groups of channel settings that channels can select with the "profile" setting
+PROFILES_FILE = os.getenv('PROFILES_FILE', 'profiles.yaml')
+HISTORY_DB_FILE = os.getenv('HISTORY_DB_FILE', 'history.db')
+ERROR_CACHE_FILE = os.getenv('ERROR_CACHE_FILE', 'error_phrases.json')
+VERIFIED_CHANNELS_FILE = os.getenv('VERIFIED_CHANNELS_FILE', 'verified_channels.json')
+# Seconds to collect channel config changes before writing them
+CHANNEL_CONFIG_FLUSH_DELAY = float(os.getenv('CHANNEL_CONFIG_FLUSH_DELAY', 1.0))
+# Seconds between checks whether another shard worker changed channel configs
+CHANNEL_CONFIG_REFRESH_INTERVAL = float(os.getenv('CHANNEL_CONFIG_REFRESH_INTERVAL', 1.0))
+
+STATS_DB_FILE = os.getenv('STATS_DB_FILE', 'stats.db')
+# Seconds between writes of the aggregated request statistics
+STATS_FLUSH_INTERVAL = float(os.getenv('STATS_FLUSH_INTERVAL', 10))
+
+# Worker processes to shard chats across; 0 runs everything in one process
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', 0))
+# Config and counters shared by the shard workers
+SHARED_DB_FILE = os.getenv('SHARED_DB_FILE', 'shared.db')
+
+# Public base URL for webhook mode; long polling is used when it is empty
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token; a random one is used when empty
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Updates waiting for a worker; the webhook answers 503 when full so Telegram redelivers later
+UPDATE_QUEUE_SIZE = int(os.getenv('UPDATE_QUEUE_SIZE', 1000))
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', 16))
+
+# Channels verified within this many seconds are not re-checked on startup
+VERIFIED_CHANNEL_TTL = float(os.getenv('VERIFIED_CHANNEL_TTL', 24 * 3600))
+# Concurrent and per-second get_chat calls during channel verification
+VERIFY_CONCURRENCY = 8
+VERIFY_RATE = 20
+
+# Streaming: post a placeholder reply and edit it while the model is generating
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '1') == '1'
+# Minimum seconds between edits of a streamed reply (Telegram rate limits message edits)
+STREAM_UPDATE_INTERVAL = float(os.getenv('STREAM_UPDATE_INTERVAL', 2.0))
+
+# Message history limits
+HISTORY_SIZE = 500
+HISTORY_RETENTION = int(os.getenv('HISTORY_RETENTION', 20000))
+# Largest N a summary may ask for; messages beyond HISTORY_SIZE are read from the history store
+MAX_SUMMARY_MESSAGES = int(os.getenv('MAX_SUMMARY_MESSAGES', 10000))
+# Messages per chat kept in the time/author/keyword index, and chats indexed at once
+CHAT_INDEX_SIZE = int(os.getenv('CHAT_INDEX_SIZE', MAX_SUMMARY_MESSAGES))
+CHAT_INDEX_MAX_CHATS = int(os.getenv('CHAT_INDEX_MAX_CHATS', 16))
+# Windows with a larger prompt are summarized in parts that are then merged (map-reduce)
+SUMMARY_DIRECT_MAX_TOKENS = int(os.getenv('SUMMARY_DIRECT_MAX_TOKENS', 64000))
+# Size of one part, and how many parts are summarized at once
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', 16000))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv('SUMMARY_MAP_CONCURRENCY', 4))
+# Most partial summaries merged by one call when they still do not fit the final prompt
+SUMMARY_REDUCE_FANOUT = 8
+
+# Embeddings for /ask retrieval: an embeddings API model, or a local hashing embedder when empty
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', '')
+EMBEDDING_BASE_URL = os.getenv('EMBEDDING_BASE_URL', OPENROUTER_BASE_URL)
+# Size of the local embeddings, and texts sent per embeddings call
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', 256))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 128))
+# Memory-mapped per-chat vector indexes live here
+VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', 'vectors')
+# Messages per chat kept in the vector index, and chats kept open at once
+VECTOR_INDEX_SIZE = int(os.getenv('VECTOR_INDEX_SIZE', HISTORY_RETENTION))
+VECTOR_INDEX_MAX_CHATS = int(os.getenv('VECTOR_INDEX_MAX_CHATS', CHAT_INDEX_MAX_CHATS))
+# Chats with more vectors are searched through an inverted-file (IVF) index over 8-bit codes
+VECTOR_IVF_MIN = int(os.getenv('VECTOR_IVF_MIN', 20000))
+# IVF lists scanned per query
+VECTOR_NPROBE = int(os.getenv('VECTOR_NPROBE', 8))
 
 # Supported models
 SUPPORTED_MODELS = [
@@ -30,6 +101,50 @@ SUPPORTED_MODELS = [
     "google/gemini-2.0-flash-001"
 ]
 
+# Context window and output limits per model in tokens, and request rate limits
+MODEL_CAPABILITIES = {
+    "qwen/qwen3-235b-a22b:free": {"context_tokens": 40960, "max_output_tokens": 8192, "requests_per_minute": 20},
+    "qwen/qwen3-14b:free": {"context_tokens": 40960, "max_output_tokens": 8192, "requests_per_minute": 20},
+    "meta-llama/llama-3.2-3b-instruct:free": {"context_tokens": 20000, "max_output_tokens": 4096, "requests_per_minute": 20},
+    "meta-llama/llama-3.2-3b-instruct": {"context_tokens": 131072, "max_output_tokens": 16384, "requests_per_minute": 600},
+    "deepseek/deepseek-r1:free": {"context_tokens": 163840, "max_output_tokens": 16384, "requests_per_minute": 20},
+    "google/gemini-2.0-flash-001": {"context_tokens": 1048576, "max_output_tokens": 8192, "requests_per_minute": 600},
+    "google/gemini-2.5-flash-preview-05-20": {"context_tokens": 1048576, "max_output_tokens": 65535, "requests_per_minute": 600},
+}
+# Used for models missing from MODEL_CAPABILITIES
+DEFAULT_MODEL_CAPABILITIES = {"context_tokens": 32768, "max_output_tokens": 4096, "requests_per_minute": 60}
+
+# USD per million prompt and completion tokens, as listed on openrouter.ai/models
+MODEL_PRICES = {
+    "qwen/qwen3-235b-a22b:free": (0.0, 0.0),
+    "qwen/qwen3-14b:free": (0.0, 0.0),
+    "meta-llama/llama-3.2-3b-instruct:free": (0.0, 0.0),
+    "meta-llama/llama-3.2-3b-instruct": (0.015, 0.025),
+    "deepseek/deepseek-r1:free": (0.0, 0.0),
+    "google/gemini-2.0-flash-001": (0.10, 0.40),
+    "google/gemini-2.5-flash-preview-05-20": (0.15, 0.60),
+}
+# Used for models missing from MODEL_PRICES, on the expensive side so unknown models are not free
+DEFAULT_MODEL_PRICE = (1.0, 4.0)
+# Channels over their daily budget are served by this model with at most this many messages per summary
+BUDGET_MODEL = os.getenv('BUDGET_MODEL', 'google/gemini-2.0-flash-001')
+BUDGET_MAX_MESSAGES = int(os.getenv('BUDGET_MAX_MESSAGES', 100))
+
+# Maximum number of LLM calls in flight at once
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+
+# Prompt assembly and HTML cleanup move off the event loop above these sizes.
+# Below about 2000 messages assembling a prompt (about 1-2us per message, see
+# benchmarks/offload_threshold.py) takes less than the GIL slice a worker
+# thread holds, so offloading would only add the thread round trip
+OFFLOAD_MIN_MESSAGES = int(os.getenv('OFFLOAD_MIN_MESSAGES', 2000))
+OFFLOAD_MIN_CHARS = int(os.getenv('OFFLOAD_MIN_CHARS', 200000))
+CPU_OFFLOAD_WORKERS = int(os.getenv('CPU_OFFLOAD_WORKERS', 2))
+# How often the event loop lag probe wakes up, in seconds
+LOOP_LAG_INTERVAL = 0.1
+# Seconds before an LLM request is abandoned and retried
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 120))
+
 def load_user_mappings():
     """Load user mappings from JSON file."""
     try:
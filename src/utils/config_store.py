@@ -0,0 +1,92 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+from utils.atomic_file import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigFileStore:
+    """Per-channel configurations in a JSON snapshot plus an append-only journal.
+
+    A change appends one line `{"id": channel_id, "config": {...} | null}`
+    to the journal and fsyncs it, so saving costs the size of the change,
+    not of all configurations. When the journal outgrows the snapshot it is
+    folded into a new snapshot, written to a temporary file, fsynced and
+    renamed over the old one. Loading reads the snapshot and replays the
+    journal; a torn last line from a crash is cut off and damaged lines are
+    skipped.
+    """
+
+    def __init__(self, path: str, min_compact_lines: int = 1000):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.min_compact_lines = min_compact_lines
+        self.journal_lines = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        """Read the snapshot and apply the journal on top of it."""
+        configs: Dict[str, dict] = {}
+        with self._lock:
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        configs = {str(k): v for k, v in json.load(f).items()}
+                except Exception as e:
+                    logger.error(f"Error loading channel configs from {self.path}: {str(e)}")
+            self.journal_lines = 0
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'r+b') as f:
+                    data = f.read()
+                    end = data.rfind(b"\n") + 1
+                    if end < len(data):
+                        # Drop a torn tail so the next append starts on a fresh line
+                        logger.warning(f"Dropping {len(data) - end} bytes of an unfinished write in {self.journal_path}")
+                        f.truncate(end)
+                for number, line in enumerate(data[:end].splitlines(), 1):
+                    try:
+                        entry = json.loads(line)
+                        channel_id, config = str(entry["id"]), entry["config"]
+                    except Exception:
+                        logger.warning(f"Skipping damaged line {number} of {self.journal_path}")
+                        continue
+                    if config is None:
+                        configs.pop(channel_id, None)
+                    else:
+                        configs[channel_id] = config
+                    self.journal_lines += 1
+        return configs
+
+    def append(self, lines: List[str]):
+        """Durably append serialized journal lines."""
+        if not lines:
+            return
+        with self._lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_lines += len(lines)
+
+    def needs_compaction(self, configs: int, new_lines: int = 0) -> bool:
+        """Whether the journal, after `new_lines` more, is longer than the snapshot is worth."""
+        return self.journal_lines + new_lines > max(self.min_compact_lines, configs)
+
+    def compact(self, configs: Dict[str, dict]):
+        """Replace the snapshot with `configs` and empty the journal."""
+        with self._lock:
+            write_json_atomic(self.path, configs, ensure_ascii=False, indent=2)
+            # Replaying an old journal over the new snapshot is harmless, so a
+            # crash between the rename and this truncation loses nothing
+            with open(self.journal_path, 'w', encoding='utf-8') as f:
+                f.flush()
+                os.fsync(f.fileno())
+            self.journal_lines = 0
+
+    @staticmethod
+    def entry(channel_id: str, config: Optional[dict]) -> str:
+        """Serialize one change as a journal line."""
+        return json.dumps({"id": channel_id, "config": config}, ensure_ascii=False) + "\n"
@@ -0,0 +1,99 @@
+import sys
+from typing import Optional
+
+
+class MessageRecord:
+    """Compact copy of the message fields used for summarization.
+
+    The message's prompt line is rendered once and kept, so every summary
+    that includes the message reuses the same string.
+    """
+
+    __slots__ = ("message_id", "date", "author", "text", "caption", "forward_from", "reply_snippet", "_line")
+
+    def __init__(self, message_id: int, date: float, author: str = "", text: Optional[str] = None,
+                 caption: Optional[str] = None, forward_from: Optional[str] = None,
+                 reply_snippet: Optional[str] = None):
+        self.message_id = message_id
+        self.date = date
+        self.author = author
+        self.text = text
+        self.caption = caption
+        self.forward_from = forward_from
+        self.reply_snippet = reply_snippet
+        self._line: Optional[str] = None
+
+    @property
+    def line(self) -> str:
+        """The message as a prompt line, or "" if it has no text."""
+        line = self._line
+        if line is None:
+            line = self._line = self.render()
+        return line
+
+    def render(self) -> str:
+        if not (self.text or self.caption or self.reply_snippet):
+            return ""
+        parts = []
+        if self.author:
+            parts.append(self.author)
+        if self.forward_from:
+            parts.append(" forwarded from ")
+            parts.append(self.forward_from)
+        if parts:
+            parts.append(": ")
+        if self.text:
+            parts.append(self.text)
+        if self.caption:
+            parts.append(" Caption: ")
+            parts.append(self.caption)
+        if self.reply_snippet:
+            parts.append(" In response to '")
+            parts.append(self.reply_snippet)
+            parts.append("'")
+        parts.append("\n")
+        return "".join(parts)
+
+    @classmethod
+    def from_message(cls, msg) -> "MessageRecord":
+        """Build a record from a telegram.Message, dropping the rest of the object graph."""
+        author = ""
+        if msg.from_user:
+            if msg.from_user.username:
+                author = f"@{msg.from_user.username}"
+            elif getattr(msg, "effective_name", None):
+                author = msg.effective_name
+            else:
+                author = msg.from_user.full_name
+
+        forward_from = None
+        if getattr(msg, "forward_from_chat", None):
+            forward_from = f"chat {msg.forward_from_chat.effective_name}"
+        elif getattr(msg, "forward_from", None):
+            forward_from = f"user {msg.forward_from.username}"
+
+        reply_snippet = None
+        reply = msg.reply_to_message
+        if reply:
+            reply_snippet = " ".join(part for part in (reply.caption, reply.text) if part)
+
+        record = cls(
+            message_id=msg.message_id,
+            date=msg.date.timestamp() if msg.date else 0.0,
+            author=author,
+            text=msg.text,
+            caption=msg.caption,
+            forward_from=forward_from,
+            reply_snippet=reply_snippet,
+        )
+        # Render at ingest, off the path of summary requests
+        record._line = record.render()
+        return record
+
+    def memory_size(self) -> int:
+        """Approximate bytes held by the record and its strings."""
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(value)
+            for value in (self.author, self.text, self.caption, self.forward_from, self.reply_snippet, self._line)
+            if value is not None
+        )
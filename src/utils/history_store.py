@@ -0,0 +1,187 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+from utils.config import HISTORY_DB_FILE, HISTORY_RETENTION
+from utils.history import MessageRecord
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class HistoryStore:
+    """Append-only SQLite (WAL) store for chat history.
+
+    Appends are queued and written by a background thread in batches, one
+    transaction per batch, so the event loop never waits on disk.
+
+    A chat is trimmed to its last `retention` rows once `trim_slack` more
+    have been written to it, so it briefly holds up to retention + slack
+    rows but the cutoff is looked up once per slack rows rather than on
+    every batch.
+    """
+
+    def __init__(self, db_file: str = HISTORY_DB_FILE, batch_size: int = 1000,
+                 flush_interval: float = 0.2, retention: int = HISTORY_RETENTION,
+                 trim_slack: Optional[int] = None):
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.trim_slack = trim_slack if trim_slack is not None else max(1, retention // 10)
+        # Rows written per chat since it was last trimmed; used by the writer thread only
+        self._untrimmed: Dict[str, int] = {}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Shard workers share the file, so wait for each other's write transactions
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """Create the schema and start the writer thread."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS messages (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        chat_id TEXT NOT NULL,
+                        message_id INTEGER NOT NULL,
+                        date REAL NOT NULL,
+                        author TEXT,
+                        text TEXT,
+                        caption TEXT,
+                        forward_from TEXT,
+                        reply_snippet TEXT
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat_id, id)")
+            conn.close()
+            self._thread = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+            self._thread.start()
+            logger.info(f"History store started at {self.db_file}")
+
+    def append(self, chat_id: str, record: MessageRecord):
+        """Queue a record for writing. Never blocks."""
+        if self._thread is None:
+            self.start()
+        self._queue.put((str(chat_id), record))
+
+    def _select(self, chat_id: str, condition: str, params: tuple) -> List[MessageRecord]:
+        """Records of a chat matching an SQL condition, newest first."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT message_id, date, author, text, caption, forward_from, reply_snippet "
+                f"FROM messages WHERE chat_id = ? {condition}",
+                (str(chat_id),) + params,
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.error(f"Error loading history for chat {chat_id}: {str(e)}")
+            return []
+        finally:
+            conn.close()
+        return [MessageRecord(*row) for row in rows]
+
+    def load_recent(self, chat_id: str, limit: int) -> List[MessageRecord]:
+        """Return the last `limit` records for a chat, oldest first."""
+        return self._select(chat_id, "ORDER BY id DESC LIMIT ?", (limit,))[::-1]
+
+    def load_after(self, chat_id: str, message_id: Optional[int], limit: int) -> List[MessageRecord]:
+        """Return the last `limit` records newer than `message_id` (all if None), oldest first."""
+        if message_id is None:
+            return self.load_recent(chat_id, limit)
+        return self._select(chat_id, "AND message_id > ? ORDER BY id DESC LIMIT ?", (message_id, limit))[::-1]
+
+    def load_messages(self, chat_id: str, message_ids: List[int]) -> List[MessageRecord]:
+        """Return the records with the given message ids, oldest first."""
+        if not message_ids:
+            return []
+        placeholders = ",".join("?" * len(message_ids))
+        return self._select(chat_id, f"AND message_id IN ({placeholders}) ORDER BY id DESC", tuple(message_ids))[::-1]
+
+    def close(self, timeout: float = 5.0):
+        """Flush pending writes and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+            thread.join(timeout)
+            self._thread = None
+
+    def _writer(self):
+        conn = self._connect()
+        running = True
+        try:
+            while running:
+                try:
+                    item = self._queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while True:
+                    if item is _STOP:
+                        running = False
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._write_batch(conn, batch)
+        finally:
+            conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list):
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO messages (chat_id, message_id, date, author, text, caption, forward_from, reply_snippet) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (chat_id, r.message_id, r.date, r.author, r.text, r.caption, r.forward_from, r.reply_snippet)
+                        for chat_id, r in batch
+                    ],
+                )
+                if self.retention:
+                    self._trim(conn, batch)
+        except Exception as e:
+            logger.error(f"Error writing {len(batch)} messages to history store: {str(e)}")
+
+    def _trim(self, conn: sqlite3.Connection, batch: list):
+        """Delete the rows beyond retention of the chats that are due for trimming."""
+        for chat_id, _ in batch:
+            # Chats not seen since startup may already be over retention, so they are due at once
+            self._untrimmed[chat_id] = self._untrimmed.get(chat_id, self.trim_slack - 1) + 1
+        for chat_id in {chat_id for chat_id, _ in batch}:
+            if self._untrimmed[chat_id] < self.trim_slack:
+                continue
+            self._untrimmed[chat_id] = 0
+            row = conn.execute(
+                "SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                (chat_id, self.retention),
+            ).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM messages WHERE chat_id = ? AND id <= ?", (chat_id, row[0]))
+
+
+# Create a global instance
+history_store = HistoryStore()
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+from utils.config import LOOP_LAG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Lags above this are logged as stalls
+STALL_THRESHOLD = 0.25
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task that sleeps for a fixed interval.
+
+    The delay beyond the interval is time the loop spent running other
+    callbacks, i.e. how long any incoming update would have waited.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, window: int = 600):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start probing the running loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag > STALL_THRESHOLD:
+                self.stalls += 1
+                logger.warning(f"Event loop stalled for {lag:.3f}s")
+
+    def get_stats(self) -> dict:
+        """Get lag statistics over the recent window."""
+        samples = sorted(self.samples)
+        if not samples:
+            return {"current": 0.0, "avg": 0.0, "p99": 0.0, "max": self.max_lag, "stalls": self.stalls}
+        return {
+            "current": self.samples[-1],
+            "avg": sum(samples) / len(samples),
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": self.max_lag,
+            "stalls": self.stalls,
+        }
+
+
+# Create a global instance
+loop_monitor = LoopLagMonitor()
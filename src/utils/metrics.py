@@ -0,0 +1,211 @@
+import abc
+import functools
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+# Seconds; covers fast handlers as well as long LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _Buckets:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # Per-bucket counts, the last one is +Inf; made cumulative on export
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines in the Prometheus text format."""
+
+
+class _SeriesMetric(_Metric):
+    """Metric that keeps a series per label values, updated through labels()."""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A new, empty series."""
+
+    def labels(self, *values):
+        """Get the series for these label values, creating it on first use."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _series(self):
+        return list(self._children.items())
+
+
+class Counter(_SeriesMetric):
+    """Monotonic counter."""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}" for values, child in self._series()]
+
+
+class Histogram(_SeriesMetric):
+    """Distribution of observed values in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        lines = []
+        for values, child in self._series():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+class Gauge(_Metric):
+    """Value read from a callback when metrics are exported.
+
+    The callback returns a number, or a dict of label values to numbers when
+    the gauge has labels. There are no series to update, so a gauge has no
+    labels().
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], GaugeValue], labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {float(v)}" for labels, v in value.items()]
+
+
+class MetricsRegistry:
+    """Collects metrics and renders them in the Prometheus text format.
+
+    Values are plain Python numbers updated from the event loop thread, so
+    recording a sample takes no lock and costs a dict lookup and an add.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable[[], GaugeValue], labelnames: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, callback, labelnames))
+
+    def render(self) -> str:
+        """Export all metrics."""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Create a global instance
+metrics = MetricsRegistry()
+
+HANDLER_LATENCY = metrics.histogram("bot_handler_seconds", "Time spent in a bot update handler", ["handler"])
+HANDLER_ERRORS = metrics.counter("bot_handler_errors_total", "Exceptions raised by bot update handlers", ["handler"])
+
+
+def instrument(callback, name: Optional[str] = None):
+    """Wrap an update handler callback to record its latency and exceptions."""
+    histogram = HANDLER_LATENCY.labels(name or callback.__name__)
+    errors = HANDLER_ERRORS.labels(name or callback.__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
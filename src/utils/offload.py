@@ -0,0 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TypeVar
+from utils.config import CPU_OFFLOAD_WORKERS
+
+T = TypeVar("T")
+
+# Threads rather than processes: copying a window of messages to another
+# process costs more than formatting it. While a worker thread runs Python
+# code the interpreter hands the GIL back to the event loop every few
+# milliseconds, so one large job no longer stalls every other chat.
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_OFFLOAD_WORKERS, thread_name_prefix="cpu-offload")
+
+
+async def run_cpu(func: Callable[..., T], *args, offload: bool = True) -> T:
+    """Run a CPU-bound function in the offload pool, or inline when `offload` is False."""
+    if not offload:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor, func, *args)
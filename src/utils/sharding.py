@@ -0,0 +1,33 @@
+import zlib
+from typing import Optional
+
+# Set in each worker process by set_shard; a single process owns every chat
+shard_index = 0
+shard_count = 1
+
+
+def shard_for(chat_id, shards: int) -> int:
+    """Stable shard of a chat. Uses crc32 because hash() differs between processes."""
+    return zlib.crc32(str(chat_id).encode()) % shards
+
+
+def set_shard(index: int, count: int):
+    """Make this process the worker for shard `index` of `count`."""
+    global shard_index, shard_count
+    shard_index = index
+    shard_count = count
+
+
+def owns(chat_id) -> bool:
+    """Check whether this process handles the chat."""
+    return shard_count == 1 or shard_for(chat_id, shard_count) == shard_index
+
+
+def update_chat_id(data: dict) -> Optional[int]:
+    """Chat id of a raw update, if it carries one."""
+    for value in data.values():
+        if isinstance(value, dict):
+            chat = value.get("chat") or (value.get("message") or {}).get("chat")
+            if chat:
+                return chat.get("id")
+    return None
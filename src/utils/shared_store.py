@@ -0,0 +1,74 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, Optional
+from utils.config import SHARED_DB_FILE
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStore:
+    """SQLite (WAL) store for state that all shard workers must see.
+
+    Holds channel configurations. Each process opens its own connection;
+    `data_version` tells a process whether another one has committed since
+    it last looked.
+    """
+
+    def __init__(self, db_file: str = SHARED_DB_FILE):
+        self.db_file = db_file
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS channel_config (channel_id TEXT PRIMARY KEY, config TEXT NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def data_version(self) -> int:
+        """Changes whenever another connection commits to the database."""
+        with self._lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load_configs(self) -> Dict[str, dict]:
+        """Load all channel configurations."""
+        with self._lock:
+            rows = self.conn.execute("SELECT channel_id, config FROM channel_config").fetchall()
+        return {channel_id: json.loads(config) for channel_id, config in rows}
+
+    def save_config(self, channel_id: str, config: Optional[dict]):
+        """Store the configuration of one channel, or delete it when `config` is None."""
+        with self._lock:
+            if config is None:
+                self.conn.execute("DELETE FROM channel_config WHERE channel_id = ?", (str(channel_id),))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO channel_config (channel_id, config) VALUES (?, ?)",
+                    (str(channel_id), json.dumps(config, ensure_ascii=False)),
+                )
+
+    def replace_configs(self, configs: Dict[str, dict]):
+        """Replace all channel configurations in one transaction."""
+        with self._lock, self.conn as conn:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM channel_config")
+            conn.executemany(
+                "INSERT INTO channel_config (channel_id, config) VALUES (?, ?)",
+                [(str(k), json.dumps(v, ensure_ascii=False)) for k, v in configs.items()],
+            )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Create a global instance
+shared_store = SharedStore()
@@ -1,26 +1,289 @@
-from collections import defaultdict
-from typing import Dict
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Dict, Optional, Tuple
+from utils.config import STATS_DB_FILE, STATS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Bucket sizes in seconds and how long buckets of each size are kept. Every
+# event is added to all three, so dropping expired fine buckets loses nothing
+# the coarser ones do not already hold.
+RESOLUTIONS = {
+    60: 2 * 86400,
+    3600: 35 * 86400,
+    86400: 400 * 86400,
+}
+# Compact at most this often
+COMPACT_INTERVAL = 3600
+
+# requests, calls, errors, call_errors, latency_sum, latency_max, prompt_tokens, completion_tokens, cost
+_FIELDS = 9
+_LATENCY_MAX = 5
+
+_Key = Tuple[int, int, str, str, str]
+
 
 class RequestStats:
-    def __init__(self):
-        self.total_requests = 0
-        self.channel_requests: Dict[str, int] = defaultdict(int)
-        self.ask_requests: Dict[str, int] = defaultdict(int)
-
-    def increment(self, channel_id: str, is_ask: bool = False):
-        """Increment request counters."""
-        self.total_requests += 1
-        self.channel_requests[str(channel_id)] += 1
-        if is_ask:
-            self.ask_requests[str(channel_id)] += 1
-
-    def get_stats(self) -> dict:
-        """Get current statistics."""
-        return {
-            "total_requests": self.total_requests,
-            "channel_requests": dict(self.channel_requests),
-            "ask_requests": dict(self.ask_requests)
-        }
+    """Time-bucketed request statistics persisted to SQLite.
+
+    Events are aggregated in memory per (bucket, channel, model, command) at
+    minute, hour and day resolution and flushed in one transaction every
+    STATS_FLUSH_INTERVAL seconds from a worker thread. Request rows count
+    user-facing requests and their latency; call rows count LLM API calls,
+    their token usage and cost in USD.
+    """
+
+    def __init__(self, db_file: str = STATS_DB_FILE, flush_interval: float = STATS_FLUSH_INTERVAL):
+        self.db_file = db_file
+        self.flush_interval = flush_interval
+        self._pending: Dict[_Key, list] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_compact = 0.0
+        self._schema_ready = False
+        # Held while a flush moves pending rows to the database, so readers that
+        # combine the two never see rows in neither or in both
+        self._flush_lock = asyncio.Lock()
+        # channel_id -> (UTC day, cost so far that day), filled on first lookup
+        self._daily_cost: Dict[str, Tuple[int, float]] = {}
+
+    def record(self, channel_id: str, command: str, model: str = "", requests: int = 0, calls: int = 0,
+               errors: int = 0, call_errors: int = 0, latency: float = 0.0, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cost: float = 0.0):
+        """Add one event to the current buckets."""
+        now = int(time.time())
+        channel_id = str(channel_id or "default")
+        for resolution in RESOLUTIONS:
+            key = (resolution, now - now % resolution, channel_id, model or "", command)
+            row = self._pending.get(key)
+            if row is None:
+                row = self._pending[key] = [0] * _FIELDS
+            row[0] += requests
+            row[1] += calls
+            row[2] += errors
+            row[3] += call_errors
+            row[4] += latency
+            row[5] = max(row[5], latency)
+            row[6] += prompt_tokens
+            row[7] += completion_tokens
+            row[8] += cost
+        if cost:
+            spent = self._daily_cost.get(channel_id)
+            if spent is not None:
+                day = now - now % 86400
+                self._daily_cost[channel_id] = (day, (spent[1] if spent[0] == day else 0.0) + cost)
+
+    def record_request(self, channel_id: str, command: str, model: str = "", latency: float = 0.0, error: bool = False):
+        """Count a user-facing request."""
+        self.record(channel_id, command, model, requests=1, errors=int(error), latency=latency)
+
+    def record_call(self, channel_id: str, command: str, model: str, usage=None, error: bool = False,
+                    cost: float = 0.0):
+        """Count an LLM API call, the tokens it used and what it cost."""
+        self.record(
+            channel_id, command, model, calls=1, call_errors=int(error),
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cost=cost,
+        )
+
+    def record_coalesced(self, channel_id: str):
+        """Count a summary request answered by another in-flight or recent request."""
+        self.record(channel_id, "coalesced", requests=1)
+
+    def record_error_cache(self, hit: bool, channel_id: Optional[str] = None):
+        """Count an error phrase cache lookup."""
+        self.record(channel_id, "error_cache_hit" if hit else "error_cache_miss", requests=1)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS stats (
+                    resolution INTEGER NOT NULL,
+                    bucket INTEGER NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    command TEXT NOT NULL,
+                    requests INTEGER NOT NULL,
+                    calls INTEGER NOT NULL,
+                    errors INTEGER NOT NULL,
+                    call_errors INTEGER NOT NULL,
+                    latency_sum REAL NOT NULL,
+                    latency_max REAL NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    cost REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (resolution, bucket, channel_id, model, command)
+                ) WITHOUT ROWID"""
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(stats)")}
+            if "cost" not in columns:
+                conn.execute("ALTER TABLE stats ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+            self._schema_ready = True
+        return conn
+
+    def _write(self, rows: Dict[_Key, list], compact: bool):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(
+                    """INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (resolution, bucket, channel_id, model, command) DO UPDATE SET
+                           requests = requests + excluded.requests,
+                           calls = calls + excluded.calls,
+                           errors = errors + excluded.errors,
+                           call_errors = call_errors + excluded.call_errors,
+                           latency_sum = latency_sum + excluded.latency_sum,
+                           latency_max = MAX(latency_max, excluded.latency_max),
+                           prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                           completion_tokens = completion_tokens + excluded.completion_tokens,
+                           cost = cost + excluded.cost""",
+                    [key + tuple(row) for key, row in rows.items()],
+                )
+                if compact:
+                    now = int(time.time())
+                    for resolution, retention in RESOLUTIONS.items():
+                        conn.execute("DELETE FROM stats WHERE resolution = ? AND bucket < ?",
+                                     (resolution, now - retention))
+        finally:
+            conn.close()
+
+    async def flush(self):
+        """Write the pending buckets."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, {}
+            compact = time.monotonic() - self._last_compact > COMPACT_INTERVAL
+            try:
+                await asyncio.to_thread(self._write, rows, compact)
+                if compact:
+                    self._last_compact = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error flushing stats: {str(e)}")
+                # Keep the rows for the next flush
+                for key, row in rows.items():
+                    self._merge_row(key, row)
+
+    def _merge_row(self, key: _Key, row: list):
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = row
+            return
+        for i in range(_FIELDS):
+            pending[i] = max(pending[i], row[i]) if i == _LATENCY_MAX else pending[i] + row[i]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        """Start flushing periodically on the running loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    def close(self):
+        """Stop the flush task and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._pending:
+            rows, self._pending = self._pending, {}
+            try:
+                self._write(rows, compact=False)
+            except Exception as e:
+                logger.error(f"Error flushing stats: {str(e)}")
+
+    def _query(self, channel_id: Optional[str], since: int) -> dict:
+        conn = self._connect()
+        try:
+            where = "resolution = 3600 AND bucket >= ?"
+            params = [since]
+            if channel_id is not None:
+                where += " AND channel_id = ?"
+                params.append(str(channel_id))
+            rows = conn.execute(
+                f"""SELECT command, model, SUM(requests), SUM(calls), SUM(errors), SUM(call_errors), SUM(latency_sum), MAX(latency_max),
+                           SUM(prompt_tokens), SUM(completion_tokens), SUM(cost)
+                    FROM stats WHERE {where} GROUP BY command, model""",
+                params,
+            ).fetchall()
+        finally:
+            conn.close()
+
+        commands: Dict[str, dict] = {}
+        models: Dict[str, dict] = {}
+        for command, model, requests, calls, errors, call_errors, latency_sum, latency_max, prompt_tokens, completion_tokens, cost in rows:
+            entry = commands.setdefault(command, {"requests": 0, "calls": 0, "errors": 0, "call_errors": 0, "latency_sum": 0.0,
+                                                  "latency_max": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            entry["requests"] += requests
+            entry["calls"] += calls
+            entry["errors"] += errors
+            entry["call_errors"] += call_errors
+            entry["latency_sum"] += latency_sum
+            entry["latency_max"] = max(entry["latency_max"], latency_max)
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost"] += cost
+            if calls and model:
+                usage = models.setdefault(model, {"calls": 0, "call_errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                                  "cost": 0.0})
+                usage["calls"] += calls
+                usage["call_errors"] += call_errors
+                usage["prompt_tokens"] += prompt_tokens
+                usage["completion_tokens"] += completion_tokens
+                usage["cost"] += cost
+        for entry in commands.values():
+            entry["avg_latency"] = entry["latency_sum"] / entry["requests"] if entry["requests"] else 0.0
+        return {"commands": commands, "models": models}
+
+    async def get_stats(self, channel_id: Optional[str] = None, hours: int = 24) -> dict:
+        """Totals per command and per model over the last `hours` hourly buckets."""
+        await self.flush()
+        now = int(time.time())
+        since = now - now % 3600 - (hours - 1) * 3600
+        return await asyncio.to_thread(self._query, channel_id, since)
+
+    def _query_cost(self, channel_id: str, day: int) -> float:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT SUM(cost) FROM stats WHERE resolution = 86400 AND bucket = ? AND channel_id = ?",
+                (day, channel_id),
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] or 0.0
+
+    async def get_daily_cost(self, channel_id: str) -> float:
+        """What a channel has spent since the start of the current UTC day.
+
+        Read from the database once per channel and day, then kept up to date
+        by record().
+        """
+        channel_id = str(channel_id or "default")
+        now = int(time.time())
+        day = now - now % 86400
+        spent = self._daily_cost.get(channel_id)
+        if spent is not None and spent[0] == day:
+            return spent[1]
+        # No flush may move pending rows into the database between reading one and the other
+        async with self._flush_lock:
+            try:
+                stored = await asyncio.to_thread(self._query_cost, channel_id, day)
+            except Exception as e:
+                logger.error(f"Error reading daily cost: {str(e)}")
+                return 0.0
+            pending = sum(row[8] for key, row in self._pending.items()
+                          if key[0] == 86400 and key[1] == day and key[2] == channel_id)
+        self._daily_cost[channel_id] = (day, stored + pending)
+        return stored + pending
+
 
 # Create a global instance
-request_stats = RequestStats() 
\ No newline at end of file
+request_stats = RequestStats()
@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+from typing import List
+
+WORD_PATTERN = re.compile(r"\w+")
+# Shorter words are not indexed
+MIN_WORD_LENGTH = 2
+# Stems are never cut shorter than this
+MIN_STEM_LENGTH = 3
+
+STOP_WORDS = {
+    # Russian
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так", "его", "но",
+    "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "мне", "было", "вот", "от", "меня", "еще",
+    "нет", "о", "из", "ему", "теперь", "когда", "даже", "ну", "ли", "если", "уже", "или", "ни", "быть", "был",
+    "него", "до", "вас", "нибудь", "опять", "уж", "вам", "ведь", "там", "потом", "себя", "ничего", "ей", "может",
+    "они", "тут", "где", "есть", "надо", "ней", "для", "мы", "тебя", "их", "чем", "была", "сам", "чтоб", "без",
+    "будто", "чего", "раз", "тоже", "себе", "под", "будет", "ж", "тогда", "кто", "этот", "это", "эти", "того",
+    "потому", "этого", "какой", "совсем", "ним", "здесь", "этом", "один", "почти", "мой", "тем", "чтобы", "нее",
+    # English
+    "the", "and", "a", "an", "of", "to", "in", "is", "it", "that", "for", "on", "was", "with", "as", "at", "be",
+    "by", "this", "are", "or", "from", "but", "not", "have", "has", "had", "you", "he", "she", "we", "they", "i",
+    "me", "my", "your", "its", "our", "their", "do", "does", "did", "so", "if", "no", "yes", "just", "what",
+}
+
+RUSSIAN_ENDINGS = frozenset((
+    "аешь", "яешь", "аете", "яете", "иями", "аем", "яем", "ает", "яет", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ешь", "ишь", "ете", "ите", "ают", "яют",
+    "ует", "уют", "ать", "ять", "еть", "ить", "уть", "ала", "яла", "ила", "ела", "али", "яли", "или", "ели",
+    "ая", "яя", "ое", "ее", "ой", "ей", "ий", "ый", "ые", "ие", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев",
+    "ую", "юю", "ию", "ия", "ья", "ье", "ут", "ют", "ет", "ит", "ал", "ял", "ил", "ел",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+))
+RUSSIAN_REFLEXIVE = ("ся", "сь")
+ENGLISH_ENDINGS = frozenset(("ingly", "edly", "ings", "ing", "ies", "ied", "ed", "es", "ly", "s"))
+# Ending lengths to try, longest first, so the most specific ending is removed
+ENDING_LENGTHS = (5, 4, 3, 2, 1)
+
+
+def is_cyrillic(word: str) -> bool:
+    return "а" <= word[0] <= "я" or word[0] == "ё"
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Cut a common inflectional ending so word forms share one index term.
+
+    A light suffix stripper rather than a full stemmer: "пиццу", "пиццы"
+    and "пицца" become "пицц", "meetings" and "meeting" become "meet".
+    """
+    if is_cyrillic(word):
+        word = word.replace("ё", "е")
+        for ending in RUSSIAN_REFLEXIVE:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                word = word[:-len(ending)]
+                break
+        endings = RUSSIAN_ENDINGS
+    else:
+        if word.endswith("ss"):
+            return word
+        endings = ENGLISH_ENDINGS
+    for length in ENDING_LENGTHS:
+        if len(word) - length >= MIN_STEM_LENGTH and word[-length:] in endings:
+            return word[:-length]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of a text, in order, without stop words."""
+    return [word for word in WORD_PATTERN.findall(text.lower())
+            if len(word) >= MIN_WORD_LENGTH and word not in STOP_WORDS]
+
+
+def terms(text: str) -> List[str]:
+    """Index terms of a text: stems of its words, in order."""
+    return [stem(word) for word in tokenize(text)]
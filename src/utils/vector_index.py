@@ -0,0 +1,271 @@
+import glob
+import json
+import logging
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+from utils.atomic_file import write_json_atomic
+from utils.config import VECTOR_INDEX_SIZE, VECTOR_IVF_MIN, VECTOR_NPROBE
+
+logger = logging.getLogger(__name__)
+
+# Sampled rows per IVF list when training the centroids, and k-means rounds
+IVF_TRAIN_PER_LIST = 40
+IVF_TRAIN_ITERATIONS = 10
+# Candidates found with the 8-bit codes that are re-scored exactly, per result
+IVF_REFINE_FACTOR = 4
+# Rows multiplied at once when assigning or quantizing, to bound temporary memory
+CHUNK_ROWS = 8192
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length, so a dot product is the cosine similarity. Zero rows stay zero."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32, copy=False)
+
+
+def top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the `k` highest scores, highest first and later positions first among equals."""
+    if k < len(scores):
+        positions = np.argpartition(-scores, k)[:k]
+    else:
+        positions = np.arange(len(scores))
+    return positions[np.lexsort((-positions, -scores[positions]))]
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """8-bit codes of rows, and the per-row scale that turns codes back into values."""
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for every row."""
+    if not len(vectors):
+        return np.empty(0, np.int64)
+    return np.concatenate([np.argmax(np.asarray(vectors[i:i + CHUNK_ROWS]) @ centroids.T, axis=1)
+                           for i in range(0, len(vectors), CHUNK_ROWS)])
+
+
+def train_centroids(vectors: np.ndarray, count: int, seed: int = 0) -> np.ndarray:
+    """Unit-length centroids from spherical k-means over a sample of the rows."""
+    rng = np.random.default_rng(seed)
+    size = min(len(vectors), count * IVF_TRAIN_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), size, replace=False))])
+    centroids = sample[rng.choice(size, count, replace=False)].copy()
+    for _ in range(IVF_TRAIN_ITERATIONS):
+        assignment = nearest(sample, centroids)
+        counts = np.bincount(assignment, minlength=count)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        used = counts > 0
+        # Sum each cluster's rows in one pass over the rows sorted by cluster;
+        # clusters that lost all their rows keep their old centroid
+        sums = np.add.reduceat(sample[np.argsort(assignment, kind="stable")], starts[used], axis=0)
+        centroids[used] = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """Embeddings of one chat's messages, searchable by cosine similarity.
+
+    Vectors (unit length, float32) are appended to a file and their message
+    ids to another, and read back through a memory map, so a chat costs
+    memory only for the pages a search touches. Small indexes are scanned
+    in full. From `ivf_min` vectors on, the index is also split into about
+    sqrt(n) lists around k-means centroids (IVF) with an 8-bit copy of
+    every vector in memory: a query scans the codes of the `nprobe` lists
+    closest to it and re-scores the best candidates exactly. New vectors
+    join their nearest list, and the centroids are retrained once the index
+    has doubled since training. The oldest vectors are dropped in batches
+    once the index holds a quarter more than `capacity`.
+
+    Files are `<path>.<generation>.vec` and `.ids`, plus `<path>.json`
+    naming the embedder, the dimension, the current generation and the
+    newest message id already considered for the index (`processed_id`,
+    which may be past the last indexed one when newer messages had no
+    text worth embedding). Dropping
+    old vectors writes a new generation and then replaces the JSON file, so
+    a crash never pairs vectors with the wrong message ids.
+    """
+
+    def __init__(self, path: str, embedder: str, capacity: int = VECTOR_INDEX_SIZE,
+                 ivf_min: int = VECTOR_IVF_MIN, nprobe: int = VECTOR_NPROBE):
+        self.path = path
+        self.embedder = embedder
+        self.capacity = capacity
+        self.ivf_min = ivf_min
+        self.nprobe = nprobe
+        self.dim: Optional[int] = None
+        self.generation = 0
+        self.ids = np.empty(0, np.int64)
+        self.processed_id: Optional[int] = None
+        self.vectors: Optional[np.ndarray] = None
+        # IVF state; centroids is None while the index is scanned in full
+        self.centroids: Optional[np.ndarray] = None
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        # Rows added to each list since its array was last extended
+        self._added: List[List[int]] = []
+        self.trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def last_message_id(self) -> Optional[int]:
+        return int(self.ids[-1]) if len(self.ids) else None
+
+    @property
+    def meta_path(self) -> str:
+        return f"{self.path}.json"
+
+    def _file(self, kind: str, generation: Optional[int] = None) -> str:
+        return f"{self.path}.{self.generation if generation is None else generation}.{kind}"
+
+    def load(self):
+        """Open the index files, discarding them if another embedder made them."""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Error loading vector index {self.meta_path}: {str(e)}")
+            self._remove_files()
+            return
+        if meta.get("embedder") != self.embedder:
+            logger.info(f"Vector index {self.path} was built by {meta.get('embedder')}, rebuilding for {self.embedder}")
+            self._remove_files()
+            return
+        self.dim, self.generation = int(meta["dim"]), int(meta["generation"])
+        ids_path, vec_path = self._file("ids"), self._file("vec")
+        ids = np.fromfile(ids_path, np.int64) if os.path.exists(ids_path) else np.empty(0, np.int64)
+        vec_size = os.path.getsize(vec_path) if os.path.exists(vec_path) else 0
+        count = min(len(ids), vec_size // (4 * self.dim))
+        if len(ids) != count or vec_size != 4 * self.dim * count:
+            # Cut off a batch that was only partly written
+            logger.warning(f"Truncating vector index {self.path} to {count} complete rows")
+            for path, size in ((ids_path, 8 * count), (vec_path, 4 * self.dim * count)):
+                with open(path, 'ab') as f:
+                    f.truncate(size)
+        self.ids = ids[:count]
+        processed = meta.get("processed")
+        if processed is None or len(ids) != count:
+            processed = self.last_message_id
+        elif self.last_message_id is not None:
+            processed = max(processed, self.last_message_id)
+        self.processed_id = processed
+        self._map()
+        if count >= self.ivf_min:
+            self._train()
+
+    def _write_meta(self):
+        write_json_atomic(self.meta_path, {"embedder": self.embedder, "dim": self.dim, "generation": self.generation,
+                                           "processed": self.processed_id})
+
+    def mark_processed(self, message_id: int):
+        """Record that messages up to `message_id` were considered, including ones that were not added."""
+        if self.processed_id is not None and message_id <= self.processed_id:
+            return
+        self.processed_id = message_id
+        # Before the first vector there is no dimension to write; the cursor then lives in memory only
+        if self.dim is not None:
+            self._write_meta()
+
+    def _remove_files(self):
+        for path in glob.glob(glob.escape(self.path) + ".*"):
+            os.remove(path)
+
+    def _map(self):
+        count = len(self.ids)
+        self.vectors = np.memmap(self._file("vec"), np.float32, 'r', shape=(count, self.dim)) if count else None
+
+    def add(self, message_ids: List[int], vectors: np.ndarray):
+        """Append unit-length vectors of new messages."""
+        if not len(message_ids):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._write_meta()
+        # Vectors first: on load, ids without a complete vector are cut off
+        with open(self._file("vec"), 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self._file("ids"), 'ab') as f:
+            f.write(np.asarray(message_ids, np.int64).tobytes())
+        first = len(self.ids)
+        self.ids = np.concatenate((self.ids, np.asarray(message_ids, np.int64)))
+        self._map()
+        if self.processed_id is None or self.last_message_id > self.processed_id:
+            self.processed_id = self.last_message_id
+
+        if len(self.ids) > self.capacity + self.capacity // 4:
+            self._evict(len(self.ids) - self.capacity)
+        elif self.centroids is not None and len(self.ids) < 2 * self.trained_size:
+            self._assign(first, vectors)
+        elif len(self.ids) >= self.ivf_min:
+            self._train()
+
+    def _train(self):
+        count = max(1, int(np.sqrt(len(self.ids))))
+        self.centroids = train_centroids(self.vectors, count)
+        parts = [quantize(np.asarray(self.vectors[i:i + CHUNK_ROWS])) for i in range(0, len(self.ids), CHUNK_ROWS)]
+        self.codes = np.concatenate([codes for codes, _ in parts])
+        self.scales = np.concatenate([scales for _, scales in parts])
+        assignment = nearest(self.vectors, self.centroids)
+        order = np.argsort(assignment, kind="stable")
+        self.lists = np.split(order, np.cumsum(np.bincount(assignment, minlength=count))[:-1])
+        self._added = [[] for _ in range(count)]
+        self.trained_size = len(self.ids)
+
+    def _assign(self, first: int, vectors: np.ndarray):
+        codes, scales = quantize(vectors)
+        self.codes = np.concatenate((self.codes, codes))
+        self.scales = np.concatenate((self.scales, scales))
+        for row, list_id in enumerate(nearest(vectors, self.centroids), first):
+            self._added[list_id].append(row)
+
+    def _list(self, list_id: int) -> np.ndarray:
+        if self._added[list_id]:
+            self.lists[list_id] = np.concatenate((self.lists[list_id], np.asarray(self._added[list_id], np.int64)))
+            self._added[list_id] = []
+        return self.lists[list_id]
+
+    def _evict(self, count: int):
+        """Write a new generation without the oldest `count` vectors."""
+        old_generation = self.generation
+        ids, vectors = self.ids[count:], np.asarray(self.vectors[count:])
+        self.generation += 1
+        vectors.tofile(self._file("vec"))
+        ids.tofile(self._file("ids"))
+        self._write_meta()
+        self.ids = ids
+        self._map()
+        for kind in ("vec", "ids"):
+            os.remove(self._file(kind, old_generation))
+        self.centroids = None
+        if len(self.ids) >= self.ivf_min:
+            self._train()
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """Message ids of the `k` vectors most similar to a unit-length query, best first."""
+        if self.vectors is None or k <= 0:
+            return []
+        query = np.asarray(query, np.float32)
+        if self.centroids is None:
+            scores = self.vectors @ query
+            rows = top(scores, k)
+            scores = scores[rows]
+        else:
+            probe = top(self.centroids @ query, self.nprobe)
+            candidates = np.concatenate([self._list(list_id) for list_id in probe])
+            approximate = (self.codes[candidates] @ query) * self.scales[candidates]
+            candidates = candidates[top(approximate, k * IVF_REFINE_FACTOR)]
+            scores = self.vectors[candidates] @ query
+            best = top(scores, k)
+            rows, scores = candidates[best], scores[best]
+        return [(int(self.ids[row]), float(score)) for row, score in zip(rows, scores)]
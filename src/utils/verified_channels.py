@@ -0,0 +1,57 @@
+import json
+import logging
+import os
+import time
+from typing import Dict
+from utils.atomic_file import file_lock, write_json_atomic
+from utils.config import VERIFIED_CHANNELS_FILE, VERIFIED_CHANNEL_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedChannelCache:
+    """Remembers when each channel was last verified so restarts can skip recent ones."""
+
+    def __init__(self, path: str = VERIFIED_CHANNELS_FILE, ttl: float = VERIFIED_CHANNEL_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.verified: Dict[str, float] = {}
+        self.load()
+
+    def load(self):
+        """Load verification times from file."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.verified = {str(k): float(v) for k, v in json.load(f).items()}
+        except Exception as e:
+            logger.error(f"Error loading verified channels: {str(e)}")
+            self.verified = {}
+
+    def save(self):
+        """Write verification times to file atomically, dropping expired entries."""
+        now = time.time()
+        try:
+            # Merge with the file under a lock so shard workers keep each other's entries
+            with file_lock(self.path):
+                mine = self.verified
+                self.load()
+                self.verified.update(mine)
+                data = {k: v for k, v in self.verified.items() if now - v < self.ttl}
+                write_json_atomic(self.path, data, indent=2)
+        except Exception as e:
+            logger.error(f"Error saving verified channels: {str(e)}")
+
+    def is_fresh(self, channel_id: str) -> bool:
+        """Check whether the channel was verified within the TTL."""
+        verified_at = self.verified.get(str(channel_id))
+        return verified_at is not None and time.time() - verified_at < self.ttl
+
+    def mark(self, channel_id: str):
+        """Record a successful verification."""
+        self.verified[str(channel_id)] = time.time()
+
+
+# Create a global instance
+verified_channels = VerifiedChannelCache()
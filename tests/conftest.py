@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The bot runs from src/ with top-level imports such as `utils.config`
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "fake")
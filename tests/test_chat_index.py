@@ -0,0 +1,58 @@
+from utils.chat_index import ChatIndex
+from utils.history import MessageRecord
+from utils.tokenizer import terms
+
+TEXTS = [
+    "pizza night at my place",
+    "the night was long, pizza was cold",
+    "who orders pizza",
+    "train is late",
+    "pizza night again?",
+]
+
+
+def make_index(capacity: int = 1000) -> ChatIndex:
+    index = ChatIndex(capacity)
+    for i, text in enumerate(TEXTS):
+        index.append(MessageRecord(i + 1, 1000.0 + 60 * i, "@alice" if i % 2 else "@bob", text))
+    return index
+
+
+def ids(records) -> list:
+    return [record.message_id for record in records]
+
+
+def test_select_by_time_range():
+    index = make_index()
+    assert ids(index.select(since=1060, until=1180)) == [2, 3, 4]
+    assert ids(index.select(since=1060, until=1180, limit=2)) == [3, 4]
+    assert ids(index.select(since=2000)) == []
+
+
+def test_select_by_author_and_words():
+    index = make_index()
+    assert ids(index.select(author="@Alice")) == [2, 4]
+    assert ids(index.select(words=terms("pizza"))) == [1, 2, 3, 5]
+    assert ids(index.select(words=terms("pizza night"))) == [1, 2, 5]
+    assert ids(index.select(author="@bob", words=terms("pizza"), since=1060)) == [3, 5]
+
+
+def test_select_phrase_needs_adjacent_words():
+    index = make_index()
+    phrase = tuple(terms("pizza night"))
+    assert ids(index.select(words=list(phrase), phrases=[phrase])) == [1, 5]
+    assert ids(index.select(words=list(phrase), phrases=[phrase], limit=1)) == [5]
+
+
+def test_select_after_eviction():
+    index = ChatIndex(capacity=4)
+    for i in range(10):
+        index.append(MessageRecord(i + 1, 1000.0 + i, "@bob", f"pizza {i}" if i % 2 else "train"))
+    assert len(index) <= 5
+    assert ids(index.select(words=terms("pizza"))) == [i + 1 for i in range(10 - len(index), 10) if i % 2]
+
+
+def test_timestamps_stay_sorted_for_late_messages():
+    index = make_index()
+    index.append(MessageRecord(6, 500.0, "@bob", "late pizza"))
+    assert ids(index.select(since=1200)) == [5, 6]
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from models import llm
+from models.coalescing import SummaryCoalescer
+from utils.history import MessageRecord
+
+
+def test_concurrent_requests_join_one_call():
+    coalescer = SummaryCoalescer()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "summary"
+
+    async def main():
+        return await asyncio.gather(*(coalescer.run("key", factory) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["summary"] * 3
+    assert [shared for _, shared in results] == [False, True, True]
+    assert not coalescer._inflight
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    coalescer = SummaryCoalescer()
+    started = asyncio.Event()
+
+    async def factory():
+        started.set()
+        await asyncio.sleep(0.01)
+        return "summary"
+
+    async def main():
+        first = asyncio.ensure_future(coalescer.run("key", factory))
+        await started.wait()
+        second = asyncio.ensure_future(coalescer.run("key", factory))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == ("summary", True)
+
+
+def test_widest_window_per_end_message_is_kept():
+    coalescer = SummaryCoalescer()
+    coalescer.remember("end", 100, "from 100")
+    # A narrower window ending at the same message does not replace the wider one
+    coalescer.remember("end", 150, "from 150")
+    assert coalescer.get_recent("end", 120) == "from 100"
+    assert coalescer.get_recent("end", 100) == "from 100"
+    # A wider window is not answered from a narrower one
+    assert coalescer.get_recent("end", 50) is None
+    coalescer.remember("end", 50, "from 50")
+    assert coalescer.get_recent("end", 100) == "from 50"
+    assert coalescer.get_recent("other end", 100) is None
+
+
+def test_expired_summary_is_not_reused():
+    coalescer = SummaryCoalescer(ttl=0.0)
+    coalescer.remember("end", 100, "from 100")
+    assert coalescer.get_recent("end", 100) is None
+
+
+def test_summary_error_is_not_cached(monkeypatch):
+    monkeypatch.setattr(llm, "summary_coalescer", SummaryCoalescer())
+    monkeypatch.setattr(llm, "request_stats", SimpleNamespace(record_request=lambda *args: None,
+                                                              record_coalesced=lambda *args: None))
+    outcomes = [llm.SummaryError("Error code 500, busy"), "summary"]
+
+    async def generate_summary(*args, **kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(llm, "generate_summary", generate_summary)
+    messages = [MessageRecord(i, 1000.0 + i, "@alice", f"message {i}") for i in range(5)]
+    assert asyncio.run(llm.get_chatgpt_summary(messages, model="m")) == "Error code 500, busy"
+    assert asyncio.run(llm.get_chatgpt_summary(messages, model="m")) == "summary"
+    assert not outcomes
+    # The successful one is reused
+    assert asyncio.run(llm.get_chatgpt_summary(messages, model="m")) == "summary"
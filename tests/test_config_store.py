@@ -0,0 +1,69 @@
+import json
+
+from utils.channel_config import ChannelConfig
+from utils.config_store import ConfigFileStore
+
+
+def write_store(tmp_path, snapshot: dict, journal: bytes) -> ConfigFileStore:
+    store = ConfigFileStore(str(tmp_path / "channel_config.json"))
+    with open(store.path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f)
+    with open(store.journal_path, "wb") as f:
+        f.write(journal)
+    return store
+
+
+def test_replay_skips_a_corrupt_line_and_cuts_a_torn_tail(tmp_path):
+    journal = (ConfigFileStore.entry("b", {"ask_context": 2})
+               + "{not json\n"
+               + ConfigFileStore.entry("a", None)
+               + ConfigFileStore.entry("c", {"ask_context": 3})).encode("utf-8")
+    store = write_store(tmp_path, {"a": {"ask_context": 1}}, journal + b'{"id": "d", "con')
+
+    assert store.load() == {"b": {"ask_context": 2}, "c": {"ask_context": 3}}
+    assert store.journal_lines == 3
+    with open(store.journal_path, "rb") as f:
+        assert f.read() == journal
+
+    # The next change starts on a line of its own
+    store.append([ConfigFileStore.entry("d", {"ask_context": 4})])
+    assert ConfigFileStore(store.path).load()["d"] == {"ask_context": 4}
+
+
+def test_journal_longer_than_the_channels_is_compacted(tmp_path):
+    store = write_store(tmp_path, {}, b"")
+    store.min_compact_lines = 0
+    store.append([ConfigFileStore.entry("a", {"ask_context": i}) for i in range(3)])
+    configs = store.load()
+    assert configs == {"a": {"ask_context": 2}}
+    assert store.needs_compaction(len(configs))
+
+    store.compact(configs)
+    assert store.journal_lines == 0
+    assert not store.needs_compaction(len(configs))
+    with open(store.journal_path, "rb") as f:
+        assert f.read() == b""
+    assert ConfigFileStore(store.path).load() == configs
+
+
+def test_change_without_event_loop_is_written_at_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = ChannelConfig()
+    assert config.update_channel_config("1", "ask_context", 77)
+    assert not config._dirty
+    with open(config.file_store.journal_path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [{"id": "1", "config": {"ask_context": 77}}]
+    assert ChannelConfig().get_channel_config("1")["ask_context"] == 77
+
+
+def test_channel_changes_fold_the_journal_into_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = ChannelConfig()
+    config.file_store.min_compact_lines = 2
+    for value in range(10, 15):
+        config.update_channel_config("1", "ask_context", value)
+    # One channel never needs more than a couple of journal lines
+    assert config.file_store.journal_lines <= 2
+    with open(config.file_store.path, encoding="utf-8") as f:
+        assert json.load(f)["1"]["ask_context"] >= 12
+    assert ChannelConfig().get_channel_config("1")["ask_context"] == 14
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from models import embeddings
+from models.budget import model_price
+from models.embeddings import APIEmbedder, LocalEmbedder
+from models.scheduler import LLMScheduler
+
+
+def test_local_embeddings_are_deterministic_unit_vectors():
+    texts = ["Pizza night on Friday", "Кто идёт на пиццу в пятницу?"]
+    first = LocalEmbedder(dim=64).embed_batch(texts)
+    second = LocalEmbedder(dim=64).embed_batch(texts)
+    assert first.shape == (2, 64)
+    assert first.dtype == np.float32
+    assert np.array_equal(first, second)
+    assert np.allclose(np.linalg.norm(first, axis=1), 1)
+
+
+def test_shared_words_are_more_similar():
+    embedder = LocalEmbedder()
+    query, related, unrelated = embedder.embed_batch(
+        ["where do we order pizza", "the pizza order is at eight", "my train is late again"])
+    assert query @ related > query @ unrelated
+
+
+def test_numbers_and_empty_texts_embed_to_zero():
+    vectors = LocalEmbedder().embed_batch(["", "12 345 2024", "pizza 2024"])
+    assert not vectors[0].any()
+    assert not vectors[1].any()
+    assert np.array_equal(vectors[2], LocalEmbedder().embed_batch(["pizza"])[0])
+
+
+def test_embed_matches_embed_batch_when_offloaded():
+    embedder = LocalEmbedder()
+    texts = [f"message about topic {i % 7} and pizza" for i in range(100)]
+    assert np.array_equal(asyncio.run(embedder.embed(texts)), embedder.embed_batch(texts))
+
+
+def test_api_embeddings_go_through_the_scheduler_and_stats(monkeypatch):
+    llm_scheduler = LLMScheduler(max_concurrency=1)
+    calls = []
+    monkeypatch.setattr(embeddings, "llm_scheduler", llm_scheduler)
+    monkeypatch.setattr(embeddings, "request_stats", SimpleNamespace(
+        record_call=lambda chat_id, command, model, usage=None, error=False, cost=0.0: calls.append(
+            (chat_id, command, model, error, cost))))
+    active = []
+
+    async def create(model, input):
+        active.append(llm_scheduler.active)
+        if input == ["fail"]:
+            raise RuntimeError("down")
+        data = [SimpleNamespace(index=i, embedding=[1.0, float(i)]) for i in range(len(input))]
+        return SimpleNamespace(data=data, usage=SimpleNamespace(prompt_tokens=1_000_000, total_tokens=1_000_000))
+
+    embedder = APIEmbedder("test/embedder", batch_size=2)
+    embedder.client = SimpleNamespace(embeddings=SimpleNamespace(create=create))
+    vectors = asyncio.run(embedder.embed(["a", "b", "c"], chat_id="1"))
+    assert vectors.shape == (3, 2)
+    assert active == [1, 1]
+    prompt_price = model_price("test/embedder")[0]
+    assert calls == [("1", "ask", "test/embedder", False, prompt_price)] * 2
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(embedder.embed(["fail"], chat_id="1"))
+    assert calls[-1] == ("1", "ask", "test/embedder", True, 0.0)
+    assert llm_scheduler.active == 0
@@ -0,0 +1,28 @@
+import pytest
+
+from utils.metrics import Gauge, MetricsRegistry, _Metric, _SeriesMetric
+
+
+def test_render_counters_histograms_and_gauges():
+    registry = MetricsRegistry()
+    registry.counter("calls_total", "Calls", ["model"]).labels("a").inc(2)
+    registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)).observe(0.5)
+    registry.gauge("queued", "Queued", lambda: {("high",): 3}, ["priority"])
+    lines = registry.render().splitlines()
+    assert 'calls_total{model="a"} 2.0' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 0' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 1' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 1' in lines
+    assert 'queued{priority="high"} 3.0' in lines
+
+
+def test_gauge_has_no_series():
+    gauge = Gauge("queued", "Queued", lambda: 1)
+    assert not hasattr(gauge, "labels")
+
+
+def test_metric_bases_are_abstract():
+    with pytest.raises(TypeError):
+        _Metric("name", "help")
+    with pytest.raises(TypeError):
+        _SeriesMetric("name", "help")
@@ -0,0 +1,36 @@
+from models import prompt_builder
+from models.prompt_builder import MAX_MESSAGE_TOKENS, estimate_tokens, pack_messages, truncate_line
+
+MODEL = "google/gemini-2.0-flash-001"
+
+
+def test_oversized_line_dropped_at_cutoff_is_not_counted_as_compressed(monkeypatch):
+    long_line = "слово " * (MAX_MESSAGE_TOKENS * 2) + "\n"
+    short = ["@a: hi\n", "@b: hello there\n"]
+    budget = sum(truncate_line(line)[1] for line in short) + 10
+    monkeypatch.setattr(prompt_builder, "input_budget", lambda model, reserved, desired: budget)
+    packed = pack_messages([long_line] + short, MODEL, 0, 1024)
+    assert packed.text == "".join(short)
+    assert packed.dropped == 1
+    assert packed.compressed == 0
+
+
+def test_oversized_line_that_fits_is_counted_as_compressed(monkeypatch):
+    long_line = "слово " * (MAX_MESSAGE_TOKENS * 2) + "\n"
+    monkeypatch.setattr(prompt_builder, "input_budget", lambda model, reserved, desired: 10 * MAX_MESSAGE_TOKENS)
+    packed = pack_messages([long_line, "@a: hi\n"], MODEL, 0, 1024)
+    assert packed.included == 2
+    assert packed.compressed == 1
+    assert packed.text.startswith(truncate_line(long_line)[0])
+
+
+def test_truncated_multibyte_lines_stay_within_the_limit():
+    for char in ("a", "ж", "字", "😀"):
+        line = "@alice: " + char * (MAX_MESSAGE_TOKENS * 4) + "\n"
+        truncated, tokens, cut = truncate_line(line)
+        assert cut
+        assert tokens == estimate_tokens(truncated) <= MAX_MESSAGE_TOKENS
+        assert tokens > MAX_MESSAGE_TOKENS - 2
+        assert truncated.endswith("…\n")
+        # No character is split by the cut
+        assert set(truncated[8:-2]) == {char}
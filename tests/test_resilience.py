@@ -0,0 +1,131 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from models import resilience
+from models.resilience import (CLOSED, HALF_OPEN, OPEN, AllModelsFailed, CircuitBreaker, StreamInterrupted,
+                               call_with_fallback)
+
+
+def status_error(cls, status: int, message: str = "error", headers: dict = None):
+    request = httpx.Request("POST", "https://api.test/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return cls(message, response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(resilience.asyncio, "sleep", sleep)
+    return delays
+
+
+def scripted(outcomes: dict):
+    """A call that raises or returns the next scripted outcome for each model and logs the models it was given."""
+    calls = []
+
+    async def call(model):
+        calls.append(model)
+        outcome = outcomes[model].pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    return call, calls
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_half_open_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow() and breaker.state == HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    assert breaker.allow()
+    breaker.record_abandoned()
+    assert breaker.state == OPEN
+
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+
+
+def test_fallback_order_and_retries(fresh_breakers):
+    call, calls = scripted({
+        "a": [status_error(openai.InternalServerError, 500)] * 2,
+        "b": [openai.APITimeoutError(httpx.Request("POST", "https://api.test"))] * 2,
+        "c": ["ok"],
+    })
+    assert asyncio.run(call_with_fallback(["a", "b", "c"], call, attempts=2)) == "ok"
+    assert calls == ["a", "a", "b", "b", "c"]
+    # One backoff per model, none after its last attempt
+    assert len(fresh_breakers) == 2
+
+
+def test_open_breaker_is_skipped():
+    resilience._breakers["a"] = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    resilience._breakers["a"].record_failure()
+    call, calls = scripted({"b": ["ok"]})
+    assert asyncio.run(call_with_fallback(["a", "b"], call)) == "ok"
+    assert calls == ["b"]
+
+
+def test_retry_after_is_capped(fresh_breakers):
+    call, calls = scripted({"a": [status_error(openai.RateLimitError, 429, headers={"retry-after": "3600"}), "ok"]})
+    assert asyncio.run(call_with_fallback(["a"], call, max_retry_after=5.0)) == "ok"
+    assert fresh_breakers == [5.0]
+
+
+def test_missing_model_falls_back_without_retries():
+    call, calls = scripted({"a": [status_error(openai.NotFoundError, 404, "No such model")], "b": ["ok"]})
+    assert asyncio.run(call_with_fallback(["a", "b"], call)) == "ok"
+    assert calls == ["a", "b"]
+    assert resilience._breakers["a"].failures == 1
+
+
+def test_context_too_long_falls_back():
+    error = status_error(openai.BadRequestError, 400, "This model's maximum context length is 8192 tokens")
+    call, calls = scripted({"a": [error], "b": ["ok"]})
+    assert asyncio.run(call_with_fallback(["a", "b"], call)) == "ok"
+    assert calls == ["a", "b"]
+    assert resilience._breakers["a"].state == CLOSED
+
+
+def test_other_client_errors_are_raised():
+    call, calls = scripted({"a": [status_error(openai.AuthenticationError, 401, "Invalid key")], "b": ["ok"]})
+    with pytest.raises(openai.AuthenticationError):
+        asyncio.run(call_with_fallback(["a", "b"], call))
+    assert calls == ["a"]
+
+
+def test_every_model_failing():
+    call, calls = scripted({"a": [status_error(openai.NotFoundError, 404)], "b": [status_error(openai.NotFoundError, 404)]})
+    with pytest.raises(AllModelsFailed):
+        asyncio.run(call_with_fallback(["a", "b"], call))
+
+
+def test_interrupted_stream_is_a_failure():
+    call, calls = scripted({"a": [StreamInterrupted("connection reset")], "b": ["ok"]})
+    with pytest.raises(StreamInterrupted):
+        asyncio.run(call_with_fallback(["a", "b"], call))
+    assert calls == ["a"]
+    assert resilience._breakers["a"].failures == 1
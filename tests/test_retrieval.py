@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from models import retrieval
+from models.embeddings import LocalEmbedder
+from models.retrieval import ChatRetriever
+from utils.history import MessageRecord
+from utils.history_store import HistoryStore
+
+
+class CountingEmbedder(LocalEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.texts = []
+
+    async def embed(self, texts, chat_id=None):
+        self.texts.extend(texts)
+        return await super().embed(texts, chat_id)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = HistoryStore(db_file=str(tmp_path / "history.db"))
+    store.start()
+    monkeypatch.setattr(retrieval, "history_store", store)
+    yield store
+    store.close()
+
+
+def fill(store: HistoryStore, chat_id: str, records: list):
+    for record in records:
+        store.append(chat_id, record)
+    # Closing flushes the writer thread; the next append starts it again
+    store.close()
+
+
+def message(message_id: int, text=None, caption=None) -> MessageRecord:
+    return MessageRecord(message_id, 1700000000 + message_id, f"@user{message_id % 3}", text, caption=caption)
+
+
+def test_retrieve_finds_related_messages_oldest_first(store, tmp_path):
+    fill(store, "1", [
+        message(1, "who wants pizza tonight"),
+        message(2, "the train was late again"),
+        message(3, caption="pizza from the new place"),
+        message(4, "meeting moved to monday"),
+    ])
+    retriever = ChatRetriever(str(tmp_path / "vectors"), capacity=1000, max_chats=10, embedder=LocalEmbedder())
+    recent = [message(5, "pizza is here")]
+    found = asyncio.run(retriever.retrieve("1", "pizza", 3, recent))
+    assert [record.message_id for record in found] == [1, 3, 5]
+    # The in-memory record is returned as is, not reloaded
+    assert found[-1] is recent[0]
+
+
+def test_messages_without_text_are_not_reloaded(store, tmp_path, monkeypatch):
+    fill(store, "1", [message(1, "pizza tonight")] + [message(i) for i in range(2, 50)])
+    embedder = CountingEmbedder()
+    retriever = ChatRetriever(str(tmp_path / "vectors"), capacity=1000, max_chats=10, embedder=embedder)
+    asyncio.run(retriever.retrieve("1", "pizza", 3))
+    assert embedder.texts == ["pizza tonight", "pizza"]
+
+    cursors = []
+    load_after = store.load_after
+    monkeypatch.setattr(store, "load_after", lambda chat_id, message_id, limit: (
+        cursors.append(message_id) or load_after(chat_id, message_id, limit)))
+    found = asyncio.run(retriever.retrieve("1", "pizza", 3))
+    assert cursors == [49]
+    assert [record.message_id for record in found] == [1]
+    assert embedder.texts[2:] == ["pizza"]
+
+
+def test_closed_index_reopens_without_embedding_again(store, tmp_path):
+    fill(store, "1", [message(1, "pizza tonight"), message(2)])
+    fill(store, "2", [message(1, "train is late")])
+    embedder = CountingEmbedder()
+    retriever = ChatRetriever(str(tmp_path / "vectors"), capacity=1000, max_chats=1, embedder=embedder)
+    asyncio.run(retriever.retrieve("1", "pizza", 3))
+    asyncio.run(retriever.retrieve("2", "train", 3))
+    assert list(retriever._indexes) == ["2"]
+
+    del embedder.texts[:]
+    found = asyncio.run(retriever.retrieve("1", "pizza", 3))
+    assert [record.message_id for record in found] == [1]
+    assert embedder.texts == ["pizza"]
+    assert retriever._indexes["1"].processed_id == 2
+
+
+def test_question_of_stop_words_finds_nothing(store, tmp_path):
+    fill(store, "1", [message(1, "pizza tonight")])
+    retriever = ChatRetriever(str(tmp_path / "vectors"), capacity=1000, max_chats=10, embedder=LocalEmbedder())
+    assert asyncio.run(retriever.retrieve("1", "и в на", 3)) == []
+
+
+def test_chat_locks_are_dropped_after_queries(store, tmp_path):
+    fill(store, "1", [message(1, "pizza tonight")])
+    fill(store, "2", [message(1, "train is late")])
+    retriever = ChatRetriever(str(tmp_path / "vectors"), capacity=1000, max_chats=1, embedder=LocalEmbedder())
+
+    async def main():
+        # Queries of one chat share the lock while they overlap
+        return await asyncio.gather(retriever.retrieve("1", "pizza", 3), retriever.retrieve("1", "pizza", 3),
+                                    retriever.retrieve("2", "train", 3))
+
+    found = asyncio.run(main())
+    assert [[record.message_id for record in records] for records in found] == [[1], [1], [1]]
+    assert retriever._locks == {} and retriever._lock_users == {}
@@ -0,0 +1,132 @@
+import asyncio
+
+from models import scheduler
+from models.scheduler import PRIORITY_ASK, PRIORITY_BACKGROUND, PRIORITY_SUMMARY, LLMScheduler, TokenBucket
+
+MODEL = "test/model"
+
+
+def make_scheduler(max_concurrency: int) -> LLMScheduler:
+    llm = LLMScheduler(max_concurrency)
+    # No rate limit unless a test sets one
+    llm._buckets[MODEL] = TokenBucket(rate=1e6, capacity=1e6)
+    return llm
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def run_queued(llm: LLMScheduler, requests: list, order: list):
+    """Queue `requests` of (name, chat, priority) behind a held slot, then free it and wait for all."""
+    release = asyncio.Event()
+
+    async def hold():
+        async with llm.slot("holder", MODEL):
+            await release.wait()
+
+    async def call(name, chat_id, priority):
+        async with llm.slot(chat_id, MODEL, priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    holders = [asyncio.create_task(hold()) for _ in range(llm.max_concurrency)]
+    await settle()
+    tasks = []
+    for request in requests:
+        tasks.append(asyncio.create_task(call(*request)))
+        await settle()
+    release.set()
+    await asyncio.gather(*holders, *tasks)
+
+
+def test_priority_order():
+    llm = make_scheduler(max_concurrency=1)
+    order = []
+    asyncio.run(run_queued(llm, [
+        ("background", "a", PRIORITY_BACKGROUND),
+        ("summary", "b", PRIORITY_SUMMARY),
+        ("ask", "c", PRIORITY_ASK),
+    ], order))
+    assert order == ["ask", "summary", "background"]
+
+
+def test_busy_chat_does_not_starve_others():
+    llm = make_scheduler(max_concurrency=2)
+    order = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold(chat_id):
+            async with llm.slot(chat_id, MODEL):
+                await release.wait()
+
+        async def call(name, chat_id):
+            async with llm.slot(chat_id, MODEL):
+                order.append(name)
+
+        busy = asyncio.create_task(hold("busy"))
+        other = asyncio.create_task(hold("other"))
+        await settle()
+        tasks = [asyncio.create_task(call("busy 1", "busy")), asyncio.create_task(call("quiet", "quiet"))]
+        await settle()
+        # Freeing a slot while "busy" still runs a call hands it to the quiet chat first
+        other.cancel()
+        await settle()
+        release.set()
+        await asyncio.gather(busy, *tasks, return_exceptions=True)
+
+    asyncio.run(main())
+    assert order == ["quiet", "busy 1"]
+
+
+def test_concurrency_cap():
+    llm = make_scheduler(max_concurrency=3)
+    running = []
+    peak = []
+
+    async def call(i):
+        async with llm.slot(f"chat {i % 4}", MODEL):
+            running.append(i)
+            peak.append(len(running))
+            await asyncio.sleep(0.001)
+            running.remove(i)
+
+    async def main():
+        await asyncio.gather(*(call(i) for i in range(20)))
+
+    asyncio.run(main())
+    assert max(peak) == 3
+    assert llm.active == 0 and llm.queue_depth == 0
+
+
+def test_rate_limit_waits_follow_priority(monkeypatch):
+    llm = LLMScheduler(max_concurrency=1)
+    llm._buckets[MODEL] = TokenBucket(rate=1.0, capacity=1.0)
+    delays = {}
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay):
+        name = asyncio.current_task().get_name()
+        if delay:
+            delays[name] = delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(scheduler.asyncio, "sleep", sleep)
+
+    async def call(priority):
+        async with llm.slot("chat", MODEL, priority):
+            pass
+
+    async def main():
+        async with llm.slot("holder", MODEL):
+            low = asyncio.create_task(call(PRIORITY_BACKGROUND), name="low")
+            await settle()
+            high = asyncio.create_task(call(PRIORITY_ASK), name="high")
+            await settle()
+        await asyncio.gather(low, high)
+
+    asyncio.run(main())
+    assert delays["high"] < delays["low"]
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from handlers.selectors import EmptyRangeError, parse_selector
+from utils.tokenizer import terms
+
+NOW = datetime(2026, 5, 14, 10, 0)
+
+
+def at(hour: int, minute: int = 0, days: int = 0) -> float:
+    return (NOW.replace(hour=hour, minute=minute) + timedelta(days=days)).timestamp()
+
+
+def test_count():
+    selector = parse_selector(["200"], NOW)
+    assert selector.count == 200
+    assert not selector.filtered
+
+
+def test_duration_and_author():
+    selector = parse_selector(["last", "3h", "@Alice"], NOW)
+    assert selector.since == at(7)
+    assert selector.until is None
+    assert selector.author == "@alice"
+    assert selector.describe() == "from the last 3h by @Alice"
+
+
+def test_since_later_than_now_is_yesterday():
+    assert parse_selector(["since", "18:00"], NOW).since == at(18, days=-1)
+
+
+def test_until_after_since_is_the_same_day():
+    selector = parse_selector(["since", "09:00", "until", "09:30"], NOW)
+    assert (selector.since, selector.until) == (at(9), at(9, 30))
+
+
+def test_until_before_since_is_the_next_day():
+    # Since 22:00 yesterday until 02:00 today
+    selector = parse_selector(["since", "22:00", "until", "02:00"], NOW)
+    assert (selector.since, selector.until) == (at(22, days=-1), at(2))
+
+
+def test_until_in_the_future_is_now():
+    selector = parse_selector(["today", "до", "18:00"], NOW)
+    assert (selector.since, selector.until) == (at(0), NOW.timestamp())
+    selector = parse_selector(["since", "09:00", "until", "12:00"], NOW)
+    assert (selector.since, selector.until) == (at(9), NOW.timestamp())
+
+
+def test_until_without_start_is_today():
+    selector = parse_selector(["until", "08:00"], NOW)
+    assert (selector.since, selector.until) == (None, at(8))
+    assert parse_selector(["until", "12:00"], NOW).until == NOW.timestamp()
+
+
+def test_until_may_come_before_since():
+    selector = parse_selector(["until", "09:30", "since", "09:00"], NOW)
+    assert (selector.since, selector.until) == (at(9), at(9, 30))
+
+
+def test_empty_range_is_rejected():
+    # Starts now, so the end is clamped onto the start
+    with pytest.raises(EmptyRangeError):
+        parse_selector(["since", "10:00", "until", "10:00"], NOW)
+
+
+def test_keywords_must_be_marked():
+    selector = parse_selector(["about:пиццу", "«пицца", "вечером»"], NOW)
+    assert selector.words == terms("пиццу") + terms("пицца вечером")
+    assert selector.phrases == [tuple(terms("пицца вечером"))]
+    with pytest.raises(ValueError):
+        parse_selector(["пицца"], NOW)
+
+
+def test_bot_mention_is_ignored_and_nothing_selected_is_an_error():
+    assert parse_selector(["@Bot", "50"], NOW, ignore="@bot").count == 50
+    with pytest.raises(ValueError):
+        parse_selector(["@bot"], NOW, ignore="@bot")
+
+
+def test_invalid_time():
+    with pytest.raises(ValueError):
+        parse_selector(["since", "25:00"], NOW)
+
+
+def test_key_tells_selections_apart():
+    assert parse_selector(['"pizza night"'], NOW).key() != parse_selector(["about:pizza", "about:night"], NOW).key()
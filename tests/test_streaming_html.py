@@ -0,0 +1,45 @@
+from handlers.streaming import MAX_MESSAGE_LENGTH, StreamingReply
+from models.llm import sanitize_partial_html
+
+
+def test_bare_ampersand_is_kept():
+    text = "Tom & Jerry talked about <b>cats</b> and dogs"
+    assert sanitize_partial_html(text) == text
+
+
+def test_entity_cut_at_the_end_is_dropped():
+    assert sanitize_partial_html("Tom &amp; Jerry &am") == "Tom &amp; Jerry "
+    assert sanitize_partial_html("quote &#3") == "quote "
+    assert sanitize_partial_html("ends with &") == "ends with "
+
+
+def test_unfinished_tag_at_the_end_is_dropped():
+    assert sanitize_partial_html("<b>bold</b> and <i") == "<b>bold</b> and "
+    assert sanitize_partial_html('see <a href="http://x') == "see "
+
+
+def test_open_tags_are_closed_innermost_first():
+    assert sanitize_partial_html("<b>bold <i>both <u>all") == "<b>bold <i>both <u>all</u></i></b>"
+
+
+def test_repeated_tag_closes_the_inner_one():
+    assert sanitize_partial_html("<b>a <i>b <b>c</b> d") == "<b>a <i>b <b>c</b> d</i></b>"
+
+
+def test_misnested_close_closes_inner_tags_first():
+    assert sanitize_partial_html("<b>a <i>b</b> c</i>") == "<b>a <i>b</i></b> c"
+
+
+def test_disallowed_tags_are_removed():
+    assert sanitize_partial_html("<p>para <b>bold</b></p><br>") == "para <b>bold</b>"
+
+
+def test_long_reply_is_cut_without_losing_text_at_an_ampersand():
+    reply = StreamingReply(message=None, render=lambda text: text, parse_mode="HTML")
+    text = "<b>Tom & Jerry</b> " + "<i>word</i> " * 1000
+    fitted = reply._fit(text)
+    assert len(fitted) <= MAX_MESSAGE_LENGTH
+    assert fitted.startswith("<b>Tom & Jerry</b> ")
+    assert len(fitted) > MAX_MESSAGE_LENGTH - 100
+    assert fitted.count("<i>") == fitted.count("</i>")
+    assert fitted.endswith("…")
@@ -0,0 +1,70 @@
+import asyncio
+
+from models import llm
+from models.summary_cache import BLOCK_SIZE, BlockSummaryCache, block_key, config_fingerprint, split_blocks
+from utils.history import MessageRecord
+
+PROMPT = "Summarize"
+
+
+def make_messages(count: int) -> list:
+    return [MessageRecord(i, 1000.0 + i, "@alice", f"message {i}") for i in range(count)]
+
+
+def test_fingerprint_depends_on_model_prompt_and_temperature():
+    base = config_fingerprint("a", PROMPT, 0.3)
+    assert base == config_fingerprint("a", PROMPT, "0.3")
+    assert base != config_fingerprint("b", PROMPT, 0.3)
+    assert base != config_fingerprint("a", "Other", 0.3)
+    assert base != config_fingerprint("a", PROMPT, 0.7)
+
+
+def test_models_do_not_evict_each_other():
+    cache = BlockSummaryCache()
+    key = (1, 50, 99, 50)
+    main, cheap = config_fingerprint("main", PROMPT, 0.3), config_fingerprint("cheap", PROMPT, 0.3)
+    cache.put("chat", main, key, "by main")
+    cache.put("chat", cheap, key, "by cheap")
+    assert cache.get("chat", main, key) == "by main"
+    assert cache.get("chat", cheap, key) == "by cheap"
+    assert cache.get("chat", config_fingerprint("main", PROMPT, 0.7), key) is None
+
+
+def test_least_recently_used_blocks_are_evicted():
+    cache = BlockSummaryCache(max_blocks_per_chat=2)
+    fingerprint = config_fingerprint("main", PROMPT, 0.3)
+    cache.put("chat", fingerprint, (1,), "one")
+    cache.put("chat", fingerprint, (2,), "two")
+    assert cache.get("chat", fingerprint, (1,)) == "one"
+    cache.put("chat", fingerprint, (3,), "three")
+    assert cache.get("chat", fingerprint, (2,)) is None
+    assert cache.get("chat", fingerprint, (1,)) == "one"
+
+
+def test_blocks_are_cached_under_the_model_that_wrote_them(monkeypatch):
+    cache = BlockSummaryCache()
+    monkeypatch.setattr(llm, "summary_cache", cache)
+    calls = []
+
+    async def summarize_part_served(text, model, prompt, temp, chat_id=None, instruction=llm.PART_PROMPT):
+        calls.append(model)
+        # The requested model is down, a fallback answers
+        return f"summary by fallback of {len(text)}", "fallback"
+
+    monkeypatch.setattr(llm, "summarize_part_served", summarize_part_served)
+    messages = make_messages(4 * BLOCK_SIZE + 10)
+    blocks = split_blocks(messages)[1]
+
+    assert asyncio.run(llm.build_rolling_prompt(messages, "chat", "main", PROMPT, 0.3)) is not None
+    assert len(calls) == len(blocks)
+    for block in blocks:
+        assert cache.get("chat", config_fingerprint("main", PROMPT, 0.3), block_key(block)) is None
+        assert cache.get("chat", config_fingerprint("fallback", PROMPT, 0.3), block_key(block)) is not None
+
+    # The fallback's summaries are not served as the main model's, but are when the fallback is asked for
+    asyncio.run(llm.build_rolling_prompt(messages, "chat", "main", PROMPT, 0.3))
+    assert len(calls) == 2 * len(blocks)
+    asyncio.run(llm.build_rolling_prompt(messages, "chat", "fallback", PROMPT, 0.3))
+    assert len(calls) == 2 * len(blocks)
+    asyncio.run(llm.build_rolling_prompt(messages, "chat", "fallback", PROMPT, 0.7))
+    assert len(calls) == 3 * len(blocks)
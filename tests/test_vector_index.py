@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+
+from utils.vector_index import VectorIndex, normalize
+
+DIM = 32
+
+
+def clustered(count: int, clusters: int = 50, seed: int = 0) -> np.ndarray:
+    """Unit vectors around random centers, like embeddings of messages on a few topics."""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((clusters, DIM)))
+    rows = centers[rng.integers(clusters, size=count)] + 0.1 * rng.standard_normal((count, DIM))
+    return normalize(rows)
+
+
+def exact(vectors: np.ndarray, ids: np.ndarray, query: np.ndarray, k: int) -> list:
+    return [int(ids[row]) for row in np.argsort(-(vectors @ query), kind="stable")[:k]]
+
+
+def fill(index: VectorIndex, vectors: np.ndarray, first_id: int = 1, batch: int = 100):
+    for start in range(0, len(vectors), batch):
+        part = vectors[start:start + batch]
+        index.add(list(range(first_id + start, first_id + start + len(part))), part)
+
+
+def test_flat_search_matches_exact(tmp_path):
+    vectors = clustered(500)
+    index = VectorIndex(str(tmp_path / "chat"), "test", capacity=1000, ivf_min=10000)
+    fill(index, vectors)
+    ids = np.arange(1, 501)
+    for query in clustered(20, seed=1):
+        hits = index.search(query, 10)
+        assert [message_id for message_id, _ in hits] == exact(vectors, ids, query, 10)
+        assert [score for _, score in hits] == sorted((score for _, score in hits), reverse=True)
+
+
+def test_ivf_recall_against_exact(tmp_path):
+    vectors = clustered(6000)
+    index = VectorIndex(str(tmp_path / "chat"), "test", capacity=10000, ivf_min=2000, nprobe=8)
+    fill(index, vectors, batch=500)
+    assert index.centroids is not None
+    ids = np.arange(1, 6001)
+    queries = clustered(100, seed=2)
+
+    def recall():
+        return np.mean([
+            len({message_id for message_id, _ in index.search(query, 10)} & set(exact(vectors, ids, query, 10))) / 10
+            for query in queries
+        ])
+
+    assert recall() >= 0.9
+    # Probing every list leaves only the 8-bit pre-selection, which the exact re-scoring makes up for
+    index.nprobe = len(index.centroids)
+    assert recall() == 1.0
+
+
+def test_ivf_finds_vectors_added_after_training(tmp_path):
+    vectors = clustered(3000)
+    index = VectorIndex(str(tmp_path / "chat"), "test", capacity=10000, ivf_min=2000)
+    fill(index, vectors[:2000], batch=2000)
+    trained = index.trained_size
+    fill(index, vectors[2000:], first_id=2001)
+    assert index.trained_size == trained
+    for row in (2000, 2500, 2999):
+        assert index.search(vectors[row], 1)[0][0] == row + 1
+
+
+def test_eviction_keeps_newest_and_removes_old_generation(tmp_path):
+    path = str(tmp_path / "chat")
+    vectors = clustered(130)
+    index = VectorIndex(path, "test", capacity=100, ivf_min=10000)
+    fill(index, vectors, batch=10)
+    # Dropped back to capacity once past capacity + a quarter
+    assert index.generation == 1
+    assert 100 <= len(index) <= 125
+    assert list(index.ids) == list(range(131 - len(index), 131))
+    assert sorted(os.listdir(tmp_path)) == ["chat.1.ids", "chat.1.vec", "chat.json"]
+    assert index.search(vectors[0], 1)[0][0] != 1
+
+    reopened = VectorIndex(path, "test", capacity=100, ivf_min=10000)
+    reopened.load()
+    assert list(reopened.ids) == list(index.ids)
+    assert reopened.search(vectors[-1], 1)[0][0] == 130
+
+
+def test_load_truncates_partly_written_batch(tmp_path):
+    path = str(tmp_path / "chat")
+    vectors = clustered(60)
+    index = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    fill(index, vectors[:50], batch=25)
+    index.mark_processed(50)
+    # A crash in the middle of the next append: half its vectors, none of its ids
+    with open(f"{path}.0.vec", "ab") as f:
+        f.write(vectors[50:].tobytes()[:5 * DIM * 4 + 7])
+
+    reopened = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    reopened.load()
+    assert len(reopened) == 50
+    assert os.path.getsize(f"{path}.0.vec") == 50 * DIM * 4
+    assert reopened.processed_id == 50
+    assert reopened.search(vectors[49], 1)[0][0] == 50
+
+    # Appending after the cut lines vectors up with their ids again
+    reopened.add(list(range(51, 61)), vectors[50:])
+    again = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    again.load()
+    assert len(again) == 60
+    assert again.search(vectors[55], 1)[0][0] == 56
+
+
+def test_load_resets_cursor_when_ids_were_cut(tmp_path):
+    path = str(tmp_path / "chat")
+    vectors = clustered(20)
+    index = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    index.add(list(range(1, 11)), vectors[:10])
+    index.mark_processed(10)
+    # Ids of the next batch written, its vectors not
+    with open(f"{path}.0.ids", "ab") as f:
+        f.write(np.arange(11, 21, dtype=np.int64).tobytes())
+
+    reopened = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    reopened.load()
+    assert len(reopened) == 10
+    assert reopened.processed_id == 10
+
+
+def test_other_embedder_discards_files(tmp_path):
+    path = str(tmp_path / "chat")
+    index = VectorIndex(path, "old", capacity=1000, ivf_min=10000)
+    index.add([1, 2], clustered(2))
+    reopened = VectorIndex(path, "new", capacity=1000, ivf_min=10000)
+    reopened.load()
+    assert len(reopened) == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_processed_cursor_survives_reload(tmp_path):
+    path = str(tmp_path / "chat")
+    index = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    index.add([1, 2], clustered(2))
+    assert index.processed_id == 2
+    index.mark_processed(7)
+    reopened = VectorIndex(path, "test", capacity=1000, ivf_min=10000)
+    reopened.load()
+    assert reopened.last_message_id == 2
+    assert reopened.processed_id == 7